@@ -1,12 +1,17 @@
+import asyncio
 import logging
 import os
-from functools import lru_cache
 from typing import Any, TypeVar
 
+import openai
 from dotenv import load_dotenv
 from openai import AsyncOpenAI
 from pydantic import BaseModel
 
+from ratelimit import AdaptiveLimiter, RetryPolicy, retry_after_seconds
+from transport import ClientPool, TransportConfig
+from usage import UsageTracker
+
 load_dotenv()
 
 logger = logging.getLogger(__name__)
@@ -29,43 +34,118 @@ MODEL_PRICES: dict[str, dict[str, float]] = {
 
 T = TypeVar("T", bound=BaseModel)
 
+# Measured usage of every call in this process, see usage.py
+usage = UsageTracker(MODEL_PRICES)
 
-@lru_cache
-def _get_client() -> AsyncOpenAI:
-    """Get cached AsyncOpenAI client configured for OpenRouter."""
+# Shared by every call so the whole process backs off together when the provider throttles,
+# its ceiling is the run's concurrency (see configure_concurrency)
+limiter = AdaptiveLimiter()
+retry_policy = RetryPolicy()
+
+
+# pool size, keep-alive, HTTP/2, timeouts and streaming of the clients, see configure_transport
+transport = TransportConfig()
+
+
+def _new_client() -> AsyncOpenAI:
     api_key = os.environ.get("open_router_key")
     if not api_key:
         raise ValueError("open_router_key not found in environment")
-    return AsyncOpenAI(base_url=OPENROUTER_BASE_URL, api_key=api_key)
+    # open_router_base_url lets tests and load runs point at a local fake server
+    base_url = os.environ.get("open_router_base_url", OPENROUTER_BASE_URL)
+    # retries happen in responses(), where they also feed the adaptive limiter
+    return AsyncOpenAI(base_url=base_url, api_key=api_key, max_retries=0,
+                       http_client=transport.http_client() if transport is not None else None)
+
+
+# connections belong to the event loop that opened them, so each loop (and process) gets its own client
+clients = ClientPool(_new_client)
+
+
+def _get_client() -> AsyncOpenAI:
+    """Get the AsyncOpenAI client configured for OpenRouter for the running event loop."""
+    return clients.get()
+
 
+def configure_transport(config: TransportConfig | None) -> None:
+    """Use `config` for every client created from now on, None for the SDK's own HTTP defaults."""
+    global transport
+    transport = config
+    clients.clear()
 
-def _log_usage(response) -> None:
-    """Log token usage and cost extrapolation for 1M queries."""
-    usage = getattr(response, "usage", None)
-    if usage is None:
+
+def configure_concurrency(maximum: int) -> None:
+    """Let up to `maximum` calls be in flight, starting there; throttling backs the limit off as usual."""
+    if limiter.maximum != maximum:
+        limiter.resize(maximum, limit=maximum)
+
+
+async def _stream(client: AsyncOpenAI, **params):
+    # the same completion parse()/create() return, assembled from the chunks
+    async with client.chat.completions.stream(stream_options={"include_usage": True}, **params) as events:
+        return await events.get_final_completion()
+
+
+def _classify(error: Exception) -> str | None:
+    """"throttle" for overload signals, "error" for other transient failures, None if not worth retrying."""
+    if isinstance(error, (openai.RateLimitError, openai.APITimeoutError)):
+        return "throttle"
+    if isinstance(error, openai.APIStatusError):
+        if error.status_code in (503, 529):
+            return "throttle"
+        return "error" if error.status_code >= 500 else None
+    if isinstance(error, openai.APIConnectionError):
+        return "error"
+    return None
+
+
+async def _call_with_retries(call):
+    """
+    Run `call` under the adaptive limiter, retrying throttles and transient errors.
+
+    Backoff sleeps happen outside the limiter slot, and honour the provider's Retry-After.
+    """
+    attempt = 0
+    while True:
+        epoch = await limiter.acquire()
+        try:
+            response = await call()
+        except Exception as e:
+            outcome = _classify(e)
+            limiter.release(epoch, outcome or "error")
+            attempt += 1
+            if outcome is None or attempt >= retry_policy.max_attempts:
+                raise
+            http_response = getattr(e, "response", None)
+            delay = retry_policy.delay(attempt, retry_after_seconds(getattr(http_response, "headers", None)))
+            logger.warning(f"{type(e).__name__} (attempt {attempt}), retrying in {delay:.2f}s, "
+                           f"concurrency limit now {int(limiter.limit)}")
+            await asyncio.sleep(delay)
+        else:
+            limiter.release(epoch, "success")
+            return response
+
+
+def _log_usage(response, page: str | None = None) -> None:
+    """Record token usage in the run's UsageTracker and log cost extrapolation for 1M queries."""
+    usage_data = getattr(response, "usage", None)
+    if usage_data is None:
         logger.warning("No usage data in response")
         return
 
     model = getattr(response, "model", "unknown")
-    input_tokens = getattr(usage, "prompt_tokens", 0) or getattr(usage, "input_tokens", 0)
-    output_tokens = getattr(usage, "completion_tokens", 0) or getattr(usage, "output_tokens", 0)
+    input_tokens = getattr(usage_data, "prompt_tokens", 0) or getattr(usage_data, "input_tokens", 0)
+    output_tokens = getattr(usage_data, "completion_tokens", 0) or getattr(usage_data, "output_tokens", 0)
 
-    # Handle reasoning tokens (may be in output_tokens_details)
+    # Reasoning tokens are part of the output tokens (chat completions and responses API alike)
     reasoning_tokens = 0
-    output_details = getattr(usage, "output_tokens_details", None)
+    output_details = (getattr(usage_data, "completion_tokens_details", None)
+                      or getattr(usage_data, "output_tokens_details", None))
     if output_details:
         reasoning_tokens = getattr(output_details, "reasoning_tokens", 0) or 0
 
-    # Get prices (default to 0 if model unknown)
-    prices = MODEL_PRICES.get(model, {"input": 0, "output": 0})
-    input_price = prices["input"]
-    output_price = prices["output"]  # Also used for reasoning
-
-    # Calculate cost for this single query
-    single_input_cost = (input_tokens / 1_000_000) * input_price
-    single_output_cost = (output_tokens / 1_000_000) * output_price
-    single_reasoning_cost = (reasoning_tokens / 1_000_000) * output_price
-    single_total = single_input_cost + single_output_cost + single_reasoning_cost
+    # Cost for this single query, priced from MODEL_PRICES
+    single_total = usage.record(model, input_tokens, output_tokens, reasoning_tokens, page)
 
     # Extrapolate to 1M queries
     million_cost = single_total * 1_000_000
@@ -89,6 +169,8 @@ async def responses(
     Call OpenRouter chat completions API with automatic token usage logging.
 
     Uses OpenAI's beta.chat.completions.parse() for structured Pydantic output.
+    429s, overloads, 5xx and timeouts are retried with jittered backoff under the shared
+    adaptive concurrency limit (see _call_with_retries).
 
     @dev: The intention of this function is to be used as a wrapper around the OpenAI API,
     so the developer can view token usage and cost extrapolation of each query. If this
@@ -102,22 +184,28 @@ async def responses(
     else:
         messages = input
 
+    if transport is not None and transport.stream:
+        if text_format is not None:
+            kwargs["response_format"] = text_format
+        response = await _call_with_retries(lambda: _stream(client, model=model, messages=messages, **kwargs))
+        _log_usage(response)
+        return response.choices[0].message.parsed if text_format is not None else response
     if text_format is not None:
         # Use beta.chat.completions.parse() for Pydantic structured output
-        response = await client.beta.chat.completions.parse(
+        response = await _call_with_retries(lambda: client.beta.chat.completions.parse(
             model=model,
             messages=messages,
             response_format=text_format,
             **kwargs,
-        )
+        ))
         _log_usage(response)
         return response.choices[0].message.parsed
     else:
         # Use chat.completions.create() for regular responses
-        response = await client.chat.completions.create(
+        response = await _call_with_retries(lambda: client.chat.completions.create(
             model=model,
             messages=messages,
             **kwargs,
-        )
+        ))
         _log_usage(response)
         return response
@@ -0,0 +1,229 @@
+# Batch-API mode for extraction.
+# Instead of one chat completion per page, every extraction request for a folder goes into a JSONL
+# file that is uploaded as a provider batch job, polled until it finishes, and mapped back into
+# Products with the same post-processing as extract.main. Slower to come back, cheaper per token,
+# and no client-side concurrency or rate limiting to tune. Needs a provider exposing the
+# OpenAI-compatible /files and /batches endpoints (point open_router_base_url at it).
+import asyncio
+import json
+import os
+import tempfile
+
+from openai.types.chat import ChatCompletion
+
+import ai
+from extraction import MODEL, finalize_product
+from ingest import iter_pages
+from models import Product
+from output import NDJSONWriter, compact, rotated_segments
+from preprocess_pool import prepare_page
+from prompts import extract_prompt
+from structured import product_from_structured
+from wire import WIRE_FORMAT, expand
+
+ENDPOINT = "/v1/chat/completions"
+# providers cap a batch input file at 200 MB, stay a little under it
+MAX_INPUT_BYTES = 190 * 1024 * 1024
+# statuses after which a batch will not change any more
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+def request_line(name: str, processed: str) -> dict:
+    """One batch input line, the same request extract_product would send."""
+    return {
+        "custom_id": name,
+        "method": "POST",
+        "url": ENDPOINT,
+        "body": {
+            "model": MODEL,
+            "messages": [
+                {"role": "system", "content": extract_prompt},
+                {"role": "user", "content": processed},
+            ],
+            "response_format": WIRE_FORMAT,
+        },
+    }
+
+
+def parse_result_line(line: str) -> tuple[str, Product | Exception]:
+    """Map one batch output line back to (custom_id, finalized Product or the error)."""
+    result = json.loads(line)
+    name = result["custom_id"]
+    try:
+        if result.get("error"):
+            raise RuntimeError(result["error"].get("message", result["error"]))
+        response = result["response"]
+        if response["status_code"] != 200:
+            raise RuntimeError(f"status {response['status_code']}: {response['body']}")
+        completion = ChatCompletion.model_validate(response["body"])
+        ai._log_usage(completion, page=name)
+        ai.usage.page_done(name)
+        product = Product.model_validate(expand(json.loads(completion.choices[0].message.content)))
+        return name, finalize_product(product)
+    except Exception as e:
+        return name, e
+
+
+def save_state(state: dict, state_path: str) -> None:
+    # replaced in one step, a crash mid-write never leaves a truncated state file
+    with open(state_path + ".tmp", "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(state_path + ".tmp", state_path)
+
+
+async def submit(data_folder: str = "data", state_path: str = "batch_jobs.json",
+                 output_path: str = "products.ndjson", max_requests: int = 50_000,
+                 fast_path: bool = True, boilerplate: str | None = None,
+                 max_bytes: int = MAX_INPUT_BYTES) -> dict:
+    """
+    Write the batch input files for a folder, upload them and start the jobs.
+
+    Pages the JSON-LD fast path can serve are written to the NDJSON output right away and never
+    enter the batch. The rest are split into jobs of at most `max_requests` lines and `max_bytes`
+    bytes, each spooled to a temporary file rather than held in memory. Job ids go to
+    `state_path` as each job starts, so a later `collect` (possibly from another process) can pick
+    them up, including the jobs already running when a later upload fails.
+    """
+    client = ai._get_client()
+    for stale in rotated_segments(output_path) + [output_path]:
+        if os.path.exists(stale):
+            os.remove(stale)
+    state = {"jobs": [], "structured": 0, "preprocess_failed": {}}
+    spool = tempfile.TemporaryFile()
+    requests = 0
+
+    async def flush():
+        nonlocal spool, requests
+        spool.seek(0)
+        uploaded = await client.files.create(file=(f"extract-{len(state['jobs'])}.jsonl", spool), purpose="batch")
+        job = await client.batches.create(input_file_id=uploaded.id, endpoint=ENDPOINT, completion_window="24h")
+        state["jobs"].append({"id": job.id, "input_file_id": uploaded.id, "requests": requests})
+        #the job is billed from here on, its id must not only live in memory
+        save_state(state, state_path)
+        spool.close()
+        spool = tempfile.TemporaryFile()
+        requests = 0
+
+    try:
+        with NDJSONWriter(output_path) as writer:
+            for name, html in iter_pages(data_folder):
+                try:
+                    page = prepare_page(html, boilerplate=boilerplate)
+                except Exception as e:
+                    state["preprocess_failed"][name] = str(e)
+                    continue
+                product = product_from_structured(page.jsonld, page.meta) if fast_path else None
+                if product is not None:
+                    writer.write(finalize_product(product))
+                    state["structured"] += 1
+                    continue
+                line = (json.dumps(request_line(name, page.processed)) + "\n").encode("utf-8")
+                if requests and (requests >= max_requests or spool.tell() + len(line) > max_bytes):
+                    await flush()
+                spool.write(line)
+                requests += 1
+        if requests:
+            await flush()
+    finally:
+        spool.close()
+    save_state(state, state_path)
+    return state
+
+
+async def wait(state: dict, poll_interval: float = 60) -> dict:
+    """Poll every job until it reaches a terminal status, recording status and output file ids in state."""
+    client = ai._get_client()
+    while True:
+        for job in state["jobs"]:
+            if job.get("status") in TERMINAL_STATUSES:
+                continue
+            batch = await client.batches.retrieve(job["id"])
+            job.update(status=batch.status, output_file_id=batch.output_file_id, error_file_id=batch.error_file_id)
+        if all(job.get("status") in TERMINAL_STATUSES for job in state["jobs"]):
+            return state
+        await asyncio.sleep(poll_interval)
+
+
+async def collect(state_path: str = "batch_jobs.json", output_path: str = "products.ndjson",
+                  poll_interval: float = 60) -> dict[str, int | dict]:
+    """
+    Wait for the submitted jobs, append their products to the NDJSON output and compact it.
+
+    Returns counts plus a {page: error} map of every page that did not produce a Product.
+    """
+    client = ai._get_client()
+    with open(state_path) as f:
+        state = json.load(f)
+    await wait(state, poll_interval)
+    save_state(state, state_path)
+
+    failed = dict(state["preprocess_failed"])
+    products = 0
+    with NDJSONWriter(output_path) as writer:
+        for job in state["jobs"]:
+            for file_id in (job.get("output_file_id"), job.get("error_file_id")):
+                if not file_id:
+                    continue
+                content = await client.files.content(file_id)
+                for line in content.text.splitlines():
+                    if not line.strip():
+                        continue
+                    name, product = parse_result_line(line)
+                    if isinstance(product, Exception):
+                        failed[name] = str(product)
+                        continue
+                    writer.write(product)
+                    products += 1
+            if job["status"] != "completed":
+                failed[job["id"]] = f"batch {job['status']}"
+    frontend_path = os.path.join("frontend", "src", "data", "products.json")
+    total = compact(output_path, ["products.json", frontend_path])
+    return {"batched": products, "structured": state["structured"], "total": total, "failed": failed}
+
+
+async def run(data_folder: str = "data", state_path: str = "batch_jobs.json", output_path: str = "products.ndjson",
+              max_requests: int = 50_000, fast_path: bool = True, poll_interval: float = 60,
+              boilerplate: str | None = None, max_bytes: int = MAX_INPUT_BYTES) -> dict:
+    await submit(data_folder, state_path, output_path, max_requests, fast_path, boilerplate, max_bytes)
+    return await collect(state_path, output_path, poll_interval)
+
+
+def report(stats: dict) -> None:
+    for name, error in stats["failed"].items():
+        print(f"fail on {name}: {error}")
+    ai.usage.print_report()
+    print(f"Wrote {stats['total']} products ({stats['batched']} from the batch, "
+          f"{stats['structured']} from structured data) to products.json")
+
+
+if __name__ == "__main__":
+    import argparse
+    import logging
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    parser = argparse.ArgumentParser(description="Extract products through the provider batch API")
+    parser.add_argument("command", choices=["submit", "collect", "run"],
+                        help="submit jobs and exit, collect previously submitted jobs, or both")
+    parser.add_argument("--data", default="data", help="folder of .html pages or a crawl archive")
+    parser.add_argument("--state", default="batch_jobs.json", help="where submitted job ids are kept")
+    parser.add_argument("--output", default="products.ndjson", help="NDJSON file products are appended to")
+    parser.add_argument("--max-requests", type=int, default=50_000, help="requests per batch job")
+    parser.add_argument("--max-mb", type=float, default=MAX_INPUT_BYTES / 2**20,
+                        help="size limit of a batch job's input file, in MiB")
+    parser.add_argument("--poll", type=float, default=60, help="seconds between status polls")
+    parser.add_argument("--no-fast-path", action="store_true", help="send every page to the batch")
+    parser.add_argument("--boilerplate", default="boilerplate.json",
+                        help="per-domain boilerplate model from boilerplate.py, used when the file exists")
+    args = parser.parse_args()
+    boilerplate = args.boilerplate if os.path.exists(args.boilerplate) else None
+
+    if args.command == "submit":
+        state = asyncio.run(submit(args.data, args.state, args.output, args.max_requests, not args.no_fast_path,
+                                   boilerplate, int(args.max_mb * 2**20)))
+        print(f"Submitted {sum(job['requests'] for job in state['jobs'])} requests in {len(state['jobs'])} jobs, "
+              f"{state['structured']} pages served from structured data. Job ids in {args.state}")
+    elif args.command == "collect":
+        report(asyncio.run(collect(args.state, args.output, args.poll)))
+    else:
+        report(asyncio.run(run(args.data, args.state, args.output, args.max_requests,
+                               not args.no_fast_path, args.poll, boilerplate, int(args.max_mb * 2**20))))
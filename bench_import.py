@@ -0,0 +1,60 @@
+# Cold-start benchmark for short-lived worker processes: what does `import models` and the first
+# category validation cost in a fresh interpreter? Each measurement runs in its own subprocess.
+import argparse
+import re
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+import taxonomy
+
+HERE = Path(__file__).parent
+
+
+def importtime_ms(module: str) -> float:
+    # self time in ms reported by `python -X importtime` for the module, dependencies excluded
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                         cwd=HERE, capture_output=True, text=True, check=True).stderr
+    for line in out.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+\d+ \|\s+(\S+)$", line.strip())
+        if match and match.group(2) == module:
+            return int(match.group(1)) / 1000
+    raise RuntimeError(f"{module} not in importtime output")
+
+
+def snippet_ms(setup: str, code: str) -> float:
+    # wall time of `code` inside a fresh interpreter after `setup` ran, measured by the child itself
+    timed = f"{setup}\nimport time\nstart = time.perf_counter()\n{code}\nprint((time.perf_counter() - start) * 1000)"
+    out = subprocess.run([sys.executable, "-c", timed], cwd=HERE, capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def median(fn, repeat: int) -> float:
+    return statistics.median(fn() for _ in range(repeat))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure taxonomy cold start in fresh processes")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    validate = "models.Category(name='Furniture > Chair')"
+    # compiled=None makes get_index() parse categories.txt and build the index from scratch
+    no_compiled = "import models, taxonomy\ntaxonomy.load_index.__defaults__ = (taxonomy.CATEGORIES_FILE, None)"
+    taxonomy.get_index()  # make sure the compiled file is fresh
+    rows = [
+        # what every process paid during `import models` before lazy loading
+        ("eager categories.txt parse (old import)", median(
+            lambda: snippet_ms("import taxonomy", "taxonomy.read_categories()"), args.repeat)),
+        ("import models, self time (now)", median(lambda: importtime_ms("models"), args.repeat)),
+        ("first validation, from categories.txt", median(
+            lambda: snippet_ms(no_compiled, validate), args.repeat)),
+        ("first validation, from compiled file", median(
+            lambda: snippet_ms("import models", validate), args.repeat)),
+    ]
+    print("=" * 56)
+    print(f"{'Cold start (median of ' + str(args.repeat) + ')':<44} {'ms':>8}")
+    print("=" * 56)
+    for label, ms in rows:
+        print(f"{label:<44} {ms:>8.1f}")
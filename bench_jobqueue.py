@@ -0,0 +1,72 @@
+# Load test for the job queue: pages/sec with 1..N worker processes against the fake model server
+import argparse
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from jobqueue import SQLiteJobQueue, run_workers
+
+
+def synthetic_pages(n: int, words: int):
+    # small distinct pages, so the run measures workers and calls rather than parsing
+    for i in range(n):
+        text = " ".join(f"word{(i * 7 + j) % 997}" for j in range(words))
+        yield f"https://shop.example/p/{i}", None, f"<html><body><h1>Product {i}</h1><p>{text}</p></body></html>"
+
+
+def start_server(latency: float) -> tuple[subprocess.Popen, str]:
+    # the fake server runs in its own process so it doesn't share a GIL with any worker
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    server = subprocess.Popen([sys.executable, "fake_openrouter.py", "--port", str(port), "--latency", str(latency)],
+                              stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            break
+        except OSError:
+            time.sleep(0.1)
+    return server, f"http://127.0.0.1:{port}/api/v1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Job queue throughput at several worker counts")
+    parser.add_argument("--workers", default="1,2,4,8")
+    parser.add_argument("--pages-per-worker", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=4, help="LLM calls in flight per worker")
+    parser.add_argument("--latency", type=float, default=1.0, help="fake server seconds per request")
+    parser.add_argument("--words", type=int, default=200)
+    args = parser.parse_args()
+
+    server, base_url = start_server(args.latency)
+    # spawned workers inherit the environment
+    os.environ["open_router_key"] = "fake"
+    os.environ["open_router_base_url"] = base_url
+    folder = tempfile.mkdtemp()
+    levels = [int(level) for level in args.workers.split(",")]
+    ideal = args.concurrency / args.latency
+    print(f"{os.cpu_count()} CPUs, {args.concurrency} calls in flight per worker, {args.latency}s per call "
+          f"(ideal {ideal:.1f} pages/s per worker)")
+    print(f"{'workers':>8} {'pages':>7} {'done':>6} {'pages/s':>9} {'speedup':>8} {'vs linear':>10}")
+    try:
+        base = None
+        for workers in levels:
+            path = os.path.join(folder, f"jobs-{workers}.sqlite")
+            queue = SQLiteJobQueue(path)
+            pages = workers * args.pages_per_worker
+            queue.enqueue(synthetic_pages(pages, args.words))
+            run_workers(path, workers, args.concurrency, fast_path=False)
+            # timed from the first lease to the last ack, process startup is not part of the rate
+            rate = queue.counts()["done"] / queue.span()
+            base = base or rate / workers
+            print(f"{workers:>8} {pages:>7} {queue.counts()['done']:>6} {rate:>9.1f} {rate / base:>7.2f}x "
+                  f"{rate / (base * workers):>10.0%}")
+            queue.close()
+    finally:
+        server.terminate()
+        shutil.rmtree(folder, ignore_errors=True)
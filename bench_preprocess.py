@@ -0,0 +1,81 @@
+# Benchmark for the preprocessing engines: per-page latency and peak memory on data/*.html
+import argparse
+import os
+import statistics
+import time
+import tracemalloc
+
+from preprocess import preprocess_html, preprocess_html_fast, preprocess_html_lazy
+
+ENGINES = {
+    "legacy": preprocess_html,
+    "single-pass": preprocess_html_fast,
+    "lazy": preprocess_html_lazy,
+}
+
+
+def time_engine(fn, html: str, repeat: int) -> float:
+    # median seconds per call
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(html)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def inflate(html: str, copies: int) -> str:
+    # a multi-megabyte page: the body repeated, like a long listing of reviews or related products
+    body = html.find(">", html.find("<body")) + 1
+    end = html.rfind("</body>")
+    if body <= 0 or end < body:
+        return html
+    return html[:end] + html[body:end] * copies + html[end:]
+
+
+def peak_memory(fn, html: str) -> int:
+    tracemalloc.start()
+    try:
+        fn(html)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare preprocessing engines on data/*.html")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--engines", nargs="+", default=list(ENGINES), choices=list(ENGINES))
+    parser.add_argument("--inflate", type=int, default=0, help="also time each page with its body repeated N more times")
+    args = parser.parse_args()
+
+    baseline = args.engines[0]
+    print("=" * 78)
+    print(f"{'File':<18} {'Engine':<14} {'ms/page':>10} {'peak MB':>10} {'speedup':>9} {'identical':>10}")
+    print("=" * 78)
+    totals = {name: [0.0, 0] for name in args.engines}
+    pages = []
+    for filename in sorted(os.listdir("data")):
+        if not filename.endswith(".html"):
+            continue
+        with open(os.path.join("data", filename), "r", encoding="utf-8") as f:
+            pages.append((filename, f.read()))
+    if args.inflate:
+        pages += [(f"{filename} x{args.inflate + 1}", inflate(html, args.inflate)) for filename, html in pages]
+    for filename, html in pages:
+        reference = ENGINES[baseline](html)
+        base_time = None
+        for name in args.engines:
+            fn = ENGINES[name]
+            seconds = time_engine(fn, html, args.repeat)
+            peak = peak_memory(fn, html)
+            base_time = base_time or seconds
+            totals[name][0] += seconds
+            totals[name][1] = max(totals[name][1], peak)
+            identical = "yes" if fn(html) == reference else "NO"
+            print(f"{filename:<18} {name:<14} {seconds * 1000:>10.1f} {peak / 1e6:>10.1f} "
+                  f"{base_time / seconds:>8.2f}x {identical:>10}")
+    print("=" * 78)
+    base_total = totals[baseline][0]
+    for name, (seconds, peak) in totals.items():
+        print(f"{'TOTAL':<18} {name:<14} {seconds * 1000:>10.1f} {peak / 1e6:>10.1f} {base_total / seconds:>8.2f}x")
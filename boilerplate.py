@@ -0,0 +1,178 @@
+# Per-domain boilerplate model.
+# Menus, footers and cookie banners are the same text on every page of a retailer, and they eat
+# the 10,000 character budget before the product text starts. Learning them is simple frequency
+# counting: sample pages per domain, and any text line that shows up on most of them is template,
+# not product. Only blocks of such lines are learned, not lone ones: a size label, a colour name or
+# "Add to cart" repeats across a retailer's product pages too, and it is product data. The model is
+# persisted as JSON so a crawl learns once and every worker reuses it.
+import json
+import os
+from collections import Counter
+from functools import lru_cache
+from urllib.parse import urlparse
+
+MODEL_FILE = "boilerplate.json"
+MODEL_VERSION = 2
+
+
+def _urls(jsonld) -> list[str]:
+    urls = []
+    for item in jsonld if isinstance(jsonld, list) else [jsonld]:
+        if isinstance(item, list):
+            urls.extend(_urls(item))
+        elif isinstance(item, dict):
+            for key in ("url", "@id"):
+                if isinstance(item.get(key), str):
+                    urls.append(item[key])
+            if "@graph" in item:
+                urls.extend(_urls(item["@graph"]))
+    return urls
+
+
+def page_domain(jsonld: list, meta: dict) -> str | None:
+    """The site a page belongs to, from og:url or the JSON-LD urls, without a leading www."""
+    for url in [meta.get("og:url"), meta.get("twitter:url"), *_urls(jsonld)]:
+        if url and (host := urlparse(url).hostname):
+            return host.removeprefix("www.")
+    return None
+
+
+class BoilerplateModel:
+    """
+    {domain: lines} of text lines shared by most sampled pages of that domain.
+
+    threshold: fraction of a domain's sampled pages a line must appear on to count as boilerplate
+    min_pages: domains with fewer sampled pages are not learned, one page has nothing to compare to
+    min_run_chars: shared lines are learned only where they form a run of consecutive shared lines
+    at least this long (in characters), on enough pages to meet the threshold
+    """
+
+    def __init__(self, threshold: float = 0.6, min_pages: int = 3, min_run_chars: int = 60):
+        self.threshold = threshold
+        self.min_pages = min_pages
+        self.min_run_chars = min_run_chars
+        self.domains: dict[str, frozenset[str]] = {}
+        self.pages: dict[str, int] = {}
+
+    def learn(self, domain: str, texts: list[str]) -> int:
+        """(Re)learn a domain from the clean text of a sample of its pages, returning the line count."""
+        if len(texts) < self.min_pages:
+            return 0
+        pages = [[line for line in text.split("\n") if line] for text in texts]
+        counts = Counter()
+        for lines in pages:
+            counts.update(set(lines))
+        needed = max(2, self.threshold * len(texts))
+        shared = {line for line, count in counts.items() if count >= needed}
+        # second pass: which shared lines sit in a long enough block of shared lines, page by page
+        in_runs = Counter()
+        for lines in pages:
+            learned, run = set(), []
+            for line in lines + [None]:
+                if line in shared:
+                    run.append(line)
+                    continue
+                if sum(map(len, run)) >= self.min_run_chars:
+                    learned.update(run)
+                run = []
+            in_runs.update(learned)
+        self.domains[domain] = frozenset(line for line, count in in_runs.items() if count >= needed)
+        self.pages[domain] = len(texts)
+        return len(self.domains[domain])
+
+    def lines(self, domain: str | None) -> frozenset[str]:
+        return self.domains.get(domain, frozenset()) if domain else frozenset()
+
+    def strip(self, domain: str | None, text: str) -> str:
+        return strip_lines(text, self.lines(domain), self.min_run_chars)
+
+    def save(self, path: str = MODEL_FILE) -> None:
+        data = {"version": MODEL_VERSION, "threshold": self.threshold, "min_pages": self.min_pages,
+                "min_run_chars": self.min_run_chars,
+                "domains": {d: {"pages": self.pages[d], "lines": sorted(lines)} for d, lines in self.domains.items()}}
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str = MODEL_FILE) -> "BoilerplateModel":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != MODEL_VERSION:
+            raise ValueError(f"{path} was written by a different boilerplate model version")
+        model = cls(data["threshold"], data["min_pages"], data["min_run_chars"])
+        for domain, entry in data["domains"].items():
+            model.domains[domain] = frozenset(entry["lines"])
+            model.pages[domain] = entry["pages"]
+        return model
+
+
+def strip_lines(text: str, lines: frozenset[str], min_run_chars: int = 0) -> str:
+    """
+    Drop runs of learned lines at least min_run_chars long, the rule learn() uses.
+
+    A learned line on its own (a "Black" or "Running" that is also a menu entry) is product text
+    and stays. Blank lines neither end a run nor count towards it.
+    """
+    if not lines:
+        return text
+    kept, run = [], []
+    for line in text.split("\n") + [None]:
+        if line is not None and (line in lines or not line and run):
+            run.append(line)
+            continue
+        if sum(map(len, run)) < min_run_chars:
+            kept.extend(run)
+        run = []
+        if line is not None:
+            kept.append(line)
+    return "\n".join(kept)
+
+
+@lru_cache(maxsize=4)
+def load_model(path: str) -> BoilerplateModel:
+    # cached so each preprocessing worker process reads the file once
+    return BoilerplateModel.load(path)
+
+
+def learn_from_pages(pages, sample: int = 200, threshold: float = 0.6, min_pages: int = 3,
+                     min_run_chars: int = 60) -> BoilerplateModel:
+    """Build a model from (name, html) pages, using at most `sample` pages per domain."""
+    from bs4 import BeautifulSoup
+
+    from preprocess import scan_html
+
+    texts: dict[str, list[str]] = {}
+    for _, html in pages:
+        jsonld, meta, text = scan_html(BeautifulSoup(html, "html.parser"))
+        domain = page_domain(jsonld, meta)
+        if domain and len(texts.setdefault(domain, [])) < sample:
+            texts[domain].append(text)
+    model = BoilerplateModel(threshold, min_pages, min_run_chars)
+    for domain, domain_texts in texts.items():
+        model.learn(domain, domain_texts)
+    return model
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from ingest import iter_pages
+
+    parser = argparse.ArgumentParser(description="Learn per-domain boilerplate text from a folder of pages")
+    parser.add_argument("--data", default="data", help="folder of .html pages or a crawl archive")
+    parser.add_argument("--out", default=MODEL_FILE)
+    parser.add_argument("--sample", type=int, default=200, help="pages sampled per domain")
+    parser.add_argument("--threshold", type=float, default=0.6, help="share of pages a line must be on")
+    parser.add_argument("--min-pages", type=int, default=3, help="smallest sample a domain is learned from")
+    parser.add_argument("--min-run-chars", type=int, default=60,
+                        help="shortest block of consecutive shared lines that is learned")
+    args = parser.parse_args()
+
+    model = learn_from_pages(iter_pages(args.data), args.sample, args.threshold, args.min_pages, args.min_run_chars)
+    model.save(args.out)
+    print(f"{'Domain':<32} {'Pages':>7} {'Lines':>7} {'Chars':>9}")
+    for domain, lines in sorted(model.domains.items()):
+        print(f"{domain:<32} {model.pages[domain]:>7} {len(lines):>7} {sum(map(len, lines)):>9,}")
+    print(f"Wrote {len(model.domains)} domains to {args.out}")
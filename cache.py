@@ -0,0 +1,114 @@
+# Persistent content-addressed cache of extracted products.
+# Recrawled pages that preprocess to the same text (with the same model and prompt) skip the LLM.
+# The cache is only ever an optimization: several worker processes share one file (jobqueue.py),
+# and a lookup or write that still fails on a locked database counts as a miss, never as a failed
+# page whose paid-for LLM answer would be thrown away.
+import hashlib
+import logging
+import sqlite3
+import time
+
+from models import Product
+
+logger = logging.getLogger(__name__)
+
+
+class ExtractionCache:
+    """
+    SQLite cache of parsed Product JSON keyed on sha256(model, prompt, preprocessed text).
+
+    max_age: seconds before an entry expires (None keeps entries forever)
+    max_entries: least recently used entries beyond this are evicted (None for no limit)
+    timeout: seconds to wait on another process's write lock before giving up on a read or write
+    Hit/miss counts and the tokens the hits saved are kept on the instance for the run report.
+    """
+
+    EVICT_EVERY = 100
+
+    def __init__(self, path: str = "extract_cache.sqlite", max_age: float | None = 30 * 86400,
+                 max_entries: int | None = 1_000_000, timeout: float = 60.0):
+        self.path = path
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.saved_input_tokens = 0
+        self.saved_output_tokens = 0
+        self._puts = 0
+        self.db = sqlite3.connect(path, timeout=timeout)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS products ("
+            " key TEXT PRIMARY KEY, product TEXT NOT NULL,"
+            " input_tokens INTEGER NOT NULL, output_tokens INTEGER NOT NULL,"
+            " created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS products_accessed ON products (accessed)")
+        self.evict()
+
+    @staticmethod
+    def key(processed: str, model: str, prompt: str) -> str:
+        digest = hashlib.sha256()
+        for part in (model, prompt, processed):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Product | None:
+        now = time.time()
+        try:
+            row = self.db.execute(
+                "SELECT product, input_tokens, output_tokens, created FROM products WHERE key = ?", (key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning("cache read failed, treated as a miss: %s", e)
+            row = None
+        if row is None or (self.max_age is not None and row[3] < now - self.max_age):
+            self.misses += 1
+            return None
+        # recency only steers eviction, losing one update to a busy database is fine
+        self._write("UPDATE products SET accessed = ? WHERE key = ?", (now, key))
+        self.hits += 1
+        self.saved_input_tokens += row[1]
+        self.saved_output_tokens += row[2]
+        return Product.model_validate_json(row[0])
+
+    def put(self, key: str, product: Product, input_tokens: int, output_tokens: int) -> None:
+        now = time.time()
+        if not self._write("INSERT OR REPLACE INTO products VALUES (?, ?, ?, ?, ?, ?)",
+                           (key, product.model_dump_json(), input_tokens, output_tokens, now, now)):
+            return
+        self._puts += 1
+        if self._puts % self.EVICT_EVERY == 0:
+            try:
+                self.evict()
+            except sqlite3.Error as e:
+                self.db.rollback()
+                logger.warning("cache eviction skipped: %s", e)
+
+    def _write(self, sql: str, params: tuple) -> bool:
+        try:
+            self.db.execute(sql, params)
+            self.db.commit()
+            return True
+        except sqlite3.Error as e:
+            self.db.rollback()
+            logger.warning("cache write skipped: %s", e)
+            return False
+
+    def evict(self) -> None:
+        if self.max_age is not None:
+            self.db.execute("DELETE FROM products WHERE created < ?", (time.time() - self.max_age,))
+        if self.max_entries is not None:
+            self.db.execute(
+                "DELETE FROM products WHERE key IN ("
+                " SELECT key FROM products ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+        self.db.commit()
+
+    def __len__(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+
+    def close(self) -> None:
+        self.db.close()
@@ -0,0 +1,82 @@
+# Model cascade: cheap model first, stronger models only for the pages it gets wrong.
+# Most pages are easy and the cheapest model in MODEL_PRICES handles them. A product that fails
+# to parse or validate (an unresolvable category is a validation error), or that fails the cheap
+# sanity checks below, is re-extracted by the next model up. Median latency and cost stay at the
+# cheap tier and only the tail pays for the stronger models.
+import openai
+
+import ai
+from cache import ExtractionCache
+from extraction import extract_product
+from models import Product
+
+DEFAULT_CASCADE = ["google/gemini-2.0-flash-lite-001", "google/gemini-2.5-flash-lite", "google/gemini-3-flash-preview"]
+# prompt/completion tokens of a typical page, used to order models by what a page costs on them
+TYPICAL_PAGE_TOKENS = (2_000, 150)
+
+
+def cascade_models(models: list[str]) -> list[str]:
+    """Validate the tiers against MODEL_PRICES and order them cheapest first."""
+    unknown = [m for m in models if m not in ai.MODEL_PRICES]
+    if unknown:
+        raise ValueError(f"no price in MODEL_PRICES for {', '.join(unknown)}, can't place it in the cascade")
+    prompt, completion = TYPICAL_PAGE_TOKENS
+
+    def page_cost(model: str) -> float:
+        prices = ai.MODEL_PRICES[model]
+        return prompt * prices["input"] + completion * prices["output"]
+
+    return sorted(dict.fromkeys(models), key=page_cost)
+
+
+def check_product(product: Product) -> list[str]:
+    """Names of the sanity checks a product fails, empty when it looks right."""
+    failed = []
+    if not product.name.strip():
+        failed.append("name")
+    if product.price.price <= 0:
+        failed.append("price")
+    if not any(url.strip() for url in product.image_urls):
+        failed.append("images")
+    return failed
+
+
+def _count(stats: dict | None, key: str) -> None:
+    if stats is not None:
+        stats[key] = stats.get(key, 0) + 1
+
+
+async def extract_cascade(processed: str, models: list[str], cache: ExtractionCache | None = None,
+                          stats: dict | None = None, first: Product | Exception | None = None) -> Product:
+    """
+    Extract with each model in turn until a product passes check_product.
+
+    stats, if given, counts pages per resolving model, plus "unresolved" for pages no tier got
+    right. Those still return the last valid product, a page with no images on it is not fixed by a
+    bigger model. first is the cheapest tier's answer when it was already obtained elsewhere
+    (a packed request), so it isn't asked again. API errors left after ai.responses' retries are
+    raised, a stronger model behind the same provider would hit them too.
+    """
+    best, error = None, None
+    for tier, model in enumerate(models):
+        try:
+            if tier == 0 and first is not None:
+                if isinstance(first, Exception):
+                    raise first
+                product = first
+            else:
+                product = await extract_product(processed, cache, model)
+        except openai.APIError:
+            raise
+        except Exception as e:
+            # parse failures, cut off answers and validation errors are the model's fault
+            error = e
+            continue
+        if not check_product(product):
+            _count(stats, model)
+            return product
+        best = product
+    if best is None:
+        raise error
+    _count(stats, "unresolved")
+    return best
@@ -0,0 +1,223 @@
+# Near-duplicate page detection.
+# A crawl reaches the same product under many URLs: color and size query params, tracking params,
+# mirrors. Each copy preprocesses to slightly different text (the URL, a view counter, a "3 left"
+# banner), so the content-addressed cache misses and every copy costs a full LLM call. The index
+# below groups pages that are the same product, by the JSON-LD identifiers (sku, gtin, mpn,
+# productGroupID) when the page has them and by MinHash similarity of the page text otherwise.
+# Only the first page of a group is extracted, the others get a copy of its product.
+#
+# MinHash here is one-permutation hashing: every shingle is hashed once and lands in one of
+# SIGNATURE_SIZE bins, each bin keeps its smallest hash. Two pages' fraction of equal bins
+# estimates the Jaccard similarity of their shingle sets, and banding the bins (LSH) finds the
+# candidates without comparing every pair. Similar text is not enough when both pages name their
+# product and the names differ: that's two products on one template, not two copies of one.
+import hashlib
+import re
+from collections import defaultdict
+
+from boilerplate import page_domain
+from structured import PRODUCT_TYPES, _as_list, _nodes, _types
+
+SHINGLE_WORDS = 5
+SIGNATURE_SIZE = 64
+# LSH bands of SIGNATURE_SIZE // BANDS bins: a pair at 0.9 similarity shares a band 99% of the time
+BANDS = 8
+# estimated Jaccard similarity above which two pages are the same product
+THRESHOLD = 0.9
+# pages with fewer shingles are only matched by identifier, short texts are too alike to compare
+MIN_SHINGLES = 50
+IDENTIFIER_KEYS = ("sku", "gtin", "gtin8", "gtin12", "gtin13", "gtin14", "mpn", "productGroupID")
+_EMPTY = 1 << 64
+_WORD = re.compile(r"\w+")
+
+
+def _hash(data: bytes) -> int:
+    # stable across processes and runs, unlike hash()
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+
+def signature(text: str) -> tuple[int, ...] | None:
+    """MinHash signature of the text's word shingles, None when the text is too short to compare."""
+    words = _WORD.findall(text.lower())
+    shingles = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+    if len(shingles) < MIN_SHINGLES:
+        return None
+    bins = [_EMPTY] * SIGNATURE_SIZE
+    for shingle in shingles:
+        h = _hash(shingle.encode("utf-8"))
+        index, value = h % SIGNATURE_SIZE, h // SIGNATURE_SIZE
+        if value < bins[index]:
+            bins[index] = value
+    return tuple(bins)
+
+
+def similarity(a: tuple[int, ...], b: tuple[int, ...]) -> float:
+    """Estimated Jaccard similarity of two signatures, bins empty on both sides don't count."""
+    filled = [(x, y) for x, y in zip(a, b) if x != _EMPTY or y != _EMPTY]
+    return sum(x == y for x, y in filled) / len(filled) if filled else 0.0
+
+
+def product_ids(jsonld: list) -> set[str]:
+    """Identifiers of the page's main JSON-LD product and the group it is a variant of, as key|value."""
+    product = next((n for n in _nodes(jsonld) if _types(n) & PRODUCT_TYPES), None)
+    if product is None:
+        return set()
+    ids = set()
+    # a variant page names its group through isVariantOf
+    for node in [product, *(n for n in _as_list(product.get("isVariantOf")) if isinstance(n, dict))]:
+        for key in IDENTIFIER_KEYS:
+            for value in _as_list(node.get(key)):
+                if isinstance(value, (str, int)) and str(value).strip():
+                    ids.add(f"{key.startswith('gtin') and 'gtin' or key}|{str(value).strip().lower()}")
+    return ids
+
+
+def identifiers(jsonld: list, meta: dict) -> set[str]:
+    """Product identifiers scoped to the page's site, none when the site is unknown (skus are only unique per site)."""
+    domain = page_domain(jsonld, meta)
+    if not domain:
+        return set()
+    return {f"{domain}|{key}" for key in product_ids(jsonld)}
+
+
+def conflicting(a: set[str], b: set[str]) -> bool:
+    """Whether two pages' product ids name different products: a kind of id both have, with no value in common."""
+    if a & b and any(key.startswith("productGroupID|") for key in a & b):
+        return False  # variants of one group
+    kinds = {key.split("|", 1)[0] for key in a} & {key.split("|", 1)[0] for key in b}
+    return any(not {k for k in a if k.startswith(kind + "|")} & {k for k in b if k.startswith(kind + "|")}
+               for kind in kinds)
+
+
+class DedupIndex:
+    """
+    Groups pages into clusters of near-duplicates, the first page of a cluster is its representative.
+
+    threshold: estimated Jaccard similarity above which pages are the same product
+    use_identifiers: also match pages sharing a JSON-LD sku/gtin/mpn/productGroupID on the same site
+    Pages whose identifiers disagree (a sku, gtin, ... on both, different values) never match by text.
+    Counts of pages matched by identifier and by text are kept for the run report.
+    """
+
+    def __init__(self, threshold: float = THRESHOLD, use_identifiers: bool = True):
+        self.threshold = threshold
+        self.use_identifiers = use_identifiers
+        self.pages = 0
+        self.by_identifier = 0
+        self.by_text = 0
+        self._ids: dict[str, str] = {}
+        self._bands: dict[tuple, list[str]] = defaultdict(list)
+        self._signatures: dict[str, tuple[int, ...]] = {}
+        self._product_ids: dict[str, set[str]] = {}
+
+    @property
+    def duplicates(self) -> int:
+        return self.by_identifier + self.by_text
+
+    @property
+    def clusters(self) -> int:
+        return self.pages - self.duplicates
+
+    def _band_keys(self, sig: tuple[int, ...]) -> list[tuple]:
+        rows = SIGNATURE_SIZE // BANDS
+        return [(band, sig[band * rows:(band + 1) * rows]) for band in range(BANDS)]
+
+    def add(self, name: str, processed: str, jsonld: list, meta: dict) -> str | None:
+        """Index a page, returning the representative it duplicates or None when it starts a new cluster."""
+        self.pages += 1
+        ids = identifiers(jsonld, meta) if self.use_identifiers else set()
+        own_ids = product_ids(jsonld)
+        for key in ids:
+            if key in self._ids and not conflicting(own_ids, self._product_ids[self._ids[key]]):
+                self.by_identifier += 1
+                return self._ids[key]
+        # one retailer template sells many products, text alone can't tell two of them apart
+        sig = signature(processed)
+        if sig is not None:
+            seen = set()
+            for key in self._band_keys(sig):
+                for candidate in self._bands.get(key, []):
+                    if candidate in seen:
+                        continue
+                    seen.add(candidate)
+                    if conflicting(own_ids, self._product_ids.get(candidate, set())):
+                        continue
+                    if similarity(sig, self._signatures[candidate]) >= self.threshold:
+                        self.by_text += 1
+                        return candidate
+        # a new representative, later pages are matched against it
+        self._product_ids[name] = own_ids
+        for key in ids:
+            self._ids.setdefault(key, name)
+        if sig is not None:
+            self._signatures[name] = sig
+            for key in self._band_keys(sig):
+                self._bands[key].append(name)
+        return None
+
+
+#report: clusters and LLM calls avoided on a synthetic crawl of perturbed copies of data/*.html
+if __name__ == "__main__":
+    import argparse
+    import random
+    import time
+
+    from ingest import iter_html_files
+    from preprocess_pool import prepare_page
+
+    parser = argparse.ArgumentParser(description="Near-duplicate clustering on perturbed copies of the sample pages")
+    parser.add_argument("--data", default="data")
+    parser.add_argument("--copies", type=int, default=20, help="perturbed copies of each page")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    def with_params(html: str) -> str:
+        # the same page reached through color/size/tracking query params
+        params = rng.choice(["?color=black", "?size=M&color=red", "?utm_source=newsletter&utm_medium=email",
+                             "?gclid=" + "".join(rng.choices("abcdef0123456789", k=16))])
+        return re.sub(r'(https?://[^"\'\s<>?#]+/[^"\'\s<>?#]*)', lambda m: m.group(1) + params, html, count=3)
+
+    def with_noise(html: str) -> str:
+        # per-request text: a view counter, a stock banner and a timestamp
+        noise = (f"<p>{rng.randint(2, 500)} people viewed this today</p>"
+                 f"<p>Only {rng.randint(1, 9)} left in stock</p><p>Updated {rng.randint(1, 59)} minutes ago</p>")
+        return html.replace("</body>", noise + "</body>", 1) if "</body>" in html else html + noise
+
+    def mirror(html: str) -> str:
+        # a mirror host serving the same markup
+        return re.sub(r"https?://(www\.)?", "https://mirror.example.net/", html, count=5)
+
+    perturb = [with_params, with_noise, mirror, lambda html: with_noise(with_params(html))]
+    corpus = []
+    for name, html in iter_html_files(args.data):
+        corpus.append((name, name, html))
+        for i in range(args.copies):
+            corpus.append((f"{name}#{i}", name, rng.choice(perturb)(html)))
+    rng.shuffle(corpus)
+    prepared = [(name, origin, prepare_page(html)) for name, origin, html in corpus]
+    originals = len({origin for _, origin, _ in corpus})
+
+    print(f"{len(corpus)} pages, {originals} distinct products, {args.copies} perturbed copies each")
+    print(f"{'index':<22} {'clusters':>9} {'LLM calls':>10} {'avoided':>8} {'by id':>6} {'by text':>8} "
+          f"{'wrong merges':>13} {'ms/page':>8}")
+    for label, index in [("exact text (cache)", None),
+                         ("minhash", DedupIndex(args.threshold, use_identifiers=False)),
+                         ("minhash + ids", DedupIndex(args.threshold))]:
+        start = time.perf_counter()
+        wrong = 0
+        if index is None:
+            # what the content-addressed cache already catches
+            clusters = len({page.processed for _, _, page in prepared})
+            matched = ids = texts = 0
+        else:
+            representative_of = {}
+            for name, origin, page in prepared:
+                rep = index.add(name, page.processed, page.jsonld, page.meta)
+                representative_of[name] = origin
+                wrong += rep is not None and representative_of[rep] != origin
+            clusters, ids, texts = index.clusters, index.by_identifier, index.by_text
+        elapsed = (time.perf_counter() - start) / len(prepared) * 1000
+        print(f"{label:<22} {clusters:>9} {clusters:>10} {1 - clusters / len(corpus):>8.0%} {ids:>6} {texts:>8} "
+              f"{wrong:>13} {elapsed:>8.2f}")
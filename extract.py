@@ -1,95 +1,432 @@
 import os
 import ai
 import asyncio
-import re
+import time
 from models import Product
-from prompts import extract_prompt
-from preprocess import preprocess_html
-import json
-#ai built function to make sure the text we are extracting looks prettier
-def clean_text(text: str) -> str:
-    if not text:
-        return text
-    # Remove replacement characters and other junk
-    text = text.replace('�', '').replace('\ufffd', '')
-    # Normalize line breaks
-    text = text.replace('\r\n', '\n').replace('\r', '\n')
-    # Collapse tabs and multiple spaces into single space
-    text = re.sub(r'[\t ]+', ' ', text)
-    # Clean up space around newlines
-    text = re.sub(r' *\n *', '\n', text)
-    # Collapse multiple newlines into max two
-    text = re.sub(r'\n{3,}', '\n\n', text)
-    # Remove leading dash-space patterns that got mangled
-    text = re.sub(r'^- +', '- ', text, flags=re.MULTILINE)
-    return text.strip()
-
-def fix_url(url: str) -> str:
-    if url and url.startswith('//'):
-        return 'https:' + url
-    return url
-
-#this is going to be the function that extracts the product object. It borrows from prompts.py which is where we will customize the prompts
-async def extract_product(processed: str) -> Product:
-    return await ai.responses(
-        #this is the choice due to the lightest option, which is important for scalablity
-        model="google/gemini-2.0-flash-lite-001",
-        input=[
-            {"role": "system", "content": extract_prompt},
-            {"role": "user", "content": processed}
-        ],
-        text_format=Product
-    )
+from preprocess_pool import PreparedPage, preprocess_stage
+from structured import product_from_structured
+from dataclasses import dataclass
+from ratelimit import TokenBudget
+from transport import TransportConfig
+from cache import ExtractionCache
+from output import NDJSONWriter, compact, rotated_segments
+from manifest import RunManifest, content_hash
+from usage import page_context
+from tracing import tracer
+#pages are read lazily from folders or straight out of WARC/tar archives, see ingest.py
+from ingest import iter_html_files, iter_pages
+from repair import repairs
+import packing
+from dedup import DedupIndex
+from refresh import RefreshStore
+import cascade as model_cascade
+#the single-page call and product clean-up live in extraction.py, shared with cascade/packing/batch
+from extraction import MODEL, clean_text, estimate_tokens, extract_product, finalize_product, fix_url
+
+# result of one page going through the pipeline, product is None when it failed
+@dataclass
+class PageResult:
+    name: str
+    product: Product | None = None
+    error: Exception | None = None
+    tokens: int = 0
+    # "structured" when the JSON-LD fast path built the product without the LLM,
+    # "duplicate" when it is a copy of a near-duplicate page's product (dedup.py),
+    # "refresh" when it is the stored product of an already extracted page, offers updated (refresh.py)
+    source: str = "llm"
+
+async def extract_pages(pages, concurrency: int = 8, tokens_per_minute: int | None = None,
+                        workers: int = 0, chunksize: int = 8, cache: ExtractionCache | None = None,
+                        fast_path: bool = True, compact_payload: bool = True, boilerplate: str | None = None,
+                        pack_tokens: int = 0, pack_pages: int = 8, pack_stats: dict | None = None,
+                        cascade: list[str] | None = None, cascade_stats: dict | None = None,
+                        dedup: DedupIndex | None = None, lazy_parse: bool = True,
+                        refresh: RefreshStore | None = None):
+    """
+    Run preprocess + extract for many pages at once and yield PageResults as they finish.
+
+    concurrency caps the LLM calls in flight (semaphore). Up to 2x that many pages are
+    scheduled at a time so the next pages are preprocessed while calls are outstanding,
+    without pulling the whole input iterator into memory.
+    tokens_per_minute optionally throttles calls against an estimated input token budget.
+    workers > 0 moves preprocessing into a process pool fed in chunks of `chunksize` pages.
+    cache short-circuits pages whose preprocessed text was already extracted.
+    fast_path serves pages whose JSON-LD maps to a complete Product without calling the LLM.
+    compact_payload sends the pruned, deduplicated payload (payload.py) instead of the full indent=2 one.
+    boilerplate is a learned per-domain model file (boilerplate.py) whose lines are stripped from page text.
+    pack_tokens > 0 sends LLM pages in packs of up to that many estimated input tokens (and at most
+    pack_pages pages) per request; pack_stats collects packs/splits/fallbacks counts.
+    cascade is a list of models tried cheapest first, escalating pages that fail the sanity checks
+    (cascade.py); cascade_stats counts the pages each model resolved.
+    dedup sends only the first page of each near-duplicate cluster to the LLM and copies its
+    product to the others (dedup.py).
+    lazy_parse reads pages with the tokenizer and stops collecting text once the payload is full,
+    instead of building the whole BeautifulSoup tree (same payload either way).
+    refresh serves pages extracted in an earlier run from the store when only their prices or
+    stock changed, and stores every newly extracted product (refresh.py).
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    # the process-wide limiter would otherwise stop at its default ceiling below a high concurrency
+    ai.configure_concurrency(concurrency)
+    budget = TokenBudget(tokens_per_minute) if tokens_per_minute else None
+    #results of cluster representatives, awaited by their duplicates
+    shared: dict[str, asyncio.Future] = {}
+
+    def publish(results: list[PageResult]) -> list[PageResult]:
+        for result in results:
+            if result.name in shared:
+                shared[result.name].set_result(result)
+        return results
+
+    def remember(name: str, page: PreparedPage, result: PageResult) -> None:
+        if refresh is not None and result.product is not None:
+            refresh.put(name, page, result.product)
+
+    #pages that never need the LLM: preprocessing failures and the structured fast path
+    def settle(name: str, page: PreparedPage | Exception) -> PageResult | None:
+        result = PageResult(name)
+        try:
+            if isinstance(page, Exception):
+                raise page
+            if not fast_path:
+                return None
+            with tracer.span("structured"):
+                product = product_from_structured(page.jsonld, page.meta)
+            if product is None:
+                return None
+            result.source = "structured"
+            with tracer.span("finalize"):
+                result.product = finalize_product(product)
+        except Exception as e:
+            result.error = e
+        return result
+
+    async def run(name: str, page: PreparedPage) -> list[PageResult]:
+        result = PageResult(name, tokens=estimate_tokens(page.processed))
+        queued = time.perf_counter()
+        try:
+            async with semaphore:
+                if budget:
+                    await budget.acquire(result.tokens)
+                started = time.perf_counter()
+                tracer.record("queue_wait", started - queued, start=queued)
+                #usage of every call made for this page is attributed to it
+                with page_context(name):
+                    if cascade:
+                        product = await model_cascade.extract_cascade(page.processed, cascade, cache, cascade_stats)
+                    else:
+                        product = await extract_product(page.processed, cache)
+                #the round trip includes the client parsing the response into a Product
+                tracer.record("llm", time.perf_counter() - started, bytes_in=len(page.processed),
+                              bytes_out=len(product.model_dump_json()) if tracer.enabled else 0, start=started)
+            with tracer.span("finalize"):
+                result.product = finalize_product(product)
+            remember(name, page, result)
+        except Exception as e:
+            result.error = e
+        finally:
+            ai.usage.page_done(name)
+        return publish([result])
+
+    async def copy_of(name: str, page: PreparedPage, representative: str) -> list[PageResult]:
+        result = PageResult(name, source="duplicate")
+        extracted = await shared[representative]
+        if extracted.error is not None:
+            result.error = RuntimeError(f"near-duplicate of {representative}, which failed: {extracted.error}")
+        else:
+            result.product = extracted.product.model_copy(deep=True)
+            remember(name, page, result)
+        return [result]
+
+    #several pages in one request, see packing.py
+    async def run_pack(pack: list[tuple[str, PreparedPage]]) -> list[PageResult]:
+        results = [PageResult(name, tokens=estimate_tokens(page.processed)) for name, page in pack]
+        queued = time.perf_counter()
+        try:
+            async with semaphore:
+                if budget:
+                    await budget.acquire(sum(r.tokens for r in results))
+                started = time.perf_counter()
+                tracer.record("queue_wait", started - queued, start=queued)
+                outcomes = await packing.extract_packed([(name, page.processed) for name, page in pack],
+                                                        cache, pack_stats, cascade[0] if cascade else None)
+                if cascade:
+                    #the pack was the cheapest tier, pages it got wrong escalate one by one
+                    async def escalate(name: str, page: PreparedPage) -> Product:
+                        with page_context(name):
+                            return await model_cascade.extract_cascade(page.processed, cascade, cache,
+                                                                       cascade_stats, first=outcomes[name])
+
+                    escalated = await asyncio.gather(*(escalate(name, page) for name, page in pack),
+                                                     return_exceptions=True)
+                    outcomes = {name: product for (name, _), product in zip(pack, escalated)}
+                tracer.record("llm", time.perf_counter() - started, start=started,
+                              bytes_in=sum(len(page.processed) for _, page in pack))
+        except Exception as e:
+            outcomes = {name: e for name, _ in pack}
+        finally:
+            #packing.py spreads each request's usage over its pages, fold them into the histograms
+            for name, _ in pack:
+                ai.usage.page_done(name)
+        for result, (_, page) in zip(results, pack):
+            outcome = outcomes[result.name]
+            if isinstance(outcome, Exception):
+                result.error = outcome
+                continue
+            with tracer.span("finalize"):
+                result.product = finalize_product(outcome)
+            remember(result.name, page, result)
+        return publish(results)
+
+    pending = set()
+    #duplicates wait on a representative that may still sit in an unsent pack, so they don't
+    #count against the in-flight window
+    copies = set()
+    pack, pack_size = [], 0
+    async for name, page in preprocess_stage(pages, workers, chunksize, compact=compact_payload,
+                                             boilerplate=boilerplate, lazy=lazy_parse):
+        if len(pending) >= concurrency * 2:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                for result in task.result():
+                    yield result
+        for task in [task for task in copies if task.done()]:
+            copies.discard(task)
+            for result in task.result():
+                yield result
+        settled = settle(name, page)
+        if settled is not None:
+            yield settled
+            continue
+        if refresh is not None:
+            with tracer.span("refresh"):
+                product = refresh.refresh(name, page)
+            if product is not None:
+                yield PageResult(name, product=product, source="refresh")
+                continue
+        if dedup is not None:
+            representative = dedup.add(name, page.processed, page.jsonld, page.meta)
+            if representative is not None:
+                copies.add(asyncio.create_task(copy_of(name, page, representative)))
+                continue
+            shared[name] = asyncio.get_running_loop().create_future()
+        if not pack_tokens:
+            pending.add(asyncio.create_task(run(name, page)))
+            continue
+        size = estimate_tokens(page.processed)
+        if pack and (pack_size + size > pack_tokens or len(pack) >= pack_pages):
+            pending.add(asyncio.create_task(run_pack(pack)))
+            pack, pack_size = [], 0
+        pack.append((name, page))
+        pack_size += size
+    if pack:
+        pending.add(asyncio.create_task(run_pack(pack)))
+    pending |= copies
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            for result in task.result():
+                yield result
+
 #This is going to be the loop that actually get the products from the pages
-async def main():
-    data_folder = "data"
-    products = []
-    total_tokens = 0
-
-    # rough estimate: 1 token ≈ 4 characters
-    def estimate_tokens(text: str) -> int:
-        return len(text) // 4
-
-    #the loop of html files
-    for filename in os.listdir(data_folder):
-        if filename.endswith(".html"):
-            filepath = os.path.join(data_folder,filename)
-            with open(filepath, "r",encoding ="utf-8") as f:
-                html = f.read()
-            #try catch block so it can actually skip over errors
-            try:
-                processed = preprocess_html(html)
-                tokens_used = estimate_tokens(processed)
-                total_tokens += tokens_used
-
-                product = await extract_product(processed)
-                # clean up whitespace garbage from text fields
-                product.description = clean_text(product.description)
-                product.key_features = [clean_text(f) for f in product.key_features]
-                # fix protocol-relative URLs
-                product.image_urls = [fix_url(u) for u in product.image_urls]
-                if product.video_url:
-                    product.video_url = fix_url(product.video_url)
-                products.append(product)
-                print(f"success for {filename}")
-                print(product.model_dump_json(indent=2))
-            except Exception as e:
-                print(f"fail on {filename}: {e}")
-    # Write to root for backend use
-    output_data = [p.model_dump() for p in products]
-    with open("products.json", "w") as f:
-        json.dump(output_data, f, indent=2)
-
-    # Also write to frontend for UI (single pipeline)
+#everything past the data folder is keyword-only, too many options to pass them by position
+async def main(data_folder: str = "data", *, concurrency: int = 8, tokens_per_minute: int | None = None,
+               workers: int = 0, cache: ExtractionCache | None = None, fast_path: bool = True,
+               output_path: str = "products.ndjson", fsync_every: int = 100, rotate_bytes: int | None = None,
+               manifest_path: str = "run_manifest.jsonl", resume: bool = False,
+               usage_report: str | None = "usage.json", prometheus_path: str | None = None,
+               trace: bool = False, trace_file: str | None = None, profile_dir: str | None = None,
+               compact_payload: bool = True, boilerplate: str | None = None,
+               pack_tokens: int = 0, pack_pages: int = 8, cascade: list[str] | None = None,
+               transport: TransportConfig | None = None, dedup: DedupIndex | None = None,
+               lazy_parse: bool = True, refresh: RefreshStore | None = None):
+    products = 0
+    structured_pages = 0
+    duplicate_pages = 0
+    refreshed_pages = 0
+    skipped = 0
+    #a new run starts a fresh NDJSON output and manifest, --resume keeps appending to them
+    if not resume:
+        for stale in rotated_segments(output_path) + [output_path]:
+            if os.path.exists(stale):
+                os.remove(stale)
+    writer = NDJSONWriter(output_path, fsync_every, rotate_bytes)
+    #checked against the output before this run appends anything to it
+    manifest = RunManifest(manifest_path, fresh=not resume, output_path=output_path)
+    hashes = {}
+    pack_stats = {}
+    cascade_stats = {}
+    repairs.clear()
+    if cascade:
+        cascade = model_cascade.cascade_models(cascade)
+    ai.usage.reset()
+    if transport is not None:
+        ai.configure_transport(transport)
+    tracer.configure(trace, trace_file, profile_dir)
+
+    #skips pages the manifest says are already done, everything else (including failures) runs again
+    def pending_pages():
+        nonlocal skipped
+        for name, html in iter_pages(data_folder):
+            digest = content_hash(html)
+            if resume and manifest.is_done(name, digest):
+                skipped += 1
+                continue
+            hashes[name] = digest
+            yield name, html
+
+    #results stream in as soon as each page finishes
+    async for result in extract_pages(pending_pages(), concurrency, tokens_per_minute, workers,
+                                     cache=cache, fast_path=fast_path, compact_payload=compact_payload,
+                                     boilerplate=boilerplate, pack_tokens=pack_tokens, pack_pages=pack_pages,
+                                     pack_stats=pack_stats, cascade=cascade, cascade_stats=cascade_stats,
+                                     dedup=dedup, lazy_parse=lazy_parse, refresh=refresh):
+        digest = hashes.pop(result.name)
+        if result.error is not None:
+            manifest.record_failed(result.name, digest, result.error)
+            print(f"fail on {result.name}: {result.error}")
+            continue
+        #each product is durable on disk as soon as it validates
+        with tracer.span("write") as span:
+            written = writer.bytes_written
+            segment, offset = writer.write(result.product)
+            span.bytes_out = writer.bytes_written - written
+        #the manifest is flushed per record, the record it points at must be out of our buffer first
+        writer.flush()
+        manifest.record_done(result.name, digest, segment, offset)
+        products += 1
+        structured_pages += result.source == "structured"
+        duplicate_pages += result.source == "duplicate"
+        refreshed_pages += result.source == "refresh"
+        note = {"structured": " (structured data, no LLM)", "duplicate": " (near-duplicate, no LLM)",
+                "refresh": " (known page, offers refreshed, no LLM)"}
+        print(f"success for {result.name}" + note.get(result.source, ""))
+        print(result.product.model_dump_json(indent=2))
+    writer.close()
+    manifest.close()
+    await ai.clients.close()
+    # Write to root for backend use, and to the frontend for UI (single pipeline)
     frontend_path = os.path.join("frontend", "src", "data", "products.json")
-    os.makedirs(os.path.dirname(frontend_path), exist_ok=True)
-    with open(frontend_path, "w") as f:
-        json.dump(output_data, f, indent=2)
-    print(f"Wrote {len(products)} products to products.json and {frontend_path}")
+    with tracer.span("compact"):
+        total = compact(output_path, ["products.json", frontend_path])
+    print(f"Wrote {total} products to {output_path}, products.json and {frontend_path}")
+    if resume:
+        print(f"Resumed: {skipped} pages already done, {products} newly extracted")
+    failed = manifest.counts()["failed"]
+    if failed:
+        print(f"{failed} pages failed, rerun with --resume to retry only those")
 
+    #measured from the provider's usage numbers, cache hits and the fast path never reach it
     print(f"\n--- Token Usage ---")
-    print(f"Total tokens consumed: ~{total_tokens:,}")
-    print(f"Estimated cost: ${total_tokens / 1_000_000 * 0.075:.4f}")
-        
+    ai.usage.print_report()
+    if usage_report:
+        ai.usage.write_json(usage_report)
+    if prometheus_path:
+        ai.usage.write_prometheus(prometheus_path)
+    print(f"Fast path: {structured_pages} of {products} products built from structured data without the LLM")
+    if cache is not None:
+        saved = cache.saved_input_tokens + cache.saved_output_tokens
+        print(f"Cache: {cache.hits} hits, {cache.misses} misses, ~{saved:,} tokens saved")
+    if dedup is not None and dedup.pages:
+        print(f"Dedup: {dedup.clusters} clusters from {dedup.pages} LLM pages, {duplicate_pages} copied from their "
+              f"representative ({dedup.by_identifier} by product id, {dedup.by_text} by text)")
+    if refresh is not None and refresh.outcomes:
+        outcomes = refresh.outcomes
+        print(f"Refresh: {refreshed_pages} known pages served without the LLM ({outcomes['unchanged']} unchanged, "
+              f"{outcomes['offers']} prices/stock updated), {outcomes['changed']} changed, "
+              f"{outcomes['unmapped']} with offers that needed the LLM, {outcomes['new']} new")
+    if pack_stats:
+        print(f"Packing: {pack_stats.get('packs', 0)} packed requests, {pack_stats.get('splits', 0)} splits, "
+              f"{pack_stats.get('fallbacks', 0)} pages retried alone")
+    if cascade_stats:
+        tiers = ", ".join(f"{cascade_stats.get(model, 0)} at {model}" for model in cascade)
+        print(f"Cascade: {tiers}, {cascade_stats.get('unresolved', 0)} failing checks at every tier (kept)")
+    if repairs:
+        fields = ", ".join(f"{field} {count}" for field, count in repairs.most_common())
+        print(f"Repairs: {repairs.total()} fields fixed with a follow-up request ({fields})")
+    if tracer.enabled:
+        print(f"\n--- Stage Latency ---")
+        tracer.print_summary()
+        tracer.close()
+
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Extract products from the html pages in a folder")
+    parser.add_argument("--data", default="data", help="folder of .html pages, or a .warc(.gz) / .tar(.gz) crawl archive")
+    parser.add_argument("--concurrency", type=int, default=8, help="max LLM calls in flight")
+    parser.add_argument("--tpm", type=int, default=None, help="tokens-per-minute budget for LLM calls")
+    parser.add_argument("--workers", type=int, default=0, help="preprocessing processes (0 = inline)")
+    parser.add_argument("--no-fast-path", action="store_true", help="send every page to the LLM")
+    parser.add_argument("--full-payload", action="store_true", help="send the unpruned indent=2 payload")
+    parser.add_argument("--full-parse", action="store_true",
+                        help="build the whole BeautifulSoup tree instead of reading pages lazily")
+    parser.add_argument("--boilerplate", default="boilerplate.json",
+                        help="per-domain boilerplate model from boilerplate.py, used when the file exists")
+    parser.add_argument("--pack-tokens", type=int, default=0,
+                        help="pack LLM pages into requests of up to this many input tokens (0 = one page per call)")
+    parser.add_argument("--pack-pages", type=int, default=8, help="most pages in one packed request")
+    #opt-in, escalated pages are billed at the stronger models' prices
+    parser.add_argument("--models", default="",
+                        help="comma separated model cascade, e.g. " + ",".join(model_cascade.DEFAULT_CASCADE) +
+                             "; pages failing the checks escalate to the next model (default: every page on MODEL)")
+    parser.add_argument("--max-connections", type=int, default=256, help="HTTP connection pool size")
+    parser.add_argument("--keepalive", type=int, default=256, help="idle connections kept for reuse")
+    parser.add_argument("--http2", action="store_true", help="multiplex calls over HTTP/2 (needs the h2 package)")
+    parser.add_argument("--connect-timeout", type=float, default=5.0)
+    parser.add_argument("--read-timeout", type=float, default=120.0, help="seconds without data before a call fails")
+    parser.add_argument("--stream", action="store_true", help="stream completions, the read timeout applies per chunk")
+    parser.add_argument("--no-dedup", action="store_true", help="extract near-duplicate pages separately")
+    parser.add_argument("--dedup-threshold", type=float, default=0.9,
+                        help="text similarity (0-1) above which pages count as the same product")
+    parser.add_argument("--refresh", action="store_true",
+                        help="reuse products of pages extracted before when only their prices/stock changed")
+    parser.add_argument("--refresh-db", default="refresh.sqlite", help="store of extracted pages for --refresh")
+    parser.add_argument("--cache", default="extract_cache.sqlite", help="extraction cache file")
+    parser.add_argument("--no-cache", action="store_true", help="always call the LLM")
+    parser.add_argument("--cache-max-age-days", type=float, default=30)
+    parser.add_argument("--cache-max-entries", type=int, default=1_000_000)
+    parser.add_argument("--output", default="products.ndjson", help="NDJSON file products are appended to")
+    parser.add_argument("--fsync-every", type=int, default=100, help="fsync the output every N products")
+    parser.add_argument("--rotate-mb", type=float, default=None, help="start a new NDJSON segment past this size")
+    parser.add_argument("--manifest", default="run_manifest.jsonl", help="checkpoint manifest file")
+    parser.add_argument("--resume", action="store_true", help="skip pages the manifest has done, retry failures")
+    parser.add_argument("--usage-report", default="usage.json", help="JSON token/cost report written at the end")
+    parser.add_argument("--prom-textfile", default=None, help="also write the report as a Prometheus textfile")
+    parser.add_argument("--trace", action="store_true", help="print p50/p95/p99 latency per pipeline stage")
+    parser.add_argument("--trace-file", default=None, help="write spans as a Chrome/Perfetto trace (implies --trace)")
+    parser.add_argument("--profile-dir", default=None, help="cProfile each synchronous stage into DIR/<stage>.prof")
+    args = parser.parse_args()
+    cache = None
+    if not args.no_cache:
+        cache = ExtractionCache(args.cache, args.cache_max_age_days * 86400, args.cache_max_entries)
+    rotate_bytes = int(args.rotate_mb * 1_000_000) if args.rotate_mb else None
+    asyncio.run(main(
+        args.data,
+        concurrency=args.concurrency,
+        tokens_per_minute=args.tpm,
+        workers=args.workers,
+        cache=cache,
+        fast_path=not args.no_fast_path,
+        output_path=args.output,
+        fsync_every=args.fsync_every,
+        rotate_bytes=rotate_bytes,
+        manifest_path=args.manifest,
+        resume=args.resume,
+        usage_report=args.usage_report,
+        prometheus_path=args.prom_textfile,
+        trace=args.trace,
+        trace_file=args.trace_file,
+        profile_dir=args.profile_dir,
+        compact_payload=not args.full_payload,
+        boilerplate=args.boilerplate if os.path.exists(args.boilerplate) else None,
+        pack_tokens=args.pack_tokens,
+        pack_pages=args.pack_pages,
+        cascade=args.models.split(",") if args.models else None,
+        transport=TransportConfig(max_connections=args.max_connections, max_keepalive=args.keepalive,
+                                  http2=args.http2, connect_timeout=args.connect_timeout,
+                                  read_timeout=args.read_timeout, stream=args.stream),
+        dedup=None if args.no_dedup else DedupIndex(args.dedup_threshold),
+        lazy_parse=not args.full_parse,
+        refresh=RefreshStore(args.refresh_db) if args.refresh else None,
+    ))
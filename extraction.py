@@ -0,0 +1,80 @@
+# One page, one LLM call: the single-page extraction and the clean-up every path applies to a product.
+# A leaf module, so the pipeline (extract.py) and the paths it drives (cascade.py, packing.py,
+# batch.py) can all share it without importing each other.
+import json
+import re
+import time
+
+import ai
+from cache import ExtractionCache
+from models import Product
+from prompts import extract_prompt
+from repair import validate_or_repair
+from tracing import tracer
+from wire import WIRE_FORMAT, expand
+#ai built function to make sure the text we are extracting looks prettier
+def clean_text(text: str) -> str:
+    if not text:
+        return text
+    # Remove replacement characters and other junk
+    text = text.replace('�', '').replace('\ufffd', '')
+    # Normalize line breaks
+    text = text.replace('\r\n', '\n').replace('\r', '\n')
+    # Collapse tabs and multiple spaces into single space
+    text = re.sub(r'[\t ]+', ' ', text)
+    # Clean up space around newlines
+    text = re.sub(r' *\n *', '\n', text)
+    # Collapse multiple newlines into max two
+    text = re.sub(r'\n{3,}', '\n\n', text)
+    # Remove leading dash-space patterns that got mangled
+    text = re.sub(r'^- +', '- ', text, flags=re.MULTILINE)
+    return text.strip()
+
+def fix_url(url: str) -> str:
+    if url and url.startswith('//'):
+        return 'https:' + url
+    return url
+
+#this is the choice due to the lightest option, which is important for scalablity
+MODEL = "google/gemini-2.0-flash-lite-001"
+
+#this is going to be the function that extracts the product object. It borrows from prompts.py which is where we will customize the prompts
+async def extract_product(processed: str, cache: ExtractionCache | None = None, model: str = MODEL) -> Product:
+    #pages that preprocess to the same text were already paid for, skip the network
+    if cache is not None:
+        key = cache.key(processed, model, extract_prompt)
+        product = cache.get(key)
+        if product is not None:
+            return product
+    response = await ai.responses(
+        model=model,
+        input=[
+            {"role": "system", "content": extract_prompt},
+            {"role": "user", "content": processed}
+        ],
+        response_format=WIRE_FORMAT
+    )
+    #the model answers in the compact wire schema, validated here rather than by parse() so a product
+    #with one bad field can be repaired instead of redone
+    content = response.choices[0].message.content
+    started = time.perf_counter()
+    try:
+        product = await validate_or_repair(expand(json.loads(content)), processed, model)
+    finally:
+        #recorded rather than a span, a repair awaits another call and other pages run meanwhile
+        tracer.record("validate", time.perf_counter() - started, bytes_in=len(content), start=started)
+    if cache is not None:
+        cache.put(key, product, estimate_tokens(processed), estimate_tokens(product.model_dump_json()))
+    return product
+# rough estimate: 1 token ≈ 4 characters
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4
+
+# clean up whitespace garbage and protocol-relative URLs on an extracted product
+def finalize_product(product: Product) -> Product:
+    product.description = clean_text(product.description)
+    product.key_features = [clean_text(f) for f in product.key_features]
+    product.image_urls = [fix_url(u) for u in product.image_urls]
+    if product.video_url:
+        product.video_url = fix_url(product.video_url)
+    return product
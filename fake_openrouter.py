@@ -0,0 +1,338 @@
+# Local stand-in for the OpenRouter chat completions endpoint.
+# It speaks just enough of the OpenAI wire format for ai.responses() to work against it,
+# so the pipeline can be load tested without spending real tokens.
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import default as default_policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_PRODUCT = {
+    "name": "Fake Product",
+    "price": {"price": 19.99, "currency": "USD", "compare_at_price": None},
+    "description": "A product returned by the fake model server.",
+    "key_features": ["Feature one", "Feature two"],
+    "image_urls": ["//example.com/image.jpg"],
+    "video_url": None,
+    "category": {"name": "Apparel & Accessories > Shoes"},
+    "brand": "FakeBrand",
+    "colors": ["Black"],
+    "variants": [{"size": "M", "sku": None, "color": "Black", "price": None, "aval": True}],
+}
+
+
+# page markers of a packed request (packing.pack_message)
+PAGE_MARKER = re.compile(r"^=== PAGE (\S+) ===\n", re.MULTILINE)
+
+
+def fake_product(text: str) -> dict:
+    product = json.loads(json.dumps(DEFAULT_PRODUCT))
+    product["name"] = f"Fake Product {hashlib.md5(text.encode()).hexdigest()[:8]}"
+    return product
+
+
+def _enums(schema) -> list:
+    if isinstance(schema, dict):
+        return schema.get("enum") or [v for value in schema.values() for v in _enums(value)]
+    if isinstance(schema, list):
+        return [v for value in schema for v in _enums(value)]
+    return []
+
+
+def default_responder(body: dict) -> dict:
+    """
+    Return a valid Product whose name is derived from the user message, so pages stay distinguishable.
+    It's encoded in the wire schema when that's what the request asks for. A packed request gets
+    {"products": [{"page_id", "product"}]}, one per page section, and a field repair (a schema
+    asking for some Product fields only) gets just those fields.
+    """
+    user_text = "".join(m.get("content") or "" for m in body.get("messages", []) if m.get("role") == "user")
+    schema = (body.get("response_format") or {}).get("json_schema", {}).get("schema", {})
+    fields = set(schema.get("properties", {}))
+    if fields and fields < DEFAULT_PRODUCT.keys():
+        answer = {field: fake_product(user_text)[field] for field in fields}
+        if "category" in answer and (choices := _enums(schema)):
+            answer["category"] = {"name": choices[0]}
+        return answer
+    # extract_product asks for the compact wire schema (wire.py)
+    encode = _to_wire if "WireProduct" in json.dumps(schema) else lambda product: product
+    sections = PAGE_MARKER.split(user_text)
+    if len(sections) > 1:
+        # split() gives ["", id1, text1, id2, text2, ...]
+        return {"products": [{"page_id": page_id, "product": encode(fake_product(text.rstrip("\n")))}
+                             for page_id, text in zip(sections[1::2], sections[2::2])]}
+    return encode(fake_product(user_text))
+
+
+def _to_wire(product: dict) -> dict:
+    # imported late, the server itself doesn't need the repo's models
+    from models import Product
+    from wire import to_wire
+    return to_wire(Product.model_validate(product))
+
+
+class _Server(ThreadingHTTPServer):
+    # the default listen backlog of 5 resets connections under load tests
+    request_queue_size = 1024
+
+
+class FakeOpenRouter:
+    """
+    Threaded HTTP server that answers /chat/completions with a canned structured response.
+
+    latency: seconds to sleep before answering each request
+    responder: callable(request_body) -> dict that becomes the message content
+    batch_polls: how many GET /batches/{id} calls a batch stays in_progress before completing
+    capacity: concurrent requests the "provider" serves, anything above it gets a 429 (None = unlimited)
+    retry_after: seconds sent in the Retry-After header of those 429s (None = no header)
+    throttle_rate: fraction of requests answered with a 429 regardless of load
+    spike_rate / spike_latency: fraction of requests that take spike_latency seconds instead of latency
+    token_latency: extra seconds per completion token, generation time grows with the answer
+
+    Also mimics the OpenAI-style batch endpoints (POST /files, POST /batches, GET /batches/{id},
+    GET /files/{id}/content) so batch mode can be tested without a provider.
+    """
+
+    def __init__(self, latency: float = 0.0, responder=default_responder, host: str = "127.0.0.1", port: int = 0,
+                 batch_polls: int = 1, capacity: int | None = None, retry_after: float | None = None,
+                 throttle_rate: float = 0.0, spike_rate: float = 0.0, spike_latency: float = 0.0, seed: int = 0,
+                 token_latency: float = 0.0):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.responder = responder
+        self.batch_polls = batch_polls
+        self.capacity = capacity
+        self.retry_after = retry_after
+        self.throttle_rate = throttle_rate
+        self.spike_rate = spike_rate
+        self.spike_latency = spike_latency
+        self.throttled = 0
+        self._rng = random.Random(seed)
+        self.files: dict[str, bytes] = {}
+        self.batches: dict[str, dict] = {}
+        self.requests = 0
+        self.max_in_flight = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self.server = _Server((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/api/v1"
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # headers and body go out in separate writes, Nagle + delayed ACK would add ~40ms to each
+            # answer on a kept-alive connection
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status: int, payload: dict, headers: dict | None = None):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_stream(self, completion: dict, latency: float, generation: float, pieces: int = 8):
+                # server-sent events over chunked encoding, generation time spread over the chunks
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                if latency:
+                    time.sleep(latency)
+                for chunk in fake.completion_chunks(completion, pieces):
+                    if generation and chunk["choices"]:
+                        time.sleep(generation / pieces)
+                    data = f"data: {json.dumps(chunk)}\n\n".encode()
+                    self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                done = b"data: [DONE]\n\n"
+                self.wfile.write(f"{len(done):x}\r\n".encode() + done + b"\r\n0\r\n\r\n")
+
+            def do_GET(self):
+                parts = self.path.split("?")[0].rstrip("/").split("/")
+                if parts[-2] == "batches" and parts[-1] in fake.batches:
+                    self._send_json(200, fake.poll_batch(parts[-1]))
+                elif parts[-1] == "content" and parts[-2] in fake.files:
+                    data = fake.files[parts[-2]]
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/octet-stream")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                else:
+                    self._send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                raw = self.rfile.read(length)
+                if self.path.endswith("/files"):
+                    self._send_json(200, fake.upload(self.headers["Content-Type"], raw))
+                    return
+                body = json.loads(raw or b"{}")
+                if self.path.endswith("/batches"):
+                    self._send_json(200, fake.create_batch(body))
+                    return
+                if not self.path.endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+                    return
+                with fake._lock:
+                    fake.requests += 1
+                    over_capacity = fake.capacity is not None and fake._in_flight >= fake.capacity
+                    if over_capacity or fake._rng.random() < fake.throttle_rate:
+                        fake.throttled += 1
+                        throttle = True
+                    else:
+                        throttle = False
+                        fake._in_flight += 1
+                        fake.max_in_flight = max(fake.max_in_flight, fake._in_flight)
+                    spike = fake._rng.random() < fake.spike_rate
+                if throttle:
+                    headers = {"Retry-After": str(fake.retry_after)} if fake.retry_after is not None else {}
+                    self._send_json(429, {"error": {"message": "Rate limit exceeded", "code": 429}}, headers)
+                    return
+                try:
+                    completion = fake.completion(body)
+                    latency = fake.spike_latency if spike else fake.latency
+                    generation = fake.token_latency * completion["usage"]["completion_tokens"]
+                    if body.get("stream"):
+                        self._send_stream(completion, latency, generation)
+                        return
+                    if latency + generation:
+                        time.sleep(latency + generation)
+                    self._send_json(200, completion)
+                finally:
+                    with fake._lock:
+                        fake._in_flight -= 1
+
+        return Handler
+
+    def completion(self, body: dict) -> dict:
+        content = json.dumps(self.responder(body))
+        prompt_text = "".join(m.get("content") or "" for m in body.get("messages", []))
+        return {
+            "id": f"chatcmpl-fake-{self.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [{
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": content},
+            }],
+            "usage": {
+                "prompt_tokens": len(prompt_text) // 4,
+                "completion_tokens": len(content) // 4,
+                "total_tokens": len(prompt_text) // 4 + len(content) // 4,
+            },
+        }
+
+    @staticmethod
+    def completion_chunks(completion: dict, pieces: int) -> list[dict]:
+        """The completion as stream chunks: content deltas, a finish chunk, then usage (include_usage)."""
+        content = completion["choices"][0]["message"]["content"]
+        size = max(1, -(-len(content) // pieces))
+        base = {key: completion[key] for key in ("id", "created", "model")}
+        chunks = [{**base, "object": "chat.completion.chunk",
+                   "choices": [{"index": 0, "delta": {"role": "assistant", "content": content[i:i + size]},
+                                "finish_reason": None}]}
+                  for i in range(0, len(content), size)]
+        chunks.append({**base, "object": "chat.completion.chunk",
+                       "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        chunks.append({**base, "object": "chat.completion.chunk", "choices": [], "usage": completion["usage"]})
+        return chunks
+
+    def upload(self, content_type: str, raw: bytes) -> dict:
+        message = BytesParser(policy=default_policy).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode() + raw)
+        data = b""
+        for part in message.iter_parts():
+            if part.get_param("name", header="content-disposition") == "file":
+                data = part.get_payload(decode=True)
+        return self._store_file(data, "batch")
+
+    def _store_file(self, data: bytes, purpose: str) -> dict:
+        file_id = f"file-{len(self.files) + 1}"
+        self.files[file_id] = data
+        return {"id": file_id, "object": "file", "bytes": len(data), "created_at": int(time.time()),
+                "filename": f"{file_id}.jsonl", "purpose": purpose, "status": "processed"}
+
+    def create_batch(self, body: dict) -> dict:
+        batch_id = f"batch-{len(self.batches) + 1}"
+        self.batches[batch_id] = {
+            "id": batch_id, "object": "batch", "endpoint": body["endpoint"],
+            "completion_window": body["completion_window"], "input_file_id": body["input_file_id"],
+            "created_at": int(time.time()), "status": "validating", "polls": 0,
+        }
+        return self._batch_view(batch_id)
+
+    def _batch_view(self, batch_id: str) -> dict:
+        return {k: v for k, v in self.batches[batch_id].items() if k != "polls"}
+
+    def poll_batch(self, batch_id: str) -> dict:
+        batch = self.batches[batch_id]
+        batch["polls"] += 1
+        if batch["status"] != "completed" and batch["polls"] > self.batch_polls:
+            # run every request in the input file through the normal completion path
+            outputs = []
+            for line in self.files[batch["input_file_id"]].decode().splitlines():
+                request = json.loads(line)
+                with self._lock:
+                    self.requests += 1
+                outputs.append(json.dumps({
+                    "id": f"response-{request['custom_id']}",
+                    "custom_id": request["custom_id"],
+                    "response": {"status_code": 200, "request_id": request["custom_id"],
+                                 "body": self.completion(request["body"])},
+                    "error": None,
+                }))
+            output = self._store_file(("\n".join(outputs) + "\n").encode(), "batch_output")
+            batch.update(status="completed", output_file_id=output["id"], completed_at=int(time.time()))
+        elif batch["status"] == "validating":
+            batch["status"] = "in_progress"
+        return self._batch_view(batch_id)
+
+    def start(self) -> "FakeOpenRouter":
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run a fake OpenRouter server for local load tests")
+    parser.add_argument("--port", type=int, default=8901)
+    parser.add_argument("--latency", type=float, default=0.5)
+    args = parser.parse_args()
+
+    fake = FakeOpenRouter(latency=args.latency, port=args.port)
+    print(f"Fake OpenRouter listening on {fake.base_url} (latency {args.latency}s)")
+    print(f"Point the pipeline at it with: open_router_base_url={fake.base_url} open_router_key=fake")
+    fake.server.serve_forever()
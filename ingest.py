@@ -0,0 +1,270 @@
+# Page sources for the pipeline.
+# The crawler delivers pages as gzip WARC files or tar archives with millions of records, not as a
+# folder of .html files. iter_pages() reads any of them lazily, one record at a time, straight
+# from the compressed stream: nothing is extracted to disk and an archive is never held in memory.
+# Plain files are memory-mapped and decoded from the mapping, which skips the bytes copy of f.read().
+import gzip
+import logging
+import mmap
+import os
+import tarfile
+import zlib
+
+from tracing import tracer
+
+HTML_SUFFIXES = (".html", ".htm")
+TAR_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+WARC_SUFFIXES = (".warc", ".warc.gz")
+# what a record with a corrupt body raises while it is decoded (bad gzip/deflate, bad chunk sizes)
+DECODE_ERRORS = (OSError, EOFError, ValueError, zlib.error)
+
+logger = logging.getLogger(__name__)
+
+
+def _decode(data, charset: str = "utf-8") -> str:
+    try:
+        text = str(data, charset, errors="replace")
+    except LookupError:
+        text = str(data, "utf-8", errors="replace")
+    # same newlines as reading in text mode
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text
+
+
+def read_text(path: str) -> str:
+    """A file's text, decoded straight from a read-only memory map."""
+    if path.endswith(".gz"):
+        with gzip.open(path, "rb") as f:
+            return _decode(f.read())
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return ""  # empty files can't be mapped
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return _decode(mapped)
+
+
+def iter_tar(path: str):
+    """(member name, html) for every .html member, reading the archive front to back once."""
+    # "r|*" is the streaming mode: no seeking, any compression
+    with tarfile.open(path, mode="r|*") as archive:
+        for member in archive:
+            if member.isfile() and member.name.lower().endswith(HTML_SUFFIXES):
+                with tracer.span("read") as span:
+                    html = _decode(archive.extractfile(member).read())
+                    span.bytes_out = len(html)
+                yield member.name, html
+
+
+def _read_headers(stream) -> dict[str, str]:
+    headers = {}
+    for line in iter(stream.readline, b""):
+        line = line.rstrip(b"\r\n")
+        if not line:
+            break
+        key, _, value = line.decode("latin-1").partition(":")
+        headers[key.strip().lower()] = value.strip()
+    return headers
+
+
+def _dechunk(body: bytes) -> bytes:
+    out, pos = [], 0
+    while pos < len(body):
+        end = body.find(b"\r\n", pos)
+        if end < 0:
+            break
+        size = int(body[pos:end].split(b";")[0] or b"0", 16)
+        if size == 0:
+            break
+        out.append(body[end + 2:end + 2 + size])
+        pos = end + 2 + size + 2
+    return b"".join(out)
+
+
+def http_body(block: bytes) -> str | None:
+    """The decoded HTML of a raw HTTP response, None when it isn't a successful HTML response."""
+    head, sep, body = block.partition(b"\r\n\r\n")
+    if not sep:
+        head, sep, body = block.partition(b"\n\n")
+    lines = head.decode("latin-1").splitlines()
+    if not lines or len(lines[0].split()) < 2 or not lines[0].split()[1].startswith("2"):
+        return None
+    headers = {}
+    for line in lines[1:]:
+        key, _, value = line.partition(":")
+        headers[key.strip().lower()] = value.strip()
+    content_type = headers.get("content-type", "text/html").lower()
+    if "html" not in content_type:
+        return None
+    # WARC keeps the bytes as they came over the wire
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        body = _dechunk(body)
+    encoding = headers.get("content-encoding", "").lower()
+    if encoding in ("gzip", "x-gzip"):
+        body = gzip.decompress(body)
+    elif encoding == "deflate":
+        try:
+            body = zlib.decompress(body)
+        except zlib.error:
+            body = zlib.decompress(body, -zlib.MAX_WBITS)  # raw deflate, servers send both
+    charset = "utf-8"
+    if "charset=" in content_type:
+        charset = content_type.split("charset=")[1].split(";")[0].strip().strip('"') or "utf-8"
+    return _decode(body, charset)
+
+
+def iter_warc(path: str):
+    """(target URI, html) for every successful HTML response record, one record in memory at a time."""
+    # gzip.open reads the concatenated per-record gzip members of a .warc.gz as one stream
+    with (gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")) as stream:
+        while True:
+            line = stream.readline()
+            if not line:
+                return
+            if not line.strip():
+                continue  # the blank lines closing the previous record
+            if not line.startswith(b"WARC/"):
+                raise ValueError(f"{path}: expected a WARC record header, got {line[:40]!r}")
+            headers = _read_headers(stream)
+            block = stream.read(int(headers.get("content-length", 0)))
+            if headers.get("warc-type") != "response" or "warc-target-uri" not in headers:
+                continue
+            uri = headers["warc-target-uri"].strip("<>")
+            # one corrupt record out of millions is skipped, it doesn't end the run
+            try:
+                with tracer.span("read") as span:
+                    html = http_body(block)
+                    span.bytes_out = len(html or "")
+            except DECODE_ERRORS as e:
+                logger.warning("%s: skipping %s, body can't be decoded: %s", path, uri, e)
+                continue
+            if html is not None:
+                yield uri, html
+
+
+def iter_html_files(data_folder: str):
+    """(filename, html) for the .html files of a folder, lazily and in name order."""
+    for filename in sorted(os.listdir(data_folder)):
+        if filename.endswith(".html"):
+            with tracer.span("read") as span:
+                html = read_text(os.path.join(data_folder, filename))
+                span.bytes_out = len(html)
+            yield filename, html
+
+
+def unique_names(records):
+    """
+    The records with repeated names made unique: the n-th repeat of a name gets "#n" appended.
+
+    A crawl fetches the same URI more than once, but the pipeline keys pages by name. The suffix
+    depends only on the order of the records, so the same source gets the same names every run.
+    """
+    seen = set()
+    for name, *rest in records:
+        unique, n = name, 1
+        while unique in seen:
+            unique, n = f"{name}#{n}", n + 1
+        seen.add(unique)
+        yield unique, *rest
+
+
+def _iter_source(source: str):
+    lower = source.lower()
+    if os.path.isdir(source):
+        yield from iter_html_files(source)
+        for filename in sorted(os.listdir(source)):
+            if filename.lower().endswith(WARC_SUFFIXES + TAR_SUFFIXES):
+                yield from _iter_source(os.path.join(source, filename))
+    elif lower.endswith(WARC_SUFFIXES):
+        yield from iter_warc(source)
+    elif lower.endswith(TAR_SUFFIXES):
+        yield from iter_tar(source)
+    else:
+        yield os.path.basename(source), read_text(source)
+
+
+def iter_pages(source: str):
+    """
+    (name, html) pairs from a folder, a WARC file, a tar archive or a single html file.
+
+    A folder yields its .html files and then the records of every archive in it, in name order.
+    Names are file names, archive member names or WARC target URIs, made unique by unique_names().
+    """
+    yield from unique_names(_iter_source(source))
+
+
+#bench: streaming from archives vs extracting them to disk first, on copies of data/*.html
+if __name__ == "__main__":
+    import argparse
+    import io
+    import shutil
+    import tempfile
+    import time
+    import tracemalloc
+
+    parser = argparse.ArgumentParser(description="Stream pages from archives vs extract-then-read")
+    parser.add_argument("--data", default="data")
+    parser.add_argument("--copies", type=int, default=400, help="times each page is repeated in the archives")
+    args = parser.parse_args()
+
+    pages = list(iter_html_files(args.data))
+    workdir = tempfile.mkdtemp()
+    tar_path = os.path.join(workdir, "crawl.tar.gz")
+    warc_path = os.path.join(workdir, "crawl.warc.gz")
+    with tarfile.open(tar_path, "w:gz") as archive:
+        for i in range(args.copies):
+            for name, html in pages:
+                data = html.encode()
+                member = tarfile.TarInfo(f"{i}/{name}")
+                member.size = len(data)
+                archive.addfile(member, io.BytesIO(data))
+    with open(warc_path, "wb") as out:
+        for i in range(args.copies):
+            for name, html in pages:
+                body = html.encode()
+                http = b"HTTP/1.1 200 OK\r\nContent-Type: text/html; charset=utf-8\r\n\r\n" + body
+                record = (f"WARC/1.0\r\nWARC-Type: response\r\nWARC-Target-URI: https://example.com/{i}/{name}\r\n"
+                          f"Content-Type: application/http; msgtype=response\r\nContent-Length: {len(http)}\r\n\r\n"
+                          ).encode() + http + b"\r\n\r\n"
+                # one gzip member per record, like crawlers write them
+                out.write(gzip.compress(record))
+
+    def measure(label: str, run) -> None:
+        tracemalloc.start()
+        start = time.perf_counter()
+        count, size = run()
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"{label:<28} {count:>8,} {size / 1e6:>9.1f} {count / elapsed:>10,.0f} {elapsed:>8.2f} {peak / 1e6:>9.1f}")
+
+    def consume(records) -> tuple[int, int]:
+        count = size = 0
+        for _, html in records:
+            count += 1
+            size += len(html)
+        return count, size
+
+    def extract_then_read() -> tuple[int, int]:
+        target = os.path.join(workdir, "extracted")
+        with tarfile.open(tar_path) as archive:
+            archive.extractall(target, filter="data")
+        count = size = 0
+        for root, _, files in os.walk(target):
+            for filename in files:
+                with open(os.path.join(root, filename), "r", encoding="utf-8") as f:
+                    size += len(f.read())
+                count += 1
+        shutil.rmtree(target)
+        return count, size
+
+    print(f"{args.copies} copies of {len(pages)} pages, tar.gz {os.path.getsize(tar_path) / 1e6:.1f} MB, "
+          f"warc.gz {os.path.getsize(warc_path) / 1e6:.1f} MB")
+    print(f"{'mode':<28} {'pages':>8} {'MB html':>9} {'pages/s':>10} {'seconds':>8} {'peak MB':>9}")
+    try:
+        measure("tar.gz: extract, then read", extract_then_read)
+        measure("tar.gz: stream", lambda: consume(iter_pages(tar_path)))
+        measure("warc.gz: stream", lambda: consume(iter_pages(warc_path)))
+        measure("folder: mmap", lambda: consume(iter_pages(args.data)))
+    finally:
+        shutil.rmtree(workdir)
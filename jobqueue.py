@@ -0,0 +1,319 @@
+# Job queue runner for scaling extraction past one process.
+# extract.main is one asyncio process: one core for preprocessing and one API key's worth of calls.
+# Here a producer enqueues page references, and any number of worker processes, on this machine or
+# others, lease jobs, run the same preprocess + extract pipeline and ack each page with its product.
+# A lease has an expiry. A worker that dies or hangs stops renewing its leases, and once they
+# expire the jobs go to the next worker that asks. A job that keeps failing is given up after
+# max_attempts.
+#
+# SQLiteJobQueue needs no broker and is enough for one machine or a few sharing a local disk
+# (SQLite locking is not safe on network filesystems). For a real fleet, implement JobQueue on a
+# broker: lease = a delivery with a visibility timeout / unacked message, ack = ack, fail = nack.
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+
+import ai
+from cache import ExtractionCache
+from extract import extract_pages
+from ingest import TAR_SUFFIXES, WARC_SUFFIXES, iter_tar, iter_warc, read_text, unique_names
+from output import NDJSONWriter, compact, rotated_segments
+
+QUEUE_FILE = "jobs.sqlite"
+
+
+@dataclass
+class Job:
+    id: int
+    name: str
+    # a page file every worker can read, or the html itself for pages that came out of an archive
+    path: str | None
+    html: str | None
+    attempts: int
+    # the worker holding the lease, only its fail() counts against the job
+    worker: str
+
+    def read(self) -> str:
+        return self.html if self.html is not None else read_text(self.path)
+
+
+class JobQueue(ABC):
+    """What the workers need from a queue; SQLiteJobQueue below, a broker-backed one can stand in."""
+
+    lease_seconds: float
+
+    @abstractmethod
+    def enqueue(self, refs) -> int:
+        """Add (name, path, html) page references, returning how many were new."""
+
+    @abstractmethod
+    def lease(self, worker: str, n: int) -> list[Job]:
+        """Up to n queued (or expired) jobs, leased to the worker for lease_seconds."""
+
+    @abstractmethod
+    def extend(self, worker: str) -> None:
+        """Renew the leases the worker holds."""
+
+    @abstractmethod
+    def ack(self, job: Job, result: str) -> None:
+        """Finish a job with its product JSON."""
+
+    @abstractmethod
+    def fail(self, job: Job, error: str) -> None:
+        """Give a job back for a retry, or fail it for good after max_attempts. No-op once job.worker lost the lease."""
+
+    @abstractmethod
+    def counts(self) -> dict[str, int]:
+        """Jobs per status: queued, leased, done, failed."""
+
+    @abstractmethod
+    def results(self):
+        """(name, product JSON) of the finished jobs, in enqueue order."""
+
+
+class SQLiteJobQueue(JobQueue):
+    """
+    Jobs in one SQLite table, leased with an atomic UPDATE ... RETURNING.
+
+    lease_seconds: how long a leased job stays with its worker without a renewal
+    max_attempts: leases a job gets before it is marked failed
+    """
+
+    def __init__(self, path: str = QUEUE_FILE, lease_seconds: float = 300.0, max_attempts: int = 3):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        # autocommit, transactions are opened explicitly where several statements must be atomic
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE, path TEXT, html TEXT,"
+            " status TEXT NOT NULL DEFAULT 'queued', attempts INTEGER NOT NULL DEFAULT 0,"
+            " worker TEXT, lease_until REAL, result TEXT, error TEXT, started REAL, finished REAL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, lease_until)")
+
+    def enqueue(self, refs, batch: int = 1000) -> int:
+        added = 0
+        refs = iter(refs)
+        while chunk := [ref for _, ref in zip(range(batch), refs)]:
+            self.db.execute("BEGIN IMMEDIATE")
+            before = self.db.total_changes
+            self.db.executemany("INSERT OR IGNORE INTO jobs (name, path, html) VALUES (?, ?, ?)", chunk)
+            added += self.db.total_changes - before
+            self.db.execute("COMMIT")
+        return added
+
+    def lease(self, worker: str, n: int) -> list[Job]:
+        now = time.time()
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            # leases that ran out on their last attempt are not handed out again
+            self.db.execute(
+                "UPDATE jobs SET status = 'failed', error = 'lease expired', finished = ?"
+                " WHERE status = 'leased' AND lease_until < ? AND attempts >= ?",
+                (now, now, self.max_attempts),
+            )
+            rows = self.db.execute(
+                "UPDATE jobs SET status = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1,"
+                " started = coalesce(started, ?)"
+                " WHERE id IN (SELECT id FROM jobs WHERE status = 'queued'"
+                "  OR (status = 'leased' AND lease_until < ?) ORDER BY id LIMIT ?)"
+                " RETURNING id, name, path, html, attempts, worker",
+                (worker, now + self.lease_seconds, now, now, n),
+            ).fetchall()
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        return sorted((Job(*row) for row in rows), key=lambda job: job.id)
+
+    def extend(self, worker: str) -> None:
+        self.db.execute("UPDATE jobs SET lease_until = ? WHERE worker = ? AND status = 'leased'",
+                        (time.time() + self.lease_seconds, worker))
+
+    def ack(self, job: Job, result: str) -> None:
+        # a late ack from a worker whose lease expired is still a good result, the first one wins
+        self.db.execute("UPDATE jobs SET status = 'done', result = ?, error = NULL, finished = ?"
+                        " WHERE id = ? AND status != 'done'", (result, time.time(), job.id))
+
+    def fail(self, job: Job, error: str) -> None:
+        status = "failed" if job.attempts >= self.max_attempts else "queued"
+        # the lease may have expired and gone to another worker, whose attempt this must not end
+        self.db.execute("UPDATE jobs SET status = ?, error = ?, finished = ?"
+                        " WHERE id = ? AND status = 'leased' AND worker = ?",
+                        (status, error, time.time() if status == "failed" else None, job.id, job.worker))
+
+    def counts(self) -> dict[str, int]:
+        counts = {"queued": 0, "leased": 0, "done": 0, "failed": 0}
+        counts.update(self.db.execute("SELECT status, count(*) FROM jobs GROUP BY status").fetchall())
+        return counts
+
+    def results(self):
+        for name, result in self.db.execute("SELECT name, result FROM jobs WHERE status = 'done' ORDER BY id"):
+            yield name, result
+
+    def failures(self) -> list[tuple[str, str]]:
+        return self.db.execute("SELECT name, error FROM jobs WHERE status = 'failed' ORDER BY id").fetchall()
+
+    def span(self) -> float:
+        """Seconds from the first lease to the last finished job."""
+        first, last = self.db.execute("SELECT min(started), max(finished) FROM jobs").fetchone()
+        return (last - first) if first and last else 0.0
+
+    def close(self) -> None:
+        self.db.close()
+
+
+def _refs(source: str):
+    if os.path.isdir(source):
+        for filename in sorted(os.listdir(source)):
+            if filename.endswith(".html"):
+                yield filename, os.path.abspath(os.path.join(source, filename)), None
+        for filename in sorted(os.listdir(source)):
+            if filename.lower().endswith(WARC_SUFFIXES + TAR_SUFFIXES):
+                yield from _refs(os.path.join(source, filename))
+    elif source.lower().endswith(WARC_SUFFIXES):
+        # records can't be read back out of a compressed stream one by one, so they travel in the job
+        for name, html in iter_warc(source):
+            yield name, None, html
+    elif source.lower().endswith(TAR_SUFFIXES):
+        for name, html in iter_tar(source):
+            yield name, None, html
+    else:
+        yield os.path.basename(source), os.path.abspath(source), None
+
+
+def page_refs(source: str):
+    """(name, path, html) references for a source, named like ingest.iter_pages names its pages."""
+    yield from unique_names(_refs(source))
+
+
+async def work(queue: JobQueue, worker: str, concurrency: int = 8, cache: ExtractionCache | None = None,
+               fast_path: bool = True, idle_poll: float = 1.0) -> int:
+    """
+    Lease, extract and ack jobs until the queue has none left queued or leased. Returns pages acked.
+
+    Jobs are leased `concurrency` at a time as the pipeline asks for pages, so a worker never
+    holds much more than it has in flight. Leases are renewed on a timer for as long as the worker
+    runs, a page stuck on a slow call keeps its lease even when no new pages are pulled.
+    """
+    jobs: dict[str, Job] = {}
+
+    async def renew():
+        while True:
+            await asyncio.sleep(queue.lease_seconds / 3)
+            queue.extend(worker)
+
+    def pages():
+        while True:
+            leased = queue.lease(worker, concurrency)
+            if not leased:
+                return
+            for job in leased:
+                try:
+                    html = job.read()
+                except OSError as e:
+                    queue.fail(job, str(e))
+                    continue
+                jobs[job.name] = job
+                yield job.name, html
+
+    acked = 0
+    renewer = asyncio.create_task(renew())
+    try:
+        while True:
+            async for result in extract_pages(pages(), concurrency, cache=cache, fast_path=fast_path):
+                job = jobs.pop(result.name)
+                if result.error is not None:
+                    queue.fail(job, f"{type(result.error).__name__}: {result.error}")
+                    continue
+                queue.ack(job, result.product.model_dump_json())
+                acked += 1
+            counts = queue.counts()
+            if not counts["queued"] and not counts["leased"]:
+                break
+            # other workers hold the rest; their leases may still expire and need picking up
+            await asyncio.sleep(idle_poll)
+    finally:
+        renewer.cancel()
+    await ai.clients.close()
+    return acked
+
+
+def worker_process(queue_path: str, concurrency: int, cache_path: str | None, fast_path: bool,
+                   lease_seconds: float) -> None:
+    """Entry point of one worker process."""
+    queue = SQLiteJobQueue(queue_path, lease_seconds)
+    cache = ExtractionCache(cache_path) if cache_path else None
+    worker = f"{socket.gethostname()}-{os.getpid()}"
+    try:
+        asyncio.run(work(queue, worker, concurrency, cache, fast_path))
+    finally:
+        queue.close()
+
+
+def run_workers(queue_path: str, workers: int, concurrency: int = 8, cache_path: str | None = None,
+                fast_path: bool = True, lease_seconds: float = 300.0) -> None:
+    """Start `workers` worker processes on this machine and wait for them to drain the queue."""
+    # spawn, the parent may already run threads (http client, executors)
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=worker_process,
+                                 args=(queue_path, concurrency, cache_path, fast_path, lease_seconds))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+
+def collect(queue: SQLiteJobQueue, output_path: str = "products.ndjson") -> int:
+    """Write the finished jobs' products to the NDJSON output and the JSON files extract.main writes."""
+    # the queue holds every result, so the output is rewritten from scratch
+    for stale in rotated_segments(output_path) + [output_path]:
+        if os.path.exists(stale):
+            os.remove(stale)
+    with NDJSONWriter(output_path) as writer:
+        for _, result in queue.results():
+            writer.write(json.loads(result))
+    frontend_path = os.path.join("frontend", "src", "data", "products.json")
+    return compact(output_path, ["products.json", frontend_path])
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Extract products through a job queue and worker processes")
+    parser.add_argument("command", choices=["enqueue", "work", "collect", "status"],
+                        help="add pages, run workers until the queue is drained, write the products, or show counts")
+    parser.add_argument("--queue", default=QUEUE_FILE, help="SQLite queue file, shared by every worker")
+    parser.add_argument("--data", default="data", help="folder of .html pages or a crawl archive (enqueue)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes on this machine")
+    parser.add_argument("--concurrency", type=int, default=8, help="LLM calls in flight per worker")
+    parser.add_argument("--lease", type=float, default=300.0, help="seconds before an unrenewed job is retried")
+    parser.add_argument("--cache", default=None, help="extraction cache file shared by the workers")
+    parser.add_argument("--no-fast-path", action="store_true", help="send every page to the LLM")
+    parser.add_argument("--output", default="products.ndjson", help="NDJSON file products are written to (collect)")
+    args = parser.parse_args()
+
+    queue = SQLiteJobQueue(args.queue, args.lease)
+    if args.command == "enqueue":
+        print(f"Enqueued {queue.enqueue(page_refs(args.data))} new pages from {args.data}")
+    elif args.command == "work":
+        start = time.perf_counter()
+        run_workers(args.queue, args.workers, args.concurrency, args.cache, not args.no_fast_path, args.lease)
+        counts = queue.counts()
+        print(f"{counts['done']} done, {counts['failed']} failed in {time.perf_counter() - start:.1f}s "
+              f"with {args.workers} workers")
+    elif args.command == "collect":
+        print(f"Wrote {collect(queue, args.output)} products to {args.output} and products.json")
+        for name, error in queue.failures():
+            print(f"fail on {name}: {error}")
+    print(", ".join(f"{status} {count}" for status, count in queue.counts().items()))
@@ -15,9 +15,10 @@ async def hello_world():
     logging.info(response.message)
 
 if __name__ == "__main__":
-    import os
+    from ingest import iter_pages
     
-    # Rough estimate: 1 token ≈ 4 characters
+    # Rough estimate: 1 token ≈ 4 characters, good enough to compare preprocessing offline.
+    # The real numbers from the provider land in usage.json after an extract.py run.
     def estimate_tokens(text: str) -> int:
         return len(text) // 4
     
@@ -31,25 +32,22 @@ if __name__ == "__main__":
     total_raw = 0
     total_processed = 0
     
-    for filename in sorted(os.listdir("data")):
-        if filename.endswith(".html"):
-            with open(f"data/{filename}", "r", encoding="utf-8") as f:
-                html = f.read()
+    for filename, html in iter_pages("data"):
             
-            processed = preprocess_html(html)
+        processed = preprocess_html(html)
             
-            raw_tokens = estimate_tokens(html)
-            proc_tokens = estimate_tokens(processed)
-            reduction = (1 - proc_tokens / raw_tokens) * 100
+        raw_tokens = estimate_tokens(html)
+        proc_tokens = estimate_tokens(processed)
+        reduction = (1 - proc_tokens / raw_tokens) * 100
             
-            # Cost to process 1 million products
-            raw_cost = (raw_tokens * 1_000_000 / 1_000_000) * INPUT_PRICE
-            proc_cost = (proc_tokens * 1_000_000 / 1_000_000) * INPUT_PRICE
+        # Cost to process 1 million products
+        raw_cost = (raw_tokens * 1_000_000 / 1_000_000) * INPUT_PRICE
+        proc_cost = (proc_tokens * 1_000_000 / 1_000_000) * INPUT_PRICE
             
-            total_raw += raw_tokens
-            total_processed += proc_tokens
+        total_raw += raw_tokens
+        total_processed += proc_tokens
             
-            print(f"{filename:<20} {raw_tokens:>10,}t {proc_tokens:>10,}t {reduction:>9.0f}% ${proc_cost:>10,.0f}")
+        print(f"{filename:<20} {raw_tokens:>10,}t {proc_tokens:>10,}t {reduction:>9.0f}% ${proc_cost:>10,.0f}")
     
     print("=" * 70)
     total_reduction = (1 - total_processed / total_raw) * 100
@@ -0,0 +1,95 @@
+# Checkpoint manifest for extraction runs.
+# One JSON line per page outcome, appended as the run progresses. Replaying it tells a resumed run
+# which pages are already safely in the NDJSON output and which ones still need (re)doing.
+import hashlib
+import json
+import os
+import time
+
+
+def content_hash(html: str) -> str:
+    return hashlib.sha256(html.encode("utf-8")).hexdigest()
+
+
+class RunManifest:
+    """
+    Append-only log of {file, hash, status, segment, offset, error} records, last record per file wins.
+
+    status is "done" (product written to the output at segment/offset) or "failed" (error kept).
+    A page only counts as done for the same content hash, so an edited page is redone.
+    output_path, given when resuming, drops done entries whose line is not in the output as it is
+    now, before the resumed run appends to it and new records land at the lost ones' offsets.
+    """
+
+    def __init__(self, path: str = "run_manifest.jsonl", fresh: bool = False, output_path: str | None = None):
+        self.path = path
+        self.entries: dict[str, dict] = {}
+        if fresh and os.path.exists(path):
+            os.remove(path)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # torn last line from a crash
+                    self.entries[entry["file"]] = entry
+        if output_path is not None:
+            self.entries = {name: entry for name, entry in self.entries.items() if entry["status"] != "done"
+                            or _line_exists(output_path, entry["segment"], entry["offset"])}
+        self._file = open(path, "a", encoding="utf-8")
+        # a torn line has no newline, start our records on a fresh one
+        if self._file.tell() and not _ends_with_newline(path):
+            self._file.write("\n")
+
+    def _append(self, entry: dict) -> None:
+        entry["time"] = time.time()
+        self.entries[entry["file"]] = entry
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+
+    def record_done(self, name: str, digest: str, segment: int, offset: int) -> None:
+        self._append({"file": name, "hash": digest, "status": "done", "segment": segment, "offset": offset})
+
+    def record_failed(self, name: str, digest: str, error: Exception | str) -> None:
+        self._append({"file": name, "hash": digest, "status": "failed", "error": str(error)})
+
+    def is_done(self, name: str, digest: str) -> bool:
+        """True when the page finished with this content."""
+        entry = self.entries.get(name)
+        return entry is not None and entry["status"] == "done" and entry["hash"] == digest
+
+    def counts(self) -> dict[str, int]:
+        counts = {"done": 0, "failed": 0}
+        for entry in self.entries.values():
+            counts[entry["status"]] += 1
+        return counts
+
+    def sync(self) -> None:
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+
+
+def _ends_with_newline(path: str) -> bool:
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+def _line_exists(output_path: str, segment: int, offset: int) -> bool:
+    # the manifest can hit the disk before the NDJSON fsync does, so check the record survived.
+    # Only meaningful before anything new is appended, a later record could sit at a lost one's offset
+    path = f"{output_path}.{segment}"
+    if not os.path.exists(path):
+        path = output_path
+    try:
+        with open(path, "rb") as f:
+            f.seek(offset)
+            return f.readline().endswith(b"\n")
+    except OSError:
+        return False
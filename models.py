@@ -1,16 +1,19 @@
 from typing import Any
-from pathlib import Path
 from pydantic import BaseModel, field_validator
-from difflib import get_close_matches
-# Load categories once at module level
-CATEGORIES_FILE = Path(__file__).parent / "categories.txt"
-VALID_CATEGORIES = set()
-if CATEGORIES_FILE.exists():
-    with open(CATEGORIES_FILE, "r") as f:
-        for line in f:
-            line = line.strip()
-            if line and not line.startswith("#"):
-                VALID_CATEGORIES.add(line)
+from functools import lru_cache
+from taxonomy import CATEGORIES_FILE, get_index, valid_categories
+# Categories are loaded lazily on first use (see taxonomy.py), importing models stays cheap
+
+#kept so `from models import VALID_CATEGORIES` still works, it just loads on first access now
+def __getattr__(name: str) -> Any:
+    if name == "VALID_CATEGORIES":
+        return valid_categories()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+#LLMs tend to return the same slightly-off paths over and over, so remember recent answers
+@lru_cache(maxsize=4096)
+def closest_category(name: str) -> str | None:
+    return get_index().best_match(name, cutoff=0.6)
 
 class Category(BaseModel):
     # A category from Google's Product Taxonomy
@@ -20,12 +23,12 @@ class Category(BaseModel):
     @field_validator("name")
     @classmethod
     def validate_name_exists(cls, v: str) -> str:
-        if v in VALID_CATEGORIES:
+        if v in valid_categories():
             return v
-        #this gets close matches betwween v and valid cats
-        matches = get_close_matches(v,VALID_CATEGORIES, n=1, cutoff=0.6)
-        if matches:
-            return matches[0]
+        #this gets the closest match betwween v and valid cats
+        match = closest_category(v)
+        if match:
+            return match
         raise ValueError(f"Category '{v}' is not a valid category in categories.txt")
 
 class Price(BaseModel):
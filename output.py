@@ -0,0 +1,157 @@
+# Incremental output for extraction runs.
+# Products are appended to an NDJSON file as they are validated, so memory stays flat and a crash
+# loses at most the records since the last fsync. compact() turns the NDJSON back into the pretty
+# JSON arrays the backend and frontend read.
+import glob
+import json
+import os
+import textwrap
+
+from pydantic import BaseModel
+
+
+class NDJSONWriter:
+    """
+    Appends one JSON object per line to `path`.
+
+    fsync_every: flush and fsync after this many records (the file is always fsynced on close)
+    rotate_bytes: once the active file reaches this size it is renamed to path.1, path.2, ...
+    and a fresh file is started (None to never rotate)
+    """
+
+    def __init__(self, path: str = "products.ndjson", fsync_every: int = 100, rotate_bytes: int | None = None):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.rotate_bytes = rotate_bytes
+        self.records = 0
+        self.bytes_written = 0
+        self._unsynced = 0
+        self._segment = len(rotated_segments(path))
+        _drop_torn_line(path)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def write(self, record: BaseModel | dict) -> tuple[int, int]:
+        """
+        Append a record, returning the (segment, byte offset) it was written at.
+
+        Segment n is the file that is (or will be, once rotated) named path.n.
+        """
+        if self.rotate_bytes is not None and self._file.tell() >= self.rotate_bytes:
+            self.rotate()
+        line = record.model_dump_json() if isinstance(record, BaseModel) else json.dumps(record)
+        offset = self._file.tell()
+        self._file.write(line + "\n")
+        self.records += 1
+        self.bytes_written += len(line.encode("utf-8")) + 1
+        self._unsynced += 1
+        if self._unsynced >= self.fsync_every:
+            self.sync()
+        return self._segment + 1, offset
+
+    def flush(self) -> None:
+        """Hand the buffered records to the OS, they survive the process being killed (not a power cut)."""
+        self._file.flush()
+
+    def sync(self) -> None:
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    def rotate(self) -> None:
+        self.sync()
+        self._file.close()
+        self._segment += 1
+        os.replace(self.path, f"{self.path}.{self._segment}")
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def close(self) -> None:
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _drop_torn_line(path: str) -> None:
+    # appending after a partial line left by a crash would glue two records together
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        end = f.seek(0, os.SEEK_END)
+        position = end
+        # walk back from the end a block at a time until the last newline turns up
+        while position > 0:
+            start = max(0, position - 65536)
+            f.seek(start)
+            block = f.read(position - start)
+            if position == end and block.endswith(b"\n"):
+                return
+            newline = block.rfind(b"\n")
+            if newline != -1:
+                f.truncate(start + newline + 1)
+                return
+            position = start
+        f.truncate(0)
+
+
+def rotated_segments(path: str) -> list[str]:
+    # path.1, path.2, ... oldest first
+    segments = [p for p in glob.glob(glob.escape(path) + ".*") if p.rsplit(".", 1)[1].isdigit()]
+    return sorted(segments, key=lambda p: int(p.rsplit(".", 1)[1]))
+
+
+def iter_records(path: str):
+    """Yield every record of an NDJSON output, rotated segments first, skipping a torn last line."""
+    for segment in rotated_segments(path) + ([path] if os.path.exists(path) else []):
+        with open(segment, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # a crash mid-write leaves a partial final line, everything before it is fine
+                    continue
+
+
+def compact(ndjson_path: str, outputs: list[str]) -> int:
+    """
+    Write the NDJSON records into each output as a pretty JSON array (same layout as json.dump(indent=2)).
+
+    Records are streamed one at a time, so the whole run never has to fit in memory.
+    Returns the number of records written.
+    """
+    handles = []
+    for output in outputs:
+        if os.path.dirname(output):
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+        handles.append(open(output, "w"))
+    count = 0
+    try:
+        for record in iter_records(ndjson_path):
+            chunk = ("[\n" if count == 0 else ",\n") + textwrap.indent(json.dumps(record, indent=2), "  ")
+            for handle in handles:
+                handle.write(chunk)
+            count += 1
+        for handle in handles:
+            handle.write("\n]" if count else "[]")
+    finally:
+        for handle in handles:
+            handle.close()
+    return count
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compact NDJSON extraction output into pretty JSON files")
+    parser.add_argument("ndjson", nargs="?", default="products.ndjson")
+    parser.add_argument("outputs", nargs="*",
+                        default=["products.json", os.path.join("frontend", "src", "data", "products.json")])
+    args = parser.parse_args()
+    count = compact(args.ndjson, args.outputs)
+    print(f"Wrote {count} products to {' and '.join(args.outputs)}")
@@ -0,0 +1,184 @@
+# Multi-page packing: several preprocessed pages in one LLM request.
+# Every single-page call resends the whole extract_prompt; packing pages up to a token budget
+# amortizes the prompt and the per-request overhead. Each returned product is validated (and
+# repaired, repair.py) on its own, so one bad product doesn't sink the pack: pages missing or still
+# invalid in the answer fall back to the one-page path, and an answer that can't be read at all is
+# split in half and retried. A pack's token usage is spread over its pages by their size.
+import asyncio
+import json
+
+from pydantic import BaseModel, ValidationError
+
+import ai
+from cache import ExtractionCache
+from extraction import MODEL, estimate_tokens, extract_product
+from models import Product
+from prompts import extract_prompt, pack_prompt
+from repair import validate_or_repair
+from usage import page_context
+from wire import WireProduct, expand, response_format
+
+
+class PackedItem(BaseModel):
+    page_id: str
+    product: WireProduct
+
+
+class PackedProducts(BaseModel):
+    products: list[PackedItem]
+
+
+# the schema is sent as-is and items are validated one by one instead of by parse()
+RESPONSE_FORMAT = response_format(PackedProducts)
+
+
+def pack_message(pages: list[tuple[str, str]]) -> str:
+    # short ids keep the markers cheap, the caller maps them back to page names
+    return "\n\n".join(f"=== PAGE {page_id} ===\n{processed}" for page_id, processed in pages)
+
+
+async def _single(name: str, processed: str, cache: ExtractionCache | None, model: str) -> Product | Exception:
+    try:
+        with page_context(name):
+            return await extract_product(processed, cache, model)
+    except Exception as e:
+        return e
+
+
+async def _item(name: str, processed: str, data, model: str) -> Product | None:
+    # a packed answer gets the same field repair as a one-page answer, None sends it to the one-page path
+    try:
+        with page_context(name):
+            return await validate_or_repair(expand(data or {}), processed, model)
+    except (ValidationError, AttributeError):
+        return None
+
+
+async def extract_packed(pages: list[tuple[str, str]], cache: ExtractionCache | None = None,
+                         stats: dict | None = None, model: str | None = None) -> dict[str, Product | Exception]:
+    """
+    Extract products for (name, processed) pages with as few requests as possible.
+
+    Returns {name: Product or the error for that page}. API errors that survive ai.responses'
+    retries are raised, they would hit the smaller requests just the same. stats, if given,
+    counts "packs", "splits" and "fallbacks". model defaults to MODEL.
+    """
+    model = model or MODEL
+    stats = stats if stats is not None else {}
+    results: dict[str, Product | Exception] = {}
+    todo = []
+    for name, processed in pages:
+        product = cache.get(cache.key(processed, model, extract_prompt)) if cache is not None else None
+        if product is not None:
+            results[name] = product
+        else:
+            todo.append((name, processed))
+    if len(todo) == 1:
+        name, processed = todo[0]
+        results[name] = await _single(name, processed, cache, model)
+        return results
+    if not todo:
+        return results
+
+    ids = {f"P{i + 1}": (name, processed) for i, (name, processed) in enumerate(todo)}
+    stats["packs"] = stats.get("packs", 0) + 1
+    with page_context({name: len(processed) for name, processed in todo}):
+        response = await ai.responses(
+            model=model,
+            input=[
+                {"role": "system", "content": pack_prompt},
+                {"role": "user",
+                 "content": pack_message([(page_id, processed) for page_id, (_, processed) in ids.items()])},
+            ],
+            response_format=RESPONSE_FORMAT,
+        )
+    try:
+        items = json.loads(response.choices[0].message.content)["products"]
+        if not isinstance(items, list):
+            raise TypeError("products is not a list")
+    except (json.JSONDecodeError, KeyError, TypeError) as e:
+        # unreadable (often cut off at the output limit): halve the pack and try again
+        stats["splits"] = stats.get("splits", 0) + 1
+        half = len(todo) // 2
+        for part in await asyncio.gather(extract_packed(todo[:half], cache, stats, model),
+                                         extract_packed(todo[half:], cache, stats, model)):
+            results.update(part)
+        return results
+
+    answers = {}
+    for item in items:
+        if isinstance(item, dict) and item.get("page_id") in ids:
+            answers.setdefault(item["page_id"], item.get("product"))  # first answer for a page wins
+    products = await asyncio.gather(*(_item(*ids[page_id], data, model) for page_id, data in answers.items()))
+    for page_id, product in zip(answers, products):
+        if product is None:
+            continue
+        name, processed = ids[page_id]
+        results[name] = product
+        if cache is not None:
+            cache.put(cache.key(processed, model, extract_prompt), product,
+                      estimate_tokens(processed), estimate_tokens(product.model_dump_json()))
+
+    # pages the pack missed or got wrong go through the one-page path
+    missing = [(name, processed) for name, processed in todo if name not in results]
+    stats["fallbacks"] = stats.get("fallbacks", 0) + len(missing)
+    for (name, _), product in zip(missing, await asyncio.gather(*(_single(n, p, cache, model) for n, p in missing))):
+        results[name] = product
+    return results
+
+
+#bench: one page per call vs packed requests against the fake provider, same pages and concurrency
+if __name__ == "__main__":
+    import argparse
+    import logging
+    import os
+    import time
+
+    import extract
+    from fake_openrouter import FakeOpenRouter
+
+    parser = argparse.ArgumentParser(description="Compare one-page-per-call with packed requests on a fake model")
+    parser.add_argument("--data", default="data", help="pages are cycled from this folder")
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.8, help="seconds to first token per request")
+    parser.add_argument("--token-latency", type=float, default=0.005, help="seconds per completion token")
+    parser.add_argument("--pack-tokens", type=int, default=12_000)
+    parser.add_argument("--pack-pages", type=int, default=8)
+    args = parser.parse_args()
+    logging.getLogger("ai").setLevel(logging.ERROR)
+
+    source = list(extract.iter_html_files(args.data))
+    # a marker per copy keeps every page distinct, so nothing is deduplicated along the way
+    pages = [(f"{i}-{name}", html.replace("</body>", f"<p>copy {i}</p></body>"))
+             for i, (name, html) in zip(range(args.pages), source * (args.pages // len(source) + 1))]
+
+    def scenario(label: str, pack_tokens: int) -> None:
+        fake = FakeOpenRouter(latency=args.latency, token_latency=args.token_latency).start()
+        os.environ["open_router_key"] = "fake"
+        os.environ["open_router_base_url"] = fake.base_url
+        ai.usage.reset()
+        stats = {}
+
+        async def go():
+            start = time.perf_counter()
+            results = [r async for r in extract.extract_pages(
+                pages, args.concurrency, fast_path=False, pack_tokens=pack_tokens, pack_pages=args.pack_pages,
+                pack_stats=stats)]
+            elapsed = time.perf_counter() - start
+            await ai.clients.close()
+            return elapsed, sum(r.error is not None for r in results)
+
+        try:
+            elapsed, failed = asyncio.run(go())
+        finally:
+            fake.stop()
+        total = ai.usage.totals()
+        print(f"{label:<18} {fake.requests:>9} {len(pages) / elapsed:>10.1f} {total.prompt_tokens / len(pages):>13,.0f} "
+              f"{total.completion_tokens / len(pages):>13,.0f} ${total.cost / len(pages) * 1000:>10.4f} {failed:>7}")
+
+    print(f"{len(pages)} pages, concurrency {args.concurrency}, {args.latency}s + {args.token_latency * 1000:.0f}ms/token")
+    print(f"{'mode':<18} {'requests':>9} {'pages/sec':>10} {'prompt/page':>13} {'compl./page':>13} "
+          f"{'$/1k pages':>11} {'failed':>7}")
+    scenario("one page per call", 0)
+    scenario(f"packed ({args.pack_pages} max)", args.pack_tokens)
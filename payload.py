@@ -0,0 +1,206 @@
+# Token-minimal LLM payload.
+# format_payload embeds every JSON-LD block and meta tag verbatim with indent=2. Input tokens are
+# most of what a page costs, so this builder keeps only product-relevant schema.org nodes and keys,
+# serializes without whitespace, and drops values already said once (variant descriptions that
+# repeat the product's, og:/twitter: copies of the same text, page text lines that are in the
+# structured data). Truncation happens last, so the 10,000 characters go to text that is new.
+import json
+
+from preprocess import format_payload
+
+TEXT_LIMIT = 10000
+
+# top level nodes worth sending, BreadcrumbList is kept (compacted) because it names the category
+KEEP_TYPES = {"Product", "ProductGroup", "IndividualProduct", "ProductModel", "Offer", "AggregateOffer",
+              "VideoObject", "BreadcrumbList"}
+# keys that never help fill a Product field
+DROP_KEYS = {
+    "@context", "@id", "itemCondition", "hasMerchantReturnPolicy", "shippingDetails", "seller",
+    "aggregateRating", "review", "potentialAction", "mainEntityOfPage", "publisher", "isPartOf",
+    "priceValidUntil", "audience", "logo", "sameAs", "isRelatedTo", "isSimilarTo",
+    "isAccessoryOrSparePartFor", "gtin", "gtin8", "gtin12", "gtin13", "gtin14", "productID",
+}
+# "url" is the image itself on these, everywhere else it's a page link (dropped unless it's all a node has)
+URL_TYPES = {"ImageObject", "VideoObject"}
+# meta tags carrying product data; twitter: copies come last so og: wins the dedup
+META_KEYS = ["og:title", "og:description", "og:image", "og:video", "og:price:amount", "og:price:currency",
+             "product:brand", "product:availability", "product:price:amount", "product:price:currency",
+             "product:category", "title", "description", "keywords",
+             "twitter:title", "twitter:description", "twitter:image"]
+SCHEMA_PREFIXES = ("https://schema.org/", "http://schema.org/")
+# strings shorter than this are too generic to deduplicate (colors, sizes, currency codes)
+MIN_DEDUPE_CHARS = 40
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.split())
+
+
+def _type_set(node: dict) -> set:
+    types = node.get("@type", [])
+    return set(types) if isinstance(types, list) else {types}
+
+
+def _prune(value, key: str | None, seen: dict[str, set], node_types: set):
+    # returns the pruned value, or None when nothing useful is left
+    if isinstance(value, dict):
+        types = _type_set(value)
+        # a bare {"url": ...} is a reference to another variant's page, the link is all there is
+        reference = value.keys() <= {"url", "@id", "@type"}
+        out = {}
+        for k, v in value.items():
+            if k in DROP_KEYS or (k == "url" and not types & URL_TYPES and not reference):
+                continue
+            if k == "@type" and types & {"ListItem", "Brand", "Offer"} and len(types) == 1:
+                continue  # implied by where the node sits
+            if "BreadcrumbList" in node_types and k == "item" and value.get("name"):
+                continue  # the crumb's name is the signal, not its link
+            pruned = _prune(v, k, seen, types or node_types)
+            if pruned is not None:
+                out[k] = pruned
+        return out or None
+    if isinstance(value, list):
+        out = [p for p in (_prune(v, key, seen, node_types) for v in value) if p is not None]
+        return out or None
+    if isinstance(value, str):
+        if value.startswith(SCHEMA_PREFIXES):
+            return value.rsplit("/", 1)[1]
+        text = _normalize(value)
+        if not text:
+            return None
+        # the same long value under the same key (every variant repeating the description) is sent once
+        if len(text) >= MIN_DEDUPE_CHARS and key != "name":
+            if text in seen.setdefault(key, set()):
+                return None
+            seen[key].add(text)
+        return value.strip()
+    return value
+
+
+def _flatten(jsonld) -> list[dict]:
+    nodes = []
+    for item in jsonld if isinstance(jsonld, list) else [jsonld]:
+        if isinstance(item, list):
+            nodes.extend(_flatten(item))
+        elif isinstance(item, dict):
+            if "@graph" in item:
+                nodes.extend(_flatten(item["@graph"]))
+            else:
+                nodes.append(item)
+    return nodes
+
+
+def prune_jsonld(jsonld: list) -> list[dict]:
+    """Keep product-relevant nodes and keys, product nodes first, repeated long values removed."""
+    nodes = [n for n in _flatten(jsonld) if _type_set(n) & KEEP_TYPES]
+    nodes.sort(key=lambda n: not _type_set(n) & {"Product", "ProductGroup"})
+    seen: dict[str, set] = {}
+    return [p for p in (_prune(n, None, seen, _type_set(n)) for n in nodes) if p is not None]
+
+
+def _strings(value, out: set) -> set:
+    if isinstance(value, dict):
+        for v in value.values():
+            _strings(v, out)
+    elif isinstance(value, list):
+        for v in value:
+            _strings(v, out)
+    elif isinstance(value, str):
+        out.add(_normalize(value))
+    return out
+
+
+def prune_meta(meta: dict, known: set[str]) -> dict:
+    """Product meta tags only, skipping values already in `known` (normalized strings, updated in place)."""
+    kept = {}
+    for key in META_KEYS:
+        value = meta.get(key)
+        if not value or _normalize(value) in known:
+            continue
+        known.add(_normalize(value))
+        kept[key] = value.strip()
+    # keep the page's own order so the payload reads like the page
+    return {k: kept[k] for k in meta if k in kept}
+
+
+def dedupe_text(clean_text: str, known: set[str]) -> str:
+    """Drop page text lines that repeat a long structured value word for word."""
+    lines = [line for line in clean_text.split("\n")
+             if len(line) < MIN_DEDUPE_CHARS or _normalize(line) not in known]
+    return "\n".join(lines)
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+
+def compact_payload(jsonld: list, meta: dict, clean_text: str) -> str:
+    """Same sections as format_payload, pruned, deduplicated and serialized without whitespace."""
+    jsonld = prune_jsonld(jsonld)
+    known = _strings(jsonld, set())
+    meta = prune_meta(meta, known)
+    clean_text = dedupe_text(clean_text, known)
+    if len(clean_text) > TEXT_LIMIT:
+        clean_text = clean_text[:TEXT_LIMIT] + "\n... [truncated]"
+    parts = []
+    if jsonld:
+        parts += ["JSON-LD Data", _dumps(jsonld)]
+    if meta:
+        parts += ["Meta Tags", _dumps(meta)]
+    parts += ["Page Content", clean_text]
+    return "\n".join(parts)
+
+
+#report: payload size before/after on data/*.html, and whether the structured fields survive pruning
+if __name__ == "__main__":
+    import argparse
+    import asyncio
+    import os
+
+    from bs4 import BeautifulSoup
+
+    from preprocess import scan_html
+    from structured import map_structured
+
+    parser = argparse.ArgumentParser(description="Token reduction of the compact payload on data/*.html")
+    parser.add_argument("--data", default="data")
+    parser.add_argument("--llm", action="store_true", help="also extract both payloads with the model and diff")
+    args = parser.parse_args()
+
+    def tokens(text: str) -> int:
+        return len(text) // 4
+
+    print("=" * 72)
+    print(f"{'File':<20} {'Current':>10} {'Compact':>10} {'Reduction':>10} {'Fields same':>14}")
+    print("=" * 72)
+    totals = [0, 0]
+    pairs = []
+    for filename in sorted(os.listdir(args.data)):
+        if not filename.endswith(".html"):
+            continue
+        with open(os.path.join(args.data, filename), "r", encoding="utf-8") as f:
+            jsonld, meta, text = scan_html(BeautifulSoup(f.read(), "html.parser"))
+        current = format_payload(jsonld, meta, text)
+        compact = compact_payload(jsonld, meta, text)
+        pairs.append((filename, current, compact))
+        # the deterministic mapper reading the pruned data must get the same fields as from the full data
+        known = _strings(prune_jsonld(jsonld), set())
+        same = map_structured(prune_jsonld(jsonld), prune_meta(meta, known)) == map_structured(jsonld, meta)
+        totals[0] += tokens(current)
+        totals[1] += tokens(compact)
+        print(f"{filename:<20} {tokens(current):>9,}t {tokens(compact):>9,}t "
+              f"{1 - tokens(compact) / tokens(current):>9.0%} {'yes' if same else 'NO':>14}")
+    print("=" * 72)
+    print(f"{'TOTAL':<20} {totals[0]:>9,}t {totals[1]:>9,}t {1 - totals[1] / totals[0]:>9.0%}")
+
+    if args.llm:
+        import extract
+
+        async def compare():
+            for filename, current, compact in pairs:
+                before = (await extract.extract_product(current)).model_dump()
+                after = (await extract.extract_product(compact)).model_dump()
+                changed = [k for k in before if before[k] != after[k]]
+                print(f"{filename:<20} {'same' if not changed else 'changed: ' + ', '.join(changed)}")
+
+        asyncio.run(compare())
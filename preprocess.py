@@ -1,6 +1,11 @@
 # HTML Preprocessor -
 import json
-from bs4 import BeautifulSoup
+import re
+from html.parser import HTMLParser
+from bs4 import BeautifulSoup, Tag
+from bs4.builder import HTMLTreeBuilder
+from bs4.builder._htmlparser import BeautifulSoupHTMLParser
+from bs4.dammit import EntitySubstitution
 #gets the scripts
 def extract_jsonld(soup: BeautifulSoup) -> list[dict]:
     jsonld_data = []
@@ -44,7 +49,10 @@ def preprocess_html(html: str) -> str:
     jsonld = extract_jsonld(soup)
     meta = extract_meta_tags(soup)
     clean_text = clean_html(soup)
+    return format_payload(jsonld, meta, clean_text)
 
+#builds the text we send to the LLM out of the extracted pieces
+def format_payload(jsonld: list, meta: dict, clean_text: str) -> str:
     if len(clean_text) > 10000:
         clean_text = clean_text[:10000] + "\n... [truncated]"
     parts = []
@@ -63,9 +71,234 @@ def preprocess_html(html: str) -> str:
     #Join all parts into one string
     return "\n".join(parts)
 
+SKIP_TAGS = {"script", "style", "noscript", "iframe", "svg"}
+
+#one walk over the tree that collects everything the three functions above collect
+def scan_html(soup: BeautifulSoup) -> tuple[list[dict], dict, str]:
+    """
+    Gather JSON-LD, meta tags, title and visible text in a single tree walk.
+
+    Gives the same results as extract_jsonld + extract_meta_tags + clean_html, but without
+    the str(soup) copy and re-parse or the separate find_all traversals. Tags in SKIP_TAGS are
+    still descended into (JSON-LD lives in <script>, titles show up inside <svg>), their text
+    just isn't collected.
+    """
+    jsonld = []
+    meta = {}
+    title = None
+    texts = []
+    text_types = soup.interesting_string_types
+    # explicit stack instead of recursion, html.parser trees can get very deep
+    stack = [(iter(soup.contents), False)]
+    while stack:
+        children, skipping = stack[-1]
+        element = next(children, None)
+        if element is None:
+            stack.pop()
+            continue
+        if isinstance(element, Tag):
+            name = element.name
+            if name == "script" and element.get("type") == "application/ld+json":
+                try:
+                    jsonld.append(json.loads(element.string))
+                except (json.JSONDecodeError, TypeError):
+                    pass
+            elif name == "meta":
+                key = element.get("name") or element.get("property")
+                content = element.get("content")
+                if key and content:
+                    meta[key] = content
+            elif name == "title" and title is None:
+                title = element
+            if element.contents:
+                stack.append((iter(element.contents), skipping or name in SKIP_TAGS))
+        elif not skipping and type(element) in text_types:
+            stripped = element.strip()
+            if stripped:
+                texts.append(stripped)
+    if title is not None:
+        meta["title"] = title.get_text(strip=True)
+    return jsonld, meta, "\n".join(texts)
+
+#same output as preprocess_html, one parse and one walk instead of two parses and four walks
+def preprocess_html_fast(html: str) -> str:
+    jsonld, meta, clean_text = scan_html(BeautifulSoup(html, "html.parser"))
+    return format_payload(jsonld, meta, clean_text)
+
+
+# characters of page text the payload keeps, more is truncated
+TEXT_BUDGET = 10000
+# html fed to the tokenizer at a time, the budget is checked between chunks
+FEED_CHARS = 32 * 1024
+# strings inside these are Script/Stylesheet/TemplateString/RubyText in BeautifulSoup, never page text
+_NOT_TEXT = SKIP_TAGS | {"template", "rt", "rp"}
+_ATTRS = r"""(?:[^>"']|"[^"]*"|'[^']*')*"""
+# what still matters once the text budget is full: ld+json scripts, meta tags and a title. Comments,
+# scripts and styles are matched whole so a "<meta" inside them isn't taken for a tag
+_SKIM = re.compile(r"<!--.*?(?:-->|\Z)"
+                   rf"|<(script|style)(?=[\s/>]){_ATTRS}>.*?(?:</\s*\1\s*>|\Z)"
+                   rf"|<meta(?=[\s/>]){_ATTRS}>"
+                   rf"|<title(?=[\s/>]){_ATTRS}>.*?(?:</\s*title\s*>|\Z)", re.I | re.S)
+
+
+#tokenizes without building a tree, text collection stops once the budget is full
+class LazyScanner(HTMLParser):
+    """
+    Same JSON-LD, meta tags, title and text as scan_html, gathered from the tokenizer events.
+
+    Entities are decoded and text is split into strings the way BeautifulSoup's html.parser
+    builder does, and tags are nested the same way (end tags close back to their start tag,
+    void elements never open), so the output matches scan_html on the same html.
+    """
+
+    def __init__(self, text_chars: int | None = TEXT_BUDGET):
+        super().__init__(convert_charrefs=False)
+        self.text_chars = text_chars
+        self.jsonld = []
+        self.meta = {}
+        self.texts = []
+        self.text_size = -1
+        self.full = False
+        self.title = None
+        self._title_depth = None
+        self._stack = []
+        self._skipping = 0
+        self._data = []
+        self._script = None
+        self._closed_voids = []
+
+    def _flush(self) -> None:
+        # the pending data is one string, BeautifulSoup ends a string at every tag event too
+        if not self._data:
+            return
+        text = "".join(self._data).strip()
+        self._data = []
+        if not text:
+            return
+        if self._title_depth is not None and len(self._stack) >= self._title_depth:
+            self.title.append(text)
+        if not self._skipping and not self.full:
+            self.texts.append(text)
+            self.text_size += len(text) + 1
+            self.full = self.text_chars is not None and self.text_size > self.text_chars
+
+    def handle_starttag(self, tag, attrs, self_closing=False):
+        self._flush()
+        attrs = {key: value or "" for key, value in attrs}
+        if tag == "meta":
+            key = attrs.get("name") or attrs.get("property")
+            if key and attrs.get("content"):
+                self.meta[key] = attrs["content"]
+        elif tag == "title" and self.title is None:
+            self.title = []
+            self._title_depth = len(self._stack) + 1
+        if tag in HTMLTreeBuilder.DEFAULT_EMPTY_ELEMENT_TAGS and not self_closing:
+            # closed right away, a later </tag> for it is ignored
+            self._closed_voids.append(tag)
+            return
+        if tag == "script" and attrs.get("type") == "application/ld+json":
+            self._script = len(self._stack)
+        self._stack.append(tag)
+        self._skipping += tag in _NOT_TEXT
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs, self_closing=True)
+        self.handle_endtag(tag, self_closing=True)
+
+    def handle_endtag(self, tag, self_closing=False):
+        if not self_closing and tag in self._closed_voids:
+            self._closed_voids.remove(tag)
+            return
+        if tag == "script" and self._script == len(self._stack) - 1:
+            # the script's one string is everything between its tags
+            try:
+                self.jsonld.append(json.loads("".join(self._data)))
+            except json.JSONDecodeError:
+                pass
+            self._data = []
+            self._script = None
+        self._flush()
+        if tag not in self._stack:
+            return
+        # closes everything opened after the matching start tag
+        while self._stack:
+            name = self._stack.pop()
+            self._skipping -= name in _NOT_TEXT
+            if self._title_depth is not None and len(self._stack) < self._title_depth:
+                self._title_depth = None
+            if name == tag:
+                break
+
+    def handle_data(self, data):
+        self._data.append(data)
+
+    def handle_charref(self, name):
+        dereferenced, _, extra = BeautifulSoupHTMLParser._dereference_numeric_character_reference(name)
+        self._data += [dereferenced, extra]
+
+    def handle_entityref(self, name):
+        self._data.append(EntitySubstitution.HTML_ENTITY_TO_CHARACTER.get(name, f"&{name}"))
+
+    def unknown_decl(self, data):
+        self._flush()
+        # <![CDATA[...]]> is page text to BeautifulSoup too
+        if data.upper().startswith("CDATA["):
+            self._data.append(data[len("CDATA["):])
+            self._flush()
+
+    def handle_comment(self, data):
+        self._flush()
+
+    def handle_decl(self, decl):
+        self._flush()
+
+    def handle_pi(self, data):
+        self._flush()
+
+    def skim(self, html: str) -> None:
+        """Pick the ld+json scripts, meta tags and title out of the rest of the page without tokenizing it."""
+        for match in _SKIM.finditer(html):
+            block = match.group(0)
+            kind = block[1:7].lower()
+            if kind.startswith("meta") or kind.startswith("title") and self.title is None:
+                self.feed(block)
+            elif kind.startswith("script") and "ld+json" in block[:block.find(">")].lower():
+                self.feed(block)
+
+
+def scan_html_lazy(html: str, text_chars: int | None = TEXT_BUDGET) -> tuple[list[dict], dict, str, bool]:
+    """
+    scan_html without the tree: (jsonld, meta, text, complete).
+
+    Page text stops at the first string past text_chars characters (None reads it all) and the
+    rest of the page is skimmed for JSON-LD, meta tags and the title only. complete is False when
+    that happened, so callers that drop lines before truncating can ask again for all the text.
+    """
+    scanner = LazyScanner(text_chars)
+    fed = 0
+    while fed < len(html) and not (scanner.full and scanner.cdata_elem is None):
+        scanner.feed(html[fed:fed + FEED_CHARS])
+        fed += FEED_CHARS
+    if fed < len(html):
+        rest = scanner.rawdata + html[fed:]
+        scanner.rawdata = ""
+        scanner.skim(rest)
+    scanner.close()
+    scanner._flush()
+    meta = scanner.meta
+    if scanner.title is not None:
+        meta["title"] = "".join(scanner.title)
+    return scanner.jsonld, meta, "\n".join(scanner.texts), not scanner.full
+
+
+#same output as preprocess_html, stops reading page text once the payload's 10,000 characters are there
+def preprocess_html_lazy(html: str) -> str:
+    jsonld, meta, clean_text, _ = scan_html_lazy(html)
+    return format_payload(jsonld, meta, clean_text)
+
 #ai built test to see the difference
 if __name__ == "__main__":
-    import os
+    from ingest import iter_pages
 
     # Rough estimate: 1 token ≈ 4 characters
     def estimate_tokens(text: str) -> int:
@@ -81,21 +314,18 @@ if __name__ == "__main__":
     total_raw = 0
     total_processed = 0
 
-    for filename in sorted(os.listdir("data")):
-        if filename.endswith(".html"):
-            with open(f"data/{filename}", "r", encoding="utf-8") as f:
-                html = f.read()
+    for filename, html in iter_pages("data"):
 
-            processed = preprocess_html(html)
+        processed = preprocess_html(html)
 
-            raw_tokens = estimate_tokens(html)
-            proc_tokens = estimate_tokens(processed)
-            reduction = (1 - proc_tokens / raw_tokens) * 100
+        raw_tokens = estimate_tokens(html)
+        proc_tokens = estimate_tokens(processed)
+        reduction = (1 - proc_tokens / raw_tokens) * 100
 
-            total_raw += raw_tokens
-            total_processed += proc_tokens
+        total_raw += raw_tokens
+        total_processed += proc_tokens
 
-            print(f"{filename:<20} {raw_tokens:>10,}t {proc_tokens:>10,}t {reduction:>9.0f}%")
+        print(f"{filename:<20} {raw_tokens:>10,}t {proc_tokens:>10,}t {reduction:>9.0f}%")
 
     print("=" * 70)
     total_reduction = (1 - total_processed / total_raw) * 100
@@ -0,0 +1,159 @@
+# Preprocessing stage that runs the HTML preprocessor in worker processes.
+# BeautifulSoup parsing is pure CPU, so on the event loop thread it stalls every in-flight
+# LLM call. Here pages are parsed across cores and handed back to the async extraction stage.
+import asyncio
+import multiprocessing
+import os
+import time
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from bs4 import BeautifulSoup
+
+from boilerplate import load_model, page_domain
+from payload import compact_payload
+from preprocess import format_payload, scan_html, scan_html_lazy
+from tracing import tracer
+
+
+# what the extraction stage gets for each page: the LLM payload plus the structured data behind it
+@dataclass
+class PreparedPage:
+    processed: str
+    jsonld: list
+    meta: dict
+
+
+def prepare_page(html: str, compact: bool = True, boilerplate: str | None = None, lazy: bool = True) -> PreparedPage:
+    # compact=False sends the full indent=2 payload of preprocess_html instead of the pruned one
+    # boilerplate is the path of a learned model, its lines for this page's site are dropped before truncation
+    # lazy reads the page with the tokenizer only (preprocess.LazyScanner), lazy=False builds the full soup
+    if not lazy:
+        jsonld, meta, clean_text = scan_html(BeautifulSoup(html, "html.parser"))
+        complete = True
+    else:
+        jsonld, meta, clean_text, complete = scan_html_lazy(html)
+    build = compact_payload if compact else format_payload
+    while True:
+        text = load_model(boilerplate).strip(page_domain(jsonld, meta), clean_text) if boilerplate else clean_text
+        processed = build(jsonld, meta, text)
+        # boilerplate and dedup drop lines before truncating, when that leaves the payload short of
+        # the limit the text that was skipped is needed after all
+        if complete or processed.endswith("... [truncated]"):
+            return PreparedPage(processed, jsonld, meta)
+        jsonld, meta, clean_text, complete = scan_html_lazy(html, None)
+
+
+def preprocess_chunk(htmls: list[str], compact: bool = True, boilerplate: str | None = None,
+                     lazy: bool = True) -> list[PreparedPage | Exception]:
+    """Worker entry point: preprocess a chunk of pages, returning the error instead of raising for bad ones."""
+    results = []
+    for html in htmls:
+        try:
+            results.append(prepare_page(html, compact, boilerplate, lazy))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+def _chunks(pages, chunksize: int):
+    pages = iter(pages)
+    while chunk := list(islice(pages, chunksize)):
+        yield chunk
+
+
+async def preprocess_stage(pages, workers: int = 0, chunksize: int = 8, executor: ProcessPoolExecutor | None = None,
+                           compact: bool = True, boilerplate: str | None = None, lazy: bool = True):
+    """
+    Yield (name, PreparedPage) for each (name, html) page, or (name, Exception) on failure.
+
+    workers=0 preprocesses inline on the event loop like before. Otherwise pages are submitted
+    to a process pool in chunks of `chunksize` (fewer, bigger IPC round trips), with at most
+    2 chunks per worker outstanding so a huge input iterator is never read ahead unbounded.
+    Results come back in completion order.
+    """
+    if not workers and executor is None:
+        for name, html in pages:
+            with tracer.span("preprocess", len(html)) as span:
+                page = preprocess_chunk([html], compact, boilerplate, lazy)[0]
+                span.bytes_out = len(page.processed) if isinstance(page, PreparedPage) else 0
+            yield name, page
+            # let in-flight LLM calls make progress between pages
+            await asyncio.sleep(0)
+        return
+
+    loop = asyncio.get_running_loop()
+    own_executor = executor is None
+    if own_executor:
+        # spawn instead of fork: the loop process already runs threads (http client, executors)
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    max_outstanding = max(1, (workers or os.cpu_count()) * 2)
+
+    def finished(future):
+        names, submitted, size = pending.pop(future)
+        results = future.result()
+        # measured from submission, so it includes time queued behind other chunks
+        tracer.record("preprocess_chunk", time.perf_counter() - submitted, bytes_in=size, start=submitted,
+                      bytes_out=sum(len(r.processed) for r in results if isinstance(r, PreparedPage)))
+        return zip(names, results)
+
+    try:
+        pending = {}
+        for chunk in _chunks(pages, chunksize):
+            if len(pending) >= max_outstanding:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    for item in finished(future):
+                        yield item
+            htmls = [html for _, html in chunk]
+            future = loop.run_in_executor(executor, preprocess_chunk, htmls, compact, boilerplate, lazy)
+            pending[future] = ([name for name, _ in chunk], time.perf_counter(), sum(map(len, htmls)))
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                for item in finished(future):
+                    yield item
+    finally:
+        if own_executor:
+            executor.shutdown(cancel_futures=True)
+
+
+#benchmark: pages/sec for inline vs pooled preprocessing on a replicated copy of data/
+if __name__ == "__main__":
+    import argparse
+    import shutil
+    import tempfile
+
+    parser = argparse.ArgumentParser(description="Benchmark inline vs process pool preprocessing")
+    parser.add_argument("--pages", type=int, default=1000, help="number of replicated pages")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunksize", type=int, default=8)
+    args = parser.parse_args()
+
+    sources = sorted(f for f in os.listdir("data") if f.endswith(".html"))
+    corpus = tempfile.mkdtemp(prefix="preprocess_bench_")
+    for i in range(args.pages):
+        src = sources[i % len(sources)]
+        shutil.copyfile(os.path.join("data", src), os.path.join(corpus, f"{i:06d}_{src}"))
+
+    def iter_corpus():
+        for filename in sorted(os.listdir(corpus)):
+            with open(os.path.join(corpus, filename), "r", encoding="utf-8") as f:
+                yield filename, f.read()
+
+    async def run(workers: int) -> float:
+        start = time.perf_counter()
+        count = 0
+        async for _ in preprocess_stage(iter_corpus(), workers=workers, chunksize=args.chunksize):
+            count += 1
+        return count / (time.perf_counter() - start)
+
+    try:
+        print(f"{args.pages} pages replicated from {len(sources)} files in data/ ({os.cpu_count()} CPUs)")
+        inline = asyncio.run(run(0))
+        print(f"{'inline':<24} {inline:>8.1f} pages/sec")
+        pooled = asyncio.run(run(args.workers))
+        print(f"{f'pool ({args.workers} workers)':<24} {pooled:>8.1f} pages/sec  ({pooled / inline:.1f}x)")
+    finally:
+        shutil.rmtree(corpus)
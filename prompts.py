@@ -46,4 +46,31 @@ DO NOT invent categories. Use the most specific matching category that exists.
 
 ## Data Sources:
 Look for structured data first (JSON-LD, meta tags), then fall back to page content.
+
+## Output Format:
+Answer with these short keys (see wire.py). Use "" or 0 for anything not on the page, never null.
+- n: name, p: price, c: currency, cp: compare_at_price
+- d: description, f: key_features, i: image_urls, v: video_url
+- cat: category, b: brand
+- sz: every size offered, in page order ([] if the product has no sizes)
+- m: one row per color (a single row with n "" if there are sizes but no colors), instead of listing variants:
+  - n: color name
+  - a: one character per size in sz: "1" in stock, "0" out of stock, "-" not sold in this color. "" if all in stock
+  - s: SKU per size in sz, or a single SKU if the whole color shares one, [] if none
+  - p: price per size in sz, or a single price if the whole color shares one, [] if it's the main price; 0 for a size at the main price
+  - cp: compare_at_price (original price of a size on sale), laid out like p, [] if not on sale
+"""
+
+#same guidelines, for requests that carry several pages at once (packing.py)
+pack_prompt = extract_prompt + """
+## Multiple Pages:
+The input holds several product pages, each starting with a line "=== PAGE <id> ===".
+Extract one product per page and return them all in `products`, each with its page's id in `page_id`.
+Never mix information between pages.
+"""
+
+#follow-up request for a single field that failed validation (repair.py)
+repair_prompt = """One field of a product extracted from a web page was missing or invalid.
+Return only that field, filled from the page excerpt. The field's current value and the reason it
+was rejected are given. If choices are listed, pick the one that fits the product best.
 """
@@ -0,0 +1,211 @@
+# Client-side limits for the extraction pipeline
+import asyncio
+import random
+import time
+from collections import deque
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+
+
+class TokenBudget:
+    """
+    Token bucket for a tokens-per-minute budget.
+
+    The bucket starts full and refills continuously at tokens_per_minute / 60 per second.
+    A request bigger than the whole bucket is let through once the bucket is full,
+    otherwise one huge page would block forever.
+    """
+
+    def __init__(self, tokens_per_minute: int):
+        if tokens_per_minute <= 0:
+            raise ValueError("tokens_per_minute must be positive")
+        self.capacity = float(tokens_per_minute)
+        self.rate = tokens_per_minute / 60.0
+        self.available = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, tokens: int) -> None:
+        # the lock keeps waiters first come first served so big pages don't starve
+        async with self._lock:
+            needed = min(float(tokens), self.capacity)
+            self._refill()
+            while self.available < needed:
+                await asyncio.sleep((needed - self.available) / self.rate)
+                self._refill()
+            self.available -= tokens
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit for calls to the provider.
+
+    Every success raises the limit by `increase / limit` (about +increase per window of calls),
+    every throttle (429, overload, timeout) multiplies it by `backoff`. Only one decrease happens
+    per window: throttles from calls that started before the last decrease are already priced in,
+    so a burst of 429s from one overloaded moment halves the limit once, not ten times.
+    Waiters are plain futures rather than an asyncio.Condition, so one limiter can outlive the
+    event loop of a single asyncio.run.
+    """
+
+    def __init__(self, initial: float = 8, minimum: float = 1, maximum: float = 64,
+                 increase: float = 1, backoff: float = 0.5):
+        if not minimum <= initial <= maximum:
+            raise ValueError("initial must be between minimum and maximum")
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.backoff = backoff
+        self.in_flight = 0
+        self.epoch = 0
+        self.decreases = 0
+        self._waiters: deque[asyncio.Future] = deque()
+
+    async def acquire(self) -> int:
+        """Wait for a slot; returns the epoch to hand back to release()."""
+        while self.in_flight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                self._wake()
+                raise
+        self.in_flight += 1
+        return self.epoch
+
+    def release(self, epoch: int, outcome: str = "success") -> None:
+        """Free the slot. outcome is "success" (ramp up), "throttle" (back off) or "error" (no signal)."""
+        self.in_flight -= 1
+        if outcome == "success":
+            self.limit = min(self.maximum, self.limit + self.increase / self.limit)
+        elif outcome == "throttle" and epoch == self.epoch:
+            self.limit = max(self.minimum, self.limit * self.backoff)
+            self.epoch += 1
+            self.decreases += 1
+        self._wake()
+
+    def resize(self, maximum: float, limit: float | None = None) -> None:
+        """Move the ceiling, e.g. to a run's --concurrency; limit restarts the ramp there, else it is clamped."""
+        self.maximum = max(self.minimum, maximum)
+        self.limit = min(self.maximum, max(self.minimum, limit if limit is not None else self.limit))
+        self._wake()
+
+    def _wake(self) -> None:
+        free = int(self.limit) - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+
+@dataclass
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter: attempt n sleeps uniform(0, min(max_delay, base_delay * 2**n)).
+
+    A Retry-After from the provider is a floor on the delay, never shortened by the jitter.
+    """
+
+    max_attempts: int = 6
+    base_delay: float = 0.5
+    max_delay: float = 30.0
+
+    def delay(self, attempt: int, retry_after: float | None = None) -> float:
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+
+def retry_after_seconds(headers) -> float | None:
+    """Seconds to wait from retry-after-ms / Retry-After (seconds or an HTTP date), None if absent."""
+    if headers is None:
+        return None
+    value = headers.get("retry-after-ms")
+    if value is not None:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+#load test: the same burst of calls against a fake provider that 429s above its capacity
+if __name__ == "__main__":
+    import argparse
+    import logging
+    import os
+
+    import ai
+    from fake_openrouter import FakeOpenRouter
+    from models import Product
+
+    parser = argparse.ArgumentParser(description="Compare fixed vs adaptive concurrency against a throttling fake provider")
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=64, help="calls the pipeline tries to run at once")
+    parser.add_argument("--capacity", type=int, default=16, help="concurrent calls the fake provider accepts")
+    parser.add_argument("--latency", type=float, default=0.1)
+    parser.add_argument("--spike-rate", type=float, default=0.05)
+    parser.add_argument("--spike-latency", type=float, default=1.0)
+    parser.add_argument("--retry-after", type=float, default=0.2)
+    args = parser.parse_args()
+    # one retry warning per 429 would drown the table
+    logging.getLogger("ai").setLevel(logging.ERROR)
+
+    def scenario(label: str, limiter: AdaptiveLimiter, policy: RetryPolicy) -> None:
+        fake = FakeOpenRouter(latency=args.latency, capacity=args.capacity, retry_after=args.retry_after,
+                              spike_rate=args.spike_rate, spike_latency=args.spike_latency).start()
+        os.environ["open_router_key"] = "fake"
+        os.environ["open_router_base_url"] = fake.base_url
+        ai.limiter, ai.retry_policy = limiter, policy
+
+        async def burst():
+            gate = asyncio.Semaphore(args.concurrency)
+
+            async def one(i):
+                async with gate:
+                    await ai.responses(ai_model, f"page {i}", text_format=Product)
+
+            start = time.perf_counter()
+            results = await asyncio.gather(*(one(i) for i in range(args.requests)), return_exceptions=True)
+            elapsed = time.perf_counter() - start
+            await ai.clients.close()
+            return elapsed, sum(isinstance(r, Exception) for r in results)
+
+        try:
+            elapsed, failed = asyncio.run(burst())
+        finally:
+            fake.stop()
+        ok = args.requests - failed
+        print(f"{label:<26} {ok:>5} {failed:>7} {fake.throttled:>6} {ok / elapsed:>9.1f} {int(limiter.limit):>7}")
+
+    ai_model = "google/gemini-2.0-flash-lite-001"
+    print(f"{args.requests} calls, {args.concurrency} at once, provider capacity {args.capacity}, "
+          f"latency {args.latency}s ({args.spike_rate:.0%} spikes to {args.spike_latency}s)")
+    print(f"{'mode':<26} {'ok':>5} {'failed':>7} {'429s':>6} {'ok/sec':>9} {'limit':>7}")
+    fixed = dict(initial=args.concurrency, minimum=args.concurrency, maximum=args.concurrency)
+    scenario("fixed, no retries", AdaptiveLimiter(**fixed), RetryPolicy(max_attempts=1))
+    scenario("fixed + backoff", AdaptiveLimiter(**fixed), RetryPolicy(max_attempts=20))
+    scenario("adaptive (AIMD) + backoff", AdaptiveLimiter(initial=8, maximum=args.concurrency),
+             RetryPolicy(max_attempts=20))
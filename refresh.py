@@ -0,0 +1,241 @@
+# Incremental refresh of known pages.
+# A daily recrawl mostly sees the same products with a new price or a size that sold out. For every
+# page extracted before, the store keeps the product, a fingerprint of the page's descriptive
+# content (structured data without offers, meta tags without prices, page text with prices and
+# stock lines masked) and a snapshot of its JSON-LD offers. On the next crawl:
+#   same payload                          -> the stored product as is
+#   same fingerprint, offers changed      -> the stored product with price / Variant.price / aval
+#                                            updated from the new offers, no LLM call
+#   fingerprint changed, or offers that can't be mapped onto the stored variants -> the LLM
+import hashlib
+import json
+import re
+import sqlite3
+import time
+from collections import Counter
+
+from models import Price, Product
+from preprocess_pool import PreparedPage
+from structured import map_structured
+
+REFRESH_FILE = "refresh.sqlite"
+# JSON-LD keys that change with price and stock, not with what the product is
+OFFER_KEYS = {"offers", "price", "lowPrice", "highPrice", "priceCurrency", "priceSpecification", "availability",
+              "priceValidUntil", "inventoryLevel", "offerCount", "aggregateRating", "review"}
+# meta tags with the same role
+OFFER_META = re.compile(r"price|availability|stock", re.IGNORECASE)
+CURRENCY = r"(?:[$€£¥]|\b(?:USD|EUR|GBP|CAD|AUD|JPY)\b)"
+PRICE_TEXT = re.compile(rf"{CURRENCY}\s?\d[\d,.]*|\d[\d,.]*\s?{CURRENCY}|\d+\s?% off", re.IGNORECASE)
+STOCK_LINE = re.compile(r"in stock|out of stock|sold out|low stock|back in stock|only \d+ left|\bavailab|"
+                        r"unavailable|backorder|pre-?order|ships in|delivery by", re.IGNORECASE)
+
+
+def _without_offers(value):
+    if isinstance(value, dict):
+        return {k: _without_offers(v) for k, v in value.items() if k not in OFFER_KEYS}
+    if isinstance(value, list):
+        return [_without_offers(v) for v in value]
+    return value
+
+
+def page_text(processed: str) -> str:
+    # both payload builders end with the page text under this heading
+    return processed.split("Page Content\n", 1)[-1]
+
+
+def fingerprint(page: PreparedPage) -> str:
+    """Hash of what the page says about the product, blind to prices and stock."""
+    lines = [PRICE_TEXT.sub("¤", line) for line in page_text(page.processed).split("\n")
+             if not STOCK_LINE.search(line)]
+    meta = {k: v for k, v in page.meta.items() if not OFFER_META.search(k)}
+    digest = hashlib.sha256()
+    for part in (_without_offers(page.jsonld), meta, lines):
+        digest.update(json.dumps(part, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def variant_key(sku: str | None, color: str | None, size: str | None) -> str:
+    return f"sku:{sku}" if sku else f"{color}|{size}"
+
+
+def offer_snapshot(jsonld: list, meta: dict) -> dict | None:
+    """The page's structured price and per-variant availability/price, None when it has no offers to go by."""
+    fields, _ = map_structured(jsonld, meta)
+    if fields["price"] is None:
+        return None
+    variants = {}
+    for v in fields["variants"]:
+        variants[variant_key(v.sku, v.color, v.size)] = [v.aval, v.price.model_dump() if v.price else None]
+    return {"price": fields["price"].model_dump(), "variants": variants}
+
+
+def apply_offers(product: Product, old: dict | None, new: dict | None) -> Product | None:
+    """
+    The product with the offer changes between two snapshots applied, None when that can't be done locally.
+
+    Only what changed between the snapshots is written, so a price the LLM read differently from
+    the structured data stays as it was until the page's offers actually move.
+    """
+    if old is None or new is None or old["variants"].keys() != new["variants"].keys():
+        return None
+    updated = product.model_copy(deep=True)
+    if new["price"] != old["price"]:
+        updated.price = Price(**new["price"])
+    by_key = {variant_key(v.sku, v.color, v.size): v for v in updated.variants}
+    for key, (aval, price) in new["variants"].items():
+        if [aval, price] == old["variants"][key]:
+            continue
+        variant = by_key.get(key)
+        if variant is None:
+            return None  # the stored product names its variants differently
+        variant.aval = aval
+        variant.price = Price(**price) if price else None
+    return updated
+
+
+def _content_hash(processed: str) -> str:
+    return hashlib.sha256(processed.encode("utf-8")).hexdigest()
+
+
+class RefreshStore:
+    """
+    SQLite store of the last product, fingerprint and offer snapshot per page name.
+
+    Outcome counts of refresh() are kept for the run report: unchanged, offers (updated locally),
+    changed (descriptive content changed), unmapped (offers changed in a way that needs the LLM), new.
+    """
+
+    def __init__(self, path: str = REFRESH_FILE):
+        self.path = path
+        self.outcomes: Counter = Counter()
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            " name TEXT PRIMARY KEY, content TEXT NOT NULL, fingerprint TEXT NOT NULL,"
+            " offers TEXT, product TEXT NOT NULL, updated REAL NOT NULL)"
+        )
+
+    def refresh(self, name: str, page: PreparedPage) -> Product | None:
+        """The page's product without the LLM when only its offers changed, else None."""
+        row = self.db.execute("SELECT content, fingerprint, offers, product FROM pages WHERE name = ?",
+                              (name,)).fetchone()
+        if row is None:
+            self.outcomes["new"] += 1
+            return None
+        content, print_, offers, stored = row
+        product = Product.model_validate_json(stored)
+        if content == _content_hash(page.processed):
+            self.outcomes["unchanged"] += 1
+            return product
+        if print_ != fingerprint(page):
+            self.outcomes["changed"] += 1
+            return None
+        snapshot = offer_snapshot(page.jsonld, page.meta)
+        updated = apply_offers(product, json.loads(offers) if offers else None, snapshot)
+        if updated is None:
+            self.outcomes["unmapped"] += 1
+            return None
+        self.outcomes["offers"] += 1
+        self.put(name, page, updated, snapshot)
+        return updated
+
+    def put(self, name: str, page: PreparedPage, product: Product, snapshot: dict | None = None) -> None:
+        """Remember the page's product, call after every extraction the next refresh should start from."""
+        if snapshot is None:
+            snapshot = offer_snapshot(page.jsonld, page.meta)
+        self.db.execute(
+            "INSERT OR REPLACE INTO pages (name, content, fingerprint, offers, product, updated)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (name, _content_hash(page.processed), fingerprint(page), json.dumps(snapshot) if snapshot else None,
+             product.model_dump_json(), time.time()),
+        )
+        self.db.commit()
+
+    def close(self) -> None:
+        self.db.close()
+
+
+#bench: LLM calls of a full re-extraction vs refresh on a simulated recrawl of data/*.html
+if __name__ == "__main__":
+    import argparse
+    import asyncio
+    import os
+    import random
+    import tempfile
+
+    import ai
+    from extract import extract_pages
+    from fake_openrouter import FakeOpenRouter
+    from ingest import iter_html_files
+
+    parser = argparse.ArgumentParser(description="Full re-extraction vs incremental refresh on a recrawl")
+    parser.add_argument("--data", default="data")
+    parser.add_argument("--copies", type=int, default=20, help="pages per sample page (as distinct URLs)")
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    def reprice(html: str) -> str:
+        factor = rng.choice([0.8, 0.9, 1.1])
+
+        def scale(match):
+            value = float(match.group(2).replace(",", ""))
+            return f"{match.group(1)}{value * factor:.2f}"
+        html = re.sub(r'("(?:price|lowPrice|highPrice)"\s*:\s*"?)(\d+(?:\.\d+)?)', scale, html)
+        html = re.sub(r'(content="|\$)(\d+\.\d\d)\b', scale, html)
+        return html
+
+    def restock(html: str) -> str:
+        # the first offer on the page (the product, or its first variant) sells out
+        return re.sub(r'("offers"\s*:\s*\[?\s*\{)', r'\1"availability":"https://schema.org/OutOfStock",', html, count=1)
+
+    def describe(html: str) -> str:
+        body = html.find(">", html.find("<body")) + 1
+        return html[:body] + "<p>Now made with recycled materials.</p>" + html[body:]
+
+    # day 2 of the crawl: most pages changed price or stock, some didn't change, some were rewritten
+    changes = [("unchanged", lambda h: h, 0.2), ("price", reprice, 0.4), ("stock", restock, 0.2),
+               ("price+stock", lambda h: restock(reprice(h)), 0.1), ("description", describe, 0.1)]
+    day1, day2 = [], []
+    for filename, html in iter_html_files(args.data):
+        for i in range(args.copies):
+            name = f"https://shop.example/{i}/{filename}"
+            label, change, _ = rng.choices(changes, weights=[w for *_, w in changes])[0]
+            day1.append((name, html))
+            day2.append((name, change(html), label))
+
+    fake = FakeOpenRouter(latency=args.latency).start()
+    os.environ["open_router_key"] = "fake"
+    os.environ["open_router_base_url"] = fake.base_url
+    store = RefreshStore(os.path.join(tempfile.mkdtemp(), "refresh.sqlite"))
+
+    async def crawl(pages, refresh):
+        results = [r async for r in extract_pages(pages, concurrency=32, refresh=refresh)]
+        await ai.clients.close()
+        return results
+
+    try:
+        asyncio.run(crawl(day1, store))
+        day2_pages = [(name, html) for name, html, _ in day2]
+        fake.requests = 0
+        asyncio.run(crawl(day2_pages, None))
+        full_calls = fake.requests
+        fake.requests = 0
+        store.outcomes.clear()
+        results = asyncio.run(crawl(day2_pages, store))
+        refresh_calls = fake.requests
+    finally:
+        fake.stop()
+
+    labels = {name: label for name, _, label in day2}
+    sources = Counter((labels[r.name], r.source) for r in results)
+    print(f"{len(day2)} recrawled pages: " + ", ".join(f"{label} {sum(1 for *_, l in day2 if l == label)}"
+                                                       for label, *_ in changes))
+    print(f"{'mode':<22} {'LLM calls':>10}")
+    print(f"{'full re-extraction':<22} {full_calls:>10}")
+    print(f"{'refresh':<22} {refresh_calls:>10}   ({1 - refresh_calls / full_calls:.0%} fewer)")
+    print("refresh outcomes: " + ", ".join(f"{k} {v}" for k, v in store.outcomes.most_common()))
+    print("source per change: " + ", ".join(f"{label}/{source} {n}" for (label, source), n in sorted(sources.items())))
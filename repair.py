@@ -0,0 +1,174 @@
+# Field-level repair of extracted products.
+# A product that fails validation on one field (a category not in the taxonomy, a price without a
+# currency) is usually right everywhere else. Instead of re-running the whole page, the valid
+# fields are kept and a small follow-up request asks for just the broken field: its schema, the
+# reason it was rejected, and the lines of the page that mention it. Category repairs also get the
+# closest taxonomy paths as choices, so the answer can't be off the list again.
+import json
+import re
+from collections import Counter
+from typing import Literal
+
+from pydantic import ValidationError, create_model
+
+import ai
+from models import Product
+from prompts import repair_prompt
+from taxonomy import get_index
+
+# more broken fields than this is a bad extraction, not a bad field; re-extract the page instead
+MAX_REPAIR_FIELDS = 2
+# page excerpt sent with a repair
+SNIPPET_CHARS = 2000
+# characters kept on each side of a hint inside a long line (the JSON-LD is a single line)
+HINT_WINDOW = 200
+CATEGORY_CHOICES = 20
+# words that point at the part of the page a field comes from
+FIELD_HINTS = {
+    "price": r"price|amount|currency|[$€£¥]|\b(?:USD|EUR|GBP|CAD|AUD|JPY)\b",
+    "category": r"breadcrumb|categor|\s>\s",
+    "image_urls": r"image|\.jpe?g|\.png|\.webp",
+    "video_url": r"video|\.mp4|youtube|vimeo",
+    "brand": r"brand|manufacturer",
+    "colors": r"colou?r",
+    "variants": r"variant|size|sku|colou?r|offers",
+}
+
+# fields repaired this run, reset by extract.main
+repairs: Counter = Counter()
+
+
+def broken_fields(error: ValidationError) -> list[str]:
+    """Top level Product fields named by a validation error, in schema order."""
+    names = {e["loc"][0] for e in error.errors() if e["loc"]}
+    return [name for name in Product.model_fields if name in names]
+
+
+def snippet(processed: str, field: str, limit: int = SNIPPET_CHARS) -> str:
+    """The lines of the page text that mention the field, or its start when none do."""
+    hint = re.compile(FIELD_HINTS.get(field, re.escape(field)), re.IGNORECASE)
+    parts, size = [], 0
+    for line in processed.split("\n"):
+        match = hint.search(line)
+        if not match:
+            continue
+        if len(line) > 2 * HINT_WINDOW:
+            line = line[max(0, match.start() - HINT_WINDOW):match.end() + HINT_WINDOW]
+        parts.append(line)
+        size += len(line) + 1
+        if size >= limit:
+            break
+    return "\n".join(parts)[:limit] if parts else processed[:limit]
+
+
+def repair_model(field: str, choices: list[str] | None = None):
+    """A one-field response model, category answers restricted to the given choices."""
+    if field == "category" and choices:
+        annotation = create_model("CategoryChoice", name=(Literal[tuple(choices)], ...))
+    else:
+        annotation = Product.model_fields[field].annotation
+    return create_model("FieldRepair", **{field: (annotation, ...)})
+
+
+def _category_query(data: dict) -> str:
+    category = data.get("category")
+    rejected = category.get("name", "") if isinstance(category, dict) else ""
+    return f"{rejected} {data.get('name', '')}".strip()
+
+
+async def repair_field(field: str, data: dict, reason: str, processed: str, model: str):
+    """Ask the model for one field again, returning its new value (plain JSON)."""
+    choices = get_index().nearest(_category_query(data), CATEGORY_CHOICES) if field == "category" else None
+    lines = [f"Field: {field}",
+             f"Current value: {json.dumps(data.get(field), ensure_ascii=False)}",
+             f"Problem: {reason}"]
+    if data.get("name"):
+        lines.append(f"Product: {data['name']}")
+    if choices:
+        lines.append("Choices:\n" + "\n".join(choices))
+    lines.append("Page excerpt:\n" + snippet(processed, field))
+    fixed = await ai.responses(
+        model=model,
+        input=[
+            {"role": "system", "content": repair_prompt},
+            {"role": "user", "content": "\n".join(lines)},
+        ],
+        text_format=repair_model(field, choices),
+    )
+    return fixed.model_dump(mode="json")[field]
+
+
+async def validate_or_repair(data: dict, processed: str, model: str) -> Product:
+    """
+    Validate Product-shaped data from an extraction, repairing up to MAX_REPAIR_FIELDS broken fields.
+
+    Raises the validation error when there are more, or when a repaired product still doesn't validate.
+    """
+    try:
+        return Product.model_validate(data)
+    except ValidationError as e:
+        fields = broken_fields(e)
+        if not isinstance(data, dict) or not fields or len(fields) > MAX_REPAIR_FIELDS:
+            raise
+        reasons = {field: "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}"
+                                    for err in e.errors() if err["loc"] and err["loc"][0] == field)
+                   for field in fields}
+    for field in fields:
+        data[field] = await repair_field(field, data, reasons[field], processed, model)
+        repairs[field] += 1
+    return Product.model_validate(data)
+
+
+#bench: tokens and latency of a full extraction vs a field repair, on data/*.html against the fake model
+if __name__ == "__main__":
+    import argparse
+    import asyncio
+    import os
+    import time
+
+    from extract import MODEL, extract_product, iter_html_files
+    from fake_openrouter import FakeOpenRouter
+    from preprocess_pool import prepare_page
+
+    parser = argparse.ArgumentParser(description="Compare a full extraction with single-field repairs")
+    parser.add_argument("--data", default="data")
+    parser.add_argument("--latency", type=float, default=0.3, help="seconds to first token per request")
+    parser.add_argument("--token-latency", type=float, default=0.005, help="seconds per completion token")
+    args = parser.parse_args()
+
+    fake = FakeOpenRouter(latency=args.latency, token_latency=args.token_latency).start()
+    os.environ["open_router_key"] = "fake"
+    os.environ["open_router_base_url"] = fake.base_url
+
+    async def measure(call) -> tuple[int, int, float]:
+        ai.usage.reset()
+        start = time.perf_counter()
+        await call
+        total = ai.usage.totals()
+        return total.prompt_tokens, total.completion_tokens, time.perf_counter() - start
+
+    async def bench():
+        rows = []
+        for name, html in iter_html_files(args.data):
+            processed = prepare_page(html).processed
+            full = await measure(extract_product(processed))
+            broken = {"name": name, "category": {"name": "Shoes > Running"}, "price": {"price": 10}}
+            category = await measure(repair_field("category", broken, "not in the taxonomy", processed, MODEL))
+            price = await measure(repair_field("price", broken, "price.currency: Field required", processed, MODEL))
+            rows.append((name, full, category, price))
+        await ai.clients.close()
+        return rows
+
+    try:
+        rows = asyncio.run(bench())
+    finally:
+        fake.stop()
+    print(f"{'File':<20} {'Full tokens':>12} {'Category':>10} {'Price':>10} {'Full s':>8} {'Cat. s':>8} {'Price s':>8}")
+    sums = [0, 0, 0]
+    for name, full, category, price in rows:
+        tokens = [sum(call[:2]) for call in (full, category, price)]
+        sums = [a + b for a, b in zip(sums, tokens)]
+        print(f"{name:<20} {tokens[0]:>12,} {tokens[1]:>10,} {tokens[2]:>10,} "
+              f"{full[2]:>8.2f} {category[2]:>8.2f} {price[2]:>8.2f}")
+    print(f"{'TOTAL':<20} {sums[0]:>12,} {sums[1]:>10,} {sums[2]:>10,}   "
+          f"repairs cost {sums[1] / sums[0]:.0%} (category) and {sums[2] / sums[0]:.0%} (price) of a full page")
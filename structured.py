@@ -0,0 +1,265 @@
+# Deterministic fast path: map schema.org JSON-LD + og: meta tags straight into a Product.
+# No site specific logic here, only the generic schema.org vocabulary (Product, ProductGroup,
+# Offer, AggregateOffer, Brand, ImageObject, BreadcrumbList).
+import html
+import re
+from functools import cache
+
+from pydantic import ValidationError
+
+from models import Category, Price, Product, Variant
+from taxonomy import valid_categories
+
+PRODUCT_TYPES = {"Product", "ProductGroup"}
+# fields a fast path product must have before we trust it over the LLM
+REQUIRED_FIELDS = ["name", "price", "description", "key_features", "image_urls", "category", "brand"]
+MAX_FEATURES = 10
+# a description line that is a bullet point
+_BULLET = re.compile(r"^\s*(?:[-*•·▪–]|\d+[.)])\s+(.+?)\s*$", re.MULTILINE)
+
+
+def _types(node: dict) -> set[str]:
+    types = node.get("@type", [])
+    return set(types) if isinstance(types, list) else {types}
+
+
+def _nodes(jsonld) -> list[dict]:
+    # flattens top level lists and @graph containers into one list of nodes
+    nodes = []
+    for item in jsonld if isinstance(jsonld, list) else [jsonld]:
+        if isinstance(item, list):
+            nodes.extend(_nodes(item))
+        elif isinstance(item, dict):
+            nodes.append(item)
+            if "@graph" in item:
+                nodes.extend(_nodes(item["@graph"]))
+    return nodes
+
+
+def _text(value) -> str | None:
+    if isinstance(value, dict):
+        value = value.get("name")
+    if isinstance(value, list):
+        value = value[0] if value else None
+    if value is None:
+        return None
+    value = html.unescape(str(value)).strip()
+    return value or None
+
+
+def _as_list(value) -> list:
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _images(value) -> list[str]:
+    urls = []
+    for image in _as_list(value):
+        if isinstance(image, dict):
+            image = image.get("contentUrl") or image.get("url")
+        if isinstance(image, str) and image:
+            urls.append(image)
+    return urls
+
+
+def _float(value) -> float | None:
+    try:
+        return float(str(value).replace(",", ""))
+    except (TypeError, ValueError):
+        return None
+
+
+def _offers(node: dict) -> list[dict]:
+    offers = []
+    for offer in _as_list(node.get("offers")):
+        if not isinstance(offer, dict):
+            continue
+        if "AggregateOffer" in _types(offer) and offer.get("offers"):
+            offers.extend(o for o in _as_list(offer["offers"]) if isinstance(o, dict))
+        else:
+            offers.append(offer)
+    return offers
+
+
+def _offer_price(offer: dict) -> tuple[float | None, str | None, float | None]:
+    price = _float(offer.get("price", offer.get("lowPrice")))
+    currency = offer.get("priceCurrency")
+    compare_at = None
+    for spec in _as_list(offer.get("priceSpecification")):
+        if not isinstance(spec, dict):
+            continue
+        price_type = str(spec.get("priceType", ""))
+        if price_type.endswith(("StrikethroughPrice", "ListPrice")):
+            compare_at = _float(spec.get("price"))
+        elif price is None:
+            price = _float(spec.get("price"))
+            currency = currency or spec.get("priceCurrency")
+    if compare_at is not None and price is not None and compare_at <= price:
+        compare_at = None
+    return price, currency, compare_at
+
+
+def _available(offer: dict | None) -> bool:
+    if offer is None:
+        return False
+    availability = str(offer.get("availability", "InStock"))
+    return not availability.endswith(("OutOfStock", "SoldOut", "Discontinued"))
+
+
+def _features(product: dict, description: str | None) -> list[str]:
+    # pros (positiveNotes), then specs (additionalProperty), then bullet lines of the description
+    features = []
+    for note in _as_list(product.get("positiveNotes")):
+        if isinstance(note, dict):
+            note = note.get("itemListElement", note)
+        for item in _as_list(note):
+            if text := _text(item):
+                features.append(text)
+    for prop in _as_list(product.get("additionalProperty")):
+        if isinstance(prop, dict) and (name := _text(prop.get("name"))) and (value := _text(prop.get("value"))):
+            features.append(f"{name}: {value}")
+    if description:
+        features.extend(_BULLET.findall(description))
+    return list(dict.fromkeys(features))[:MAX_FEATURES]
+
+
+@cache
+def _parents() -> frozenset[str]:
+    # taxonomy paths that have subcategories
+    return frozenset(path.rsplit(" > ", 1)[0] for path in valid_categories() if " > " in path)
+
+
+def _resolve(path: str) -> str | None:
+    # exact taxonomy path, else whatever Category itself accepts (its fuzzy match), never a guess from the name
+    path = path.replace(" / ", " > ")
+    if path in valid_categories():
+        return path
+    try:
+        return Category(name=path).name
+    except ValidationError:
+        return None
+
+
+def _category(product: dict, nodes: list[dict]) -> str | None:
+    """
+    The category the page states: the Product's `category`, else its BreadcrumbList as a path.
+
+    Words of the product name are not used, "Apple iPhone 15 Case" is not a fruit. A page that
+    states no resolvable category goes to the LLM.
+    """
+    raw = _text(product.get("category"))
+    if raw and (path := _resolve(raw)):
+        return path
+    for node in nodes:
+        if "BreadcrumbList" in _types(node):
+            items = sorted(_as_list(node.get("itemListElement")), key=lambda i: _float(i.get("position")) or 0)
+            crumbs = [_text(item.get("name") or item.get("item")) for item in items if isinstance(item, dict)]
+            crumbs = [crumb for crumb in crumbs if crumb]
+            if crumbs and (path := _resolve(" > ".join(crumbs))):
+                return path
+    return None
+
+
+def map_structured(jsonld: list, meta: dict) -> tuple[dict, list[str]]:
+    """Map JSON-LD and meta tags into Product fields. Returns (fields, missing required field names)."""
+    nodes = _nodes(jsonld)
+    product = next((n for n in nodes if _types(n) & PRODUCT_TYPES), {})
+
+    name = _text(product.get("name")) or _text(meta.get("og:title"))
+    description = _text(product.get("description")) or _text(meta.get("og:description"))
+    brand = _text(product.get("brand")) or _text(product.get("manufacturer"))
+
+    variant_nodes = [v for v in _as_list(product.get("hasVariant")) if isinstance(v, dict)]
+    images = _images(product.get("image"))
+    for node in variant_nodes:
+        images.extend(_images(node.get("image")))
+    if not images and meta.get("og:image"):
+        images = [meta["og:image"]]
+
+    # the main price is the cheapest offer we can see, on the product or on its variants
+    priced = [_offer_price(o) for o in _offers(product)]
+    for node in variant_nodes:
+        priced.extend(_offer_price(o) for o in _offers(node))
+    priced = [p for p in priced if p[0] is not None and p[1]]
+    price = min(priced, key=lambda p: p[0]) if priced else None
+
+    variants = []
+    colors = []
+    for node in variant_nodes or ([product] if product.get("sku") else []):
+        offer = next(iter(_offers(node)), None)
+        # a ProductGroup variant without an offer can't be bought, a lone product is in stock unless told otherwise
+        if offer is None and not variant_nodes:
+            offer = {}
+        variant_price = _offer_price(offer) if offer else (None, None, None)
+        color = _text(node.get("color"))
+        if color and color not in colors:
+            colors.append(color)
+        variants.append(Variant(
+            size=_text(node.get("size")),
+            sku=_text(node.get("sku") or node.get("mpn")),
+            color=color,
+            price=Price(price=variant_price[0], currency=variant_price[1], compare_at_price=variant_price[2])
+            if variant_price[0] is not None and variant_price[1] and price and variant_price[0] != price[0] else None,
+            aval=_available(offer),
+        ))
+
+    video = next((v for v in _as_list(product.get("video")) if isinstance(v, dict)), {})
+    video_url = video.get("contentUrl") or video.get("embedUrl") or meta.get("og:video")
+
+    fields = {
+        "name": name,
+        "price": Price(price=price[0], currency=price[1], compare_at_price=price[2]) if price else None,
+        "description": description,
+        "key_features": _features(product, description),
+        "image_urls": list(dict.fromkeys(images)),
+        "video_url": video_url,
+        "category": _category(product, nodes),
+        "brand": brand,
+        "colors": colors,
+        "variants": variants,
+    }
+    missing = [f for f in REQUIRED_FIELDS if not fields[f] or (f == "price" and fields[f].price <= 0)]
+    # the LLM picks the most specific category, one with subcategories is too coarse to keep
+    if fields["category"] in _parents():
+        missing.append("category")
+    return fields, missing
+
+
+def product_from_structured(jsonld: list, meta: dict) -> Product | None:
+    """Build a Product from structured data alone, or None when the LLM is still needed."""
+    fields, missing = map_structured(jsonld, meta)
+    if missing:
+        return None
+    try:
+        return Product(**{**fields, "category": Category(name=fields["category"])})
+    except ValidationError:
+        return None
+
+
+#coverage report: how many corpus pages the fast path serves without an LLM call
+if __name__ == "__main__":
+    import os
+
+    from bs4 import BeautifulSoup
+
+    from preprocess import scan_html
+
+    print("=" * 78)
+    print(f"{'File':<18} {'Fast path':<10} {'Category':<38} Missing")
+    print("=" * 78)
+    served = 0
+    total = 0
+    for filename in sorted(os.listdir("data")):
+        if not filename.endswith(".html"):
+            continue
+        with open(os.path.join("data", filename), "r", encoding="utf-8") as f:
+            jsonld, meta, _ = scan_html(BeautifulSoup(f.read(), "html.parser"))
+        fields, missing = map_structured(jsonld, meta)
+        product = product_from_structured(jsonld, meta)
+        total += 1
+        served += product is not None
+        category = (fields["category"] or "-")[-38:]
+        print(f"{filename:<18} {'yes' if product else 'no':<10} {category:<38} {', '.join(missing) or '-'}")
+    print("=" * 78)
+    print(f"Served by the fast path: {served}/{total} pages ({served / total:.0%}), the rest fall back to the LLM")
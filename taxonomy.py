@@ -0,0 +1,220 @@
+# Search index over the Google product taxonomy used to resolve slightly-off category paths.
+# difflib.get_close_matches runs SequenceMatcher against all ~5,600 paths on every miss; here a
+# trigram inverted index narrows that down to a handful of candidates first. Candidates are ranked
+# by Dice similarity of the trigram sets, not by the raw count of shared trigrams: the raw count
+# favours long paths, which share many trigrams with anything, over the short path that was meant.
+#
+# Nothing is read at import time. The first lookup loads the taxonomy, preferring a compiled
+# marshal file next to categories.txt that is rebuilt whenever the text file changes.
+import heapq
+import marshal
+import os
+from collections import Counter
+from difflib import SequenceMatcher, get_close_matches
+from functools import lru_cache
+from pathlib import Path
+
+CATEGORIES_FILE = Path(__file__).parent / "categories.txt"
+COMPILED_FILE = Path(__file__).parent / "categories.compiled"
+# bump when the compiled layout changes so old files get rebuilt
+COMPILED_VERSION = 2
+
+
+def _trigrams(text: str) -> set[str]:
+    text = f"  {text.lower()} "
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class CategoryIndex:
+    """
+    Trigram inverted index over category paths.
+
+    best_match() scores only the `candidates` paths with the highest trigram Dice similarity to
+    the query, using the same SequenceMatcher ratio, cutoff and tie-breaking as
+    get_close_matches(n=1). If none of them clears the cutoff it falls back to the exhaustive
+    difflib scan, so a query that used to match still matches. The shortlist is a heuristic: it
+    picked the same path as difflib on 700 of 700 perturbed paths (python taxonomy.py), but a
+    path outside the shortlist with a higher ratio would be missed.
+    """
+
+    def __init__(self, categories, candidates: int = 32, max_posting: float = 0.2, postings=None, sizes=None):
+        self.categories = sorted(categories)
+        self.lookup = set(self.categories)
+        self.candidates = candidates
+        if postings is None:
+            postings = {}
+            for i, category in enumerate(self.categories):
+                for gram in _trigrams(category):
+                    postings.setdefault(gram, []).append(i)
+            # trigrams like " > " are in nearly every path and say nothing, leave them out
+            limit = max(1, int(len(self.categories) * max_posting))
+            postings = {gram: ids for gram, ids in postings.items() if len(ids) <= limit}
+        self.postings = postings
+        # trigram count per path, for the Dice ranking
+        self.sizes = sizes if sizes is not None else [len(_trigrams(category)) for category in self.categories]
+
+    def _shortlist(self, query: str, n: int) -> list[int]:
+        grams = _trigrams(query)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.postings.get(gram, ()))
+        dice = {i: count / (len(grams) + self.sizes[i]) for i, count in shared.items()}
+        return heapq.nlargest(n, dice, key=dice.__getitem__)
+
+    def best_match(self, query: str, cutoff: float = 0.6) -> str | None:
+        if query in self.lookup:
+            return query
+        matcher = SequenceMatcher()
+        matcher.set_seq2(query)
+        best = None
+        for i in self._shortlist(query, self.candidates):
+            candidate = self.categories[i]
+            matcher.set_seq1(candidate)
+            if matcher.real_quick_ratio() >= cutoff and matcher.quick_ratio() >= cutoff:
+                score = matcher.ratio()
+                if score >= cutoff and (best is None or (score, candidate) > best):
+                    best = (score, candidate)
+        if best is not None:
+            return best[1]
+        matches = get_close_matches(query, self.categories, n=1, cutoff=cutoff)
+        return matches[0] if matches else None
+
+    def nearest(self, query: str, n: int = 20) -> list[str]:
+        """The n paths most similar to query by trigrams, a short list for a model to choose from."""
+        return [self.categories[i] for i in self._shortlist(query, n)]
+
+
+def read_categories(path: Path = CATEGORIES_FILE) -> set[str]:
+    categories = set()
+    if path.exists():
+        with open(path, "r") as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    categories.add(line)
+    return categories
+
+
+def _stamp(path: Path) -> list[int]:
+    stat = path.stat()
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def load_index(path: Path = CATEGORIES_FILE, compiled: Path | None = COMPILED_FILE) -> CategoryIndex:
+    """
+    Load the category index, from the compiled file when it matches the text file's mtime and size.
+
+    Otherwise the text file is parsed, the index built, and the compiled file (re)written for the
+    next process. Writing is best effort: a read-only checkout just keeps parsing the text file.
+    """
+    if not path.exists():
+        return CategoryIndex(set())
+    stamp = _stamp(path)
+    if compiled is not None:
+        try:
+            with open(compiled, "rb") as f:
+                # loads(read()) rather than load(f), which reads the file in tiny chunks
+                version, compiled_stamp, categories, postings, sizes = marshal.loads(f.read())
+            if version == COMPILED_VERSION and compiled_stamp == stamp:
+                return CategoryIndex(categories, postings=postings, sizes=sizes)
+        except (OSError, EOFError, ValueError, TypeError):
+            pass
+    index = CategoryIndex(read_categories(path))
+    if compiled is not None:
+        try:
+            # write then rename so concurrent workers never read a half written file
+            tmp = compiled.with_name(f"{compiled.name}.{os.getpid()}.tmp")
+            with open(tmp, "wb") as f:
+                marshal.dump((COMPILED_VERSION, stamp, index.categories, index.postings, index.sizes), f)
+            os.replace(tmp, compiled)
+        except OSError:
+            pass
+    return index
+
+
+@lru_cache(maxsize=1)
+def get_index() -> CategoryIndex:
+    return load_index()
+
+
+def valid_categories() -> set[str]:
+    return get_index().lookup
+
+
+#micro-benchmark: validations/sec for difflib vs the index on perturbed category strings
+if __name__ == "__main__":
+    import argparse
+    import random
+    import time
+
+    from pydantic import BaseModel, field_validator
+
+    import models
+    import taxonomy
+    from models import Category
+
+    VALID_CATEGORIES = taxonomy.valid_categories()
+
+    parser = argparse.ArgumentParser(description="Benchmark category resolution on perturbed paths")
+    parser.add_argument("--samples", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+
+    def perturb(path: str) -> str:
+        kind = rng.choice(["drop", "swap", "replace", "plural", "segment", "lower"])
+        i = rng.randrange(len(path) - 1)
+        if kind == "drop":
+            return path[:i] + path[i + 1:]
+        if kind == "swap":
+            return path[:i] + path[i + 1] + path[i] + path[i + 2:]
+        if kind == "replace":
+            return path[:i] + rng.choice("abcdefghijklmnopqrstuvwxyz") + path[i + 1:]
+        if kind == "plural":
+            return path[:-1] if path.endswith("s") else path + "s"
+        if kind == "segment" and " > " in path:
+            parts = path.split(" > ")
+            del parts[rng.randrange(len(parts))]
+            return " > ".join(parts)
+        return path.lower()
+
+    queries = [perturb(p) for p in rng.sample(sorted(VALID_CATEGORIES), args.samples)]
+
+    # the validator as it was: exhaustive difflib scan on every miss
+    class DifflibCategory(BaseModel):
+        name: str
+
+        @field_validator("name")
+        @classmethod
+        def validate_name_exists(cls, v: str) -> str:
+            if v in VALID_CATEGORIES:
+                return v
+            matches = get_close_matches(v, VALID_CATEGORIES, n=1, cutoff=0.6)
+            if matches:
+                return matches[0]
+            raise ValueError(f"Category '{v}' is not a valid category in categories.txt")
+
+    def run(model) -> tuple[float, list]:
+        results = []
+        start = time.perf_counter()
+        for query in queries:
+            try:
+                results.append(model(name=query).name)
+            except ValueError:
+                results.append(None)
+        return len(queries) / (time.perf_counter() - start), results
+
+    before, expected = run(DifflibCategory)
+    start = time.perf_counter()
+    taxonomy.load_index(compiled=None)
+    build = time.perf_counter() - start
+    models.closest_category.cache_clear()
+    cold, got = run(Category)
+    warm, _ = run(Category)
+    agree = sum(a == b for a, b in zip(expected, got))
+    print(f"{len(queries)} perturbed category strings, index built in {build * 1000:.0f}ms")
+    print(f"{'difflib scan':<22} {before:>10,.0f} validations/sec")
+    print(f"{'index (cold cache)':<22} {cold:>10,.0f} validations/sec  ({cold / before:.0f}x)")
+    print(f"{'index (warm LRU)':<22} {warm:>10,.0f} validations/sec  ({warm / before:.0f}x)")
+    print(f"Same result as difflib: {agree}/{len(queries)}")
@@ -1,7 +1,8 @@
 
 import pytest
 import json
-from preprocess import preprocess_html, extract_jsonld, extract_meta_tags, clean_html
+import asyncio
+from preprocess import preprocess_html, preprocess_html_fast, extract_jsonld, extract_meta_tags, clean_html
 from extract import clean_text, fix_url
 from models import Product, Category, Price, Variant
 from bs4 import BeautifulSoup
@@ -105,6 +106,25 @@ class TestPreprocessing:
         assert "... [truncated]" in result
 
 
+class TestSinglePassPreprocessing:
+    """The single-pass engine must match preprocess_html byte for byte."""
+
+    @pytest.mark.parametrize("filename", ["ace.html", "adaysmarch.html", "article.html", "llbean.html", "nike.html"])
+    def test_matches_legacy_on_corpus(self, filename):
+        with open(f"data/{filename}", "r", encoding="utf-8") as f:
+            html = f.read()
+        assert preprocess_html_fast(html) == preprocess_html(html)
+
+    @pytest.mark.parametrize("html", [
+        '<svg><title>Icon</title></svg><title>Real title</title>',
+        '<noscript><script type="application/ld+json">{"a": 1}</script></noscript><meta name="title" content="m"><title>t</title>',
+        '<p>unclosed <b>bold <i>italic</p> more <template><p>hidden</p></template>',
+        '<p>a &amp; b &lt;script&gt;</p><style>p {}</style><iframe>inner</iframe>tail',
+        '<script type="application/ld+json"></script><script type="application/ld+json">[1, 2]</script>',
+    ])
+    def test_matches_legacy_on_edge_cases(self, html):
+        assert preprocess_html_fast(html) == preprocess_html(html)
+
 class TestTextCleaning:
     """Tests for text cleaning utilities."""
 
@@ -158,6 +178,56 @@ class TestModels:
         with pytest.raises(ValueError, match="not a valid category"):
             Category(name="Completely Invalid Category That Doesnt Exist")
 
+    def test_category_index_matches_difflib(self):
+        """The trigram index should pick the same path as an exhaustive difflib scan."""
+        from difflib import get_close_matches
+        from models import VALID_CATEGORIES
+        from taxonomy import CategoryIndex
+        index = CategoryIndex(VALID_CATEGORIES)
+        for query in ["Apparel & Accessories > Clothing > Pant",
+                      "Hardware > Tools > Drill > Handheld Power Drills",
+                      "Home & Garden > Lightning > Lamps",
+                      "apparel & accessories > shoes",
+                      # the short intended path shares fewer trigrams than long paths around it
+                      "Vehicles & Parts > Vehicles > MotorVehicles",
+                      "Home & Garden > Lamps",
+                      "Cameras & Optics > Webcams"]:
+            expected = get_close_matches(query, VALID_CATEGORIES, n=1, cutoff=0.6)
+            assert index.best_match(query) == (expected[0] if expected else None)
+
+    def test_category_lookups_are_cached(self):
+        """Repeated off paths should be answered from the LRU cache."""
+        from models import closest_category
+        closest_category.cache_clear()
+        Category(name="Furniture > Chair")
+        Category(name="Furniture > Chair")
+        assert closest_category.cache_info().hits == 1
+
+    def test_taxonomy_loads_lazily_from_compiled_file(self, tmp_path):
+        """The compiled index is reused until categories.txt changes."""
+        import os
+        import taxonomy
+        text = tmp_path / "categories.txt"
+        compiled = tmp_path / "categories.compiled"
+        text.write_text("# header\nFurniture\nFurniture > Chairs\n")
+        assert taxonomy.load_index(text, compiled).lookup == {"Furniture", "Furniture > Chairs"}
+        assert compiled.exists()
+        # a stale-looking rebuild would pick this up, a fresh compiled file must not
+        stamp = compiled.stat().st_mtime_ns
+        assert taxonomy.load_index(text, compiled).best_match("Furniture > Chair") == "Furniture > Chairs"
+        assert compiled.stat().st_mtime_ns == stamp
+        text.write_text("Furniture\nFurniture > Tables\n")
+        os.utime(text, ns=(stamp + 10**9, stamp + 10**9))
+        assert taxonomy.load_index(text, compiled).lookup == {"Furniture", "Furniture > Tables"}
+
+    def test_import_models_does_not_read_taxonomy(self):
+        """Importing models in a fresh interpreter should not touch categories.txt."""
+        import subprocess
+        import sys
+        code = "import models, taxonomy; print(taxonomy.get_index.cache_info().currsize)"
+        out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+        assert out.stdout.strip() == "0"
+
     def test_price_model(self):
         """Should correctly parse price data."""
         price = Price(price=29.95, currency="USD", compare_at_price=39.95)
@@ -232,5 +302,1355 @@ class TestIntegration:
         assert reduction > 50, f"Expected >50% reduction, got {reduction:.0f}%"
 
 
+
+@pytest.fixture
+def fake_server(monkeypatch):
+    """Local fake OpenRouter server with ai.responses pointed at it."""
+    from fake_openrouter import FakeOpenRouter
+
+    server = FakeOpenRouter().start()
+    monkeypatch.setenv("open_router_key", "fake")
+    monkeypatch.setenv("open_router_base_url", server.base_url)
+    yield server
+    server.stop()
+
+
+class TestConcurrentExtraction:
+    """Tests for the bounded concurrent pipeline against the fake server."""
+
+    @staticmethod
+    def _pages(n):
+        return [(f"page{i}.html", f"<html><body><p>Product {i}</p></body></html>") for i in range(n)]
+
+    @staticmethod
+    async def _collect(pages, **kwargs):
+        from extract import extract_pages
+        return [r async for r in extract_pages(pages, **kwargs)]
+
+    def test_extract_pages_overlaps_llm_latency(self, fake_server):
+        """Pages should be extracted concurrently instead of one after another."""
+        import time
+
+        async def timed():
+            # first call pays for client setup, keep it out of the timing
+            await self._collect(self._pages(1))
+            fake_server.latency = 0.3
+            start = time.perf_counter()
+            results = await self._collect(self._pages(6), concurrency=6)
+            return results, time.perf_counter() - start
+
+        results, elapsed = asyncio.run(timed())
+        assert all(r.product is not None for r in results)
+        assert len({r.product.name for r in results}) == 6
+        assert elapsed < 6 * 0.3 * 0.6, f"took {elapsed:.2f}s, looks serialized"
+
+    def test_extract_pages_respects_concurrency_limit(self, fake_server):
+        """No more than `concurrency` LLM calls should be in flight at once."""
+        fake_server.latency = 0.1
+        results = asyncio.run(self._collect(self._pages(10), concurrency=3))
+        assert len(results) == 10
+        assert fake_server.max_in_flight <= 3
+
+    def test_extract_pages_reports_failures(self, fake_server):
+        """A bad model response should fail only that page."""
+        fake_server.responder = lambda body: {"name": "missing everything"}
+        results = asyncio.run(self._collect(self._pages(2), concurrency=2))
+        assert all(r.product is None and r.error is not None for r in results)
+
+    def test_extract_pages_with_process_pool(self, fake_server):
+        """Pooled preprocessing should feed the same pages into extraction."""
+        results = asyncio.run(self._collect(self._pages(5), concurrency=2, workers=2, chunksize=2))
+        assert sorted(r.name for r in results) == [f"page{i}.html" for i in range(5)]
+        assert all(r.product is not None for r in results)
+
+    def test_preprocess_stage_pool_matches_inline(self):
+        """Process pool output should be identical to inline preprocess_html."""
+        from preprocess_pool import preprocess_stage
+
+        pages = [(f"p{i}", f"<html><title>T{i}</title><body><p>Body {i}</p></body></html>") for i in range(7)]
+
+        async def collect(workers):
+            return {name: page.processed
+                    async for name, page in preprocess_stage(pages, workers=workers, chunksize=3, compact=False)}
+
+        assert asyncio.run(collect(2)) == {name: preprocess_html(html) for name, html in pages}
+
+    def test_token_budget_throttles(self):
+        """Spending past the per-minute budget should wait for the bucket to refill."""
+        import time
+        from ratelimit import TokenBudget
+
+        async def spend():
+            budget = TokenBudget(tokens_per_minute=600)  # 10 tokens/sec
+            await budget.acquire(600)
+            start = time.perf_counter()
+            await budget.acquire(3)
+            return time.perf_counter() - start
+
+        assert asyncio.run(spend()) >= 0.25
+
+
+
+class TestExtractionCache:
+    """Tests for the content-addressed extraction cache."""
+
+    @staticmethod
+    def _product(name="Cached"):
+        return Product(
+            name=name,
+            price=Price(price=10.0, currency="USD"),
+            description="d",
+            key_features=[],
+            image_urls=[],
+            category=Category(name="Apparel & Accessories > Shoes"),
+            brand="b",
+            colors=[],
+            variants=[],
+        )
+
+    def test_hit_skips_network(self, fake_server, tmp_path):
+        """The second extraction of the same text should not reach the model."""
+        from cache import ExtractionCache
+        from extract import extract_product
+
+        cache = ExtractionCache(str(tmp_path / "cache.sqlite"))
+
+        async def twice():
+            first = await extract_product("same page text", cache)
+            second = await extract_product("same page text", cache)
+            return first, second
+
+        first, second = asyncio.run(twice())
+        assert first == second
+        assert fake_server.requests == 1
+        assert (cache.hits, cache.misses) == (1, 1)
+        assert cache.saved_input_tokens > 0 and cache.saved_output_tokens > 0
+
+    def test_locked_cache_does_not_fail_the_page(self, fake_server, tmp_path):
+        """Another process holding the write lock makes the cache write a no-op, the paid answer is kept."""
+        import sqlite3
+        from cache import ExtractionCache
+        from extract import extract_product
+        path = str(tmp_path / "cache.sqlite")
+        cache = ExtractionCache(path, timeout=0.1)
+        other = sqlite3.connect(path, isolation_level=None)
+        other.execute("BEGIN EXCLUSIVE")
+        try:
+            product = asyncio.run(extract_product("page text", cache))
+        finally:
+            other.execute("ROLLBACK")
+            other.close()
+        assert product.name and fake_server.requests == 1
+        assert len(cache) == 0
+        cache.put("k", product, 10, 5)
+        assert cache.get("k") == product
+
+    def test_key_depends_on_model_and_prompt(self):
+        """Changing the model or prompt must not reuse old extractions."""
+        from cache import ExtractionCache
+        base = ExtractionCache.key("text", "model-a", "prompt")
+        assert base == ExtractionCache.key("text", "model-a", "prompt")
+        assert base != ExtractionCache.key("text", "model-b", "prompt")
+        assert base != ExtractionCache.key("text", "model-a", "prompt v2")
+
+    def test_evicts_expired_and_least_recently_used(self, tmp_path):
+        """Old entries expire and the cache is trimmed to max_entries."""
+        from cache import ExtractionCache
+        cache = ExtractionCache(str(tmp_path / "cache.sqlite"), max_age=60, max_entries=2)
+        for i in range(3):
+            cache.put(f"k{i}", self._product(f"p{i}"), 10, 5)
+        cache.get("k0")
+        cache.db.execute("UPDATE products SET accessed = accessed - 10 WHERE key = 'k1'")
+        cache.evict()
+        assert len(cache) == 2 and cache.get("k1") is None
+        cache.db.execute("UPDATE products SET created = created - 120 WHERE key = 'k0'")
+        assert cache.get("k0") is None
+        cache.evict()
+        assert len(cache) == 1
+
+
+class TestStructuredFastPath:
+    """Tests for the JSON-LD -> Product fast path."""
+
+    JSONLD = {
+        "@type": "Product",
+        "name": "Trail Runner &amp; Co Shoes",
+        "description": "Light trail shoes.\n- Recycled mesh upper\n- Rock plate",
+        "image": [{"@type": "ImageObject", "url": "https://example.com/a.jpg"}, "https://example.com/b.jpg"],
+        "additionalProperty": [{"@type": "PropertyValue", "name": "Drop", "value": "6 mm"}],
+        "brand": {"@type": "Brand", "name": "Acme"},
+        "category": "Apparel & Accessories / Shoes",
+        "sku": "TR-1",
+        "offers": {
+            "@type": "Offer", "price": "89.00", "priceCurrency": "USD",
+            "availability": "https://schema.org/OutOfStock",
+            "priceSpecification": {"priceType": "https://schema.org/StrikethroughPrice", "price": "120.00"},
+        },
+    }
+
+    def test_maps_complete_product(self):
+        """A complete Product node should validate without the LLM."""
+        from structured import product_from_structured
+        product = product_from_structured([self.JSONLD], {})
+        assert product.name == "Trail Runner & Co Shoes"
+        assert product.price == Price(price=89.0, currency="USD", compare_at_price=120.0)
+        assert product.category.name == "Apparel & Accessories > Shoes"
+        assert product.image_urls == ["https://example.com/a.jpg", "https://example.com/b.jpg"]
+        assert product.variants == [Variant(sku="TR-1", aval=False)]
+        assert product.key_features == ["Drop: 6 mm", "Recycled mesh upper", "Rock plate"]
+
+    def test_missing_fields_fall_back(self):
+        """Pages without a price, features or a specific category must go to the LLM."""
+        from structured import map_structured, product_from_structured
+        jsonld = {**self.JSONLD, "name": "Mystery Item"}
+        del jsonld["offers"], jsonld["category"]
+        _, missing = map_structured([jsonld], {})
+        assert missing == ["price", "category"]
+        assert product_from_structured([jsonld], {}) is None
+        assert product_from_structured([], {"og:title": "Some Shoes"}) is None
+        _, missing = map_structured([{**self.JSONLD, "name": "Cordless Drill", "additionalProperty": [],
+                                      "description": "A drill.", "category": "Hardware > Tools > Drills"}], {})
+        # "Hardware > Tools > Drills" has subcategories
+        assert missing == ["key_features", "category"]
+
+    def test_category_is_never_guessed_from_the_name(self):
+        """Only a stated category (JSON-LD or breadcrumbs) is trusted, a name full of taxonomy words isn't."""
+        from structured import map_structured, product_from_structured
+        jsonld = {**self.JSONLD, "name": "Apple iPhone 15 Silicone Case - Blue"}
+        del jsonld["category"]
+        fields, missing = map_structured([jsonld], {})
+        assert fields["category"] is None and missing == ["category"]
+        assert product_from_structured([jsonld], {}) is None
+        crumbs = {"@type": "BreadcrumbList", "itemListElement": [
+            {"position": 2, "name": "Shoes"}, {"position": 1, "name": "Apparel & Accessories"}]}
+        fields, missing = map_structured([jsonld, crumbs], {})
+        assert fields["category"] == "Apparel & Accessories > Shoes" and missing == []
+
+    def test_product_group_variants(self):
+        """ProductGroup variants become Variants, pages without offers are unavailable."""
+        with open("data/nike.html", "r", encoding="utf-8") as f:
+            soup = BeautifulSoup(f.read(), "html.parser")
+        from preprocess import scan_html
+        from structured import map_structured, product_from_structured
+        jsonld, meta, _ = scan_html(soup)
+        fields, missing = map_structured(jsonld, meta)
+        assert fields["brand"] == "Nike" and fields["price"].currency == "GBP"
+        assert len(fields["variants"]) == 25
+        assert sum(v.aval for v in fields["variants"]) == 17
+        # no features in its structured data, the LLM reads them from the page
+        assert missing == ["key_features", "category"] and product_from_structured(jsonld, meta) is None
+
+    def test_pipeline_skips_llm(self, fake_server):
+        """Pages served by the fast path never reach the model."""
+        from extract import extract_pages
+        html = f'<script type="application/ld+json">{json.dumps(self.JSONLD)}</script>'
+
+        async def collect():
+            return [r async for r in extract_pages([("shoe.html", html)])]
+
+        [result] = asyncio.run(collect())
+        assert result.source == "structured" and result.tokens == 0
+        assert fake_server.requests == 0
+
+
+class TestNDJSONOutput:
+    """Tests for the incremental NDJSON writer and compaction."""
+
+    def test_compact_matches_json_dump(self, tmp_path):
+        """Compacted output should look exactly like the old json.dump(indent=2) files."""
+        from output import NDJSONWriter, compact
+        records = [{"name": "a", "price": {"price": 1.5}, "tags": []}, {"name": "b", "variants": [{"aval": True}]}]
+        with NDJSONWriter(str(tmp_path / "out.ndjson")) as writer:
+            for record in records:
+                writer.write(record)
+        assert compact(str(tmp_path / "out.ndjson"), [str(tmp_path / "a.json"), str(tmp_path / "sub" / "b.json")]) == 2
+        assert (tmp_path / "a.json").read_text() == json.dumps(records, indent=2)
+        assert (tmp_path / "sub" / "b.json").read_text() == json.dumps(records, indent=2)
+        compact(str(tmp_path / "missing.ndjson"), [str(tmp_path / "empty.json")])
+        assert (tmp_path / "empty.json").read_text() == json.dumps([], indent=2)
+
+    def test_rotation_and_torn_line(self, tmp_path):
+        """Rotated segments are read oldest first and a partial last line is ignored."""
+        from output import NDJSONWriter, iter_records, rotated_segments
+        path = str(tmp_path / "out.ndjson")
+        with NDJSONWriter(path, fsync_every=1, rotate_bytes=10) as writer:
+            offsets = [writer.write({"i": i}) for i in range(5)]
+        assert offsets[0] == (1, 0)
+        assert len(rotated_segments(path)) >= 2
+        with open(path, "a") as f:
+            f.write('{"i": 5, "trunc')
+        assert [r["i"] for r in iter_records(path)] == [0, 1, 2, 3, 4]
+
+    def test_main_streams_products(self, fake_server, tmp_path, monkeypatch):
+        """extract.main writes NDJSON as it goes and compacts it at the end."""
+        import extract
+        data = tmp_path / "data"
+        data.mkdir()
+        for i in range(3):
+            (data / f"p{i}.html").write_text(f"<html><body><p>Product {i}</p></body></html>")
+        monkeypatch.chdir(tmp_path)
+        asyncio.run(extract.main(str(data), concurrency=2))
+        lines = (tmp_path / "products.ndjson").read_text().splitlines()
+        assert len(lines) == 3
+        assert len(json.loads((tmp_path / "products.json").read_text())) == 3
+        assert (tmp_path / "frontend" / "src" / "data" / "products.json").exists()
+
+
+class TestResume:
+    """Tests for the checkpoint manifest and --resume."""
+
+    def test_resume_retries_only_failed_pages(self, fake_server, tmp_path, monkeypatch):
+        """A resumed run skips finished pages and redoes the failed one."""
+        import extract
+        from fake_openrouter import default_responder
+        data = tmp_path / "data"
+        data.mkdir()
+        for i in range(3):
+            (data / f"p{i}.html").write_text(f"<html><body><p>Product {i}</p></body></html>")
+        monkeypatch.chdir(tmp_path)
+
+        def flaky(body):
+            if "Product 1" in body["messages"][-1]["content"]:
+                return {"broken": True}
+            return default_responder(body)
+
+        fake_server.responder = flaky
+        asyncio.run(extract.main(str(data), fast_path=False))
+        assert fake_server.requests == 3
+        assert len(json.loads((tmp_path / "products.json").read_text())) == 2
+
+        fake_server.responder = default_responder
+        asyncio.run(extract.main(str(data), fast_path=False, resume=True))
+        assert fake_server.requests == 4
+        assert len(json.loads((tmp_path / "products.json").read_text())) == 3
+
+        # nothing left to do
+        asyncio.run(extract.main(str(data), fast_path=False, resume=True))
+        assert fake_server.requests == 4
+
+    def test_changed_or_lost_pages_are_redone(self, tmp_path):
+        """A done entry only counts for the same content and when its output line survived."""
+        from manifest import RunManifest, content_hash
+        from output import NDJSONWriter
+        output = str(tmp_path / "out.ndjson")
+        manifest = RunManifest(str(tmp_path / "manifest.jsonl"))
+        with NDJSONWriter(output) as writer:
+            manifest.record_done("a.html", content_hash("<p>a</p>"), *writer.write({"name": "a"}))
+        manifest.record_done("b.html", content_hash("<p>b</p>"), 1, 10_000)
+        manifest.close()
+
+        reloaded = RunManifest(str(tmp_path / "manifest.jsonl"), output_path=output)
+        assert reloaded.is_done("a.html", content_hash("<p>a</p>"))
+        assert not reloaded.is_done("a.html", content_hash("<p>a changed</p>"))
+        assert not reloaded.is_done("b.html", content_hash("<p>b</p>"))
+
+    def test_lost_records_stay_lost_after_new_writes(self, tmp_path):
+        """Done entries whose lines never reached the output are dropped before the resumed run writes."""
+        from manifest import RunManifest, content_hash
+        from output import NDJSONWriter
+        output = str(tmp_path / "out.ndjson")
+        manifest = RunManifest(str(tmp_path / "manifest.jsonl"))
+        manifest.record_done("a.html", content_hash("a"), 1, 0)
+        manifest.record_done("b.html", content_hash("b"), 1, 12)
+        manifest.close()
+        # killed before the NDJSON buffer was written out
+        open(output, "w").close()
+
+        writer = NDJSONWriter(output)
+        resumed = RunManifest(str(tmp_path / "manifest.jsonl"), output_path=output)
+        for name in ["c", "d"]:
+            writer.write({"name": name})
+        writer.close()
+        assert not resumed.is_done("a.html", content_hash("a"))
+        assert not resumed.is_done("b.html", content_hash("b"))
+
+
+class TestRetryAndAdaptiveLimit:
+    """Tests for the backoff/AIMD layer in ai.responses."""
+
+    def test_limiter_is_aimd(self):
+        """Successes ramp the limit up slowly, a burst of throttles halves it once."""
+        from ratelimit import AdaptiveLimiter
+        limiter = AdaptiveLimiter(initial=8, maximum=16)
+
+        async def go():
+            epochs = [await limiter.acquire() for _ in range(8)]
+            assert limiter.in_flight == 8
+            for epoch in epochs:
+                limiter.release(epoch, "throttle")
+            assert limiter.limit == 4 and limiter.decreases == 1
+            for _ in range(40):
+                limiter.release(await limiter.acquire(), "success")
+            assert 8 < limiter.limit < 16
+
+        asyncio.run(go())
+
+    def test_retry_after_parsing(self):
+        """Retry-After is read as seconds, milliseconds or an HTTP date."""
+        from email.utils import formatdate
+        import time
+        from ratelimit import RetryPolicy, retry_after_seconds
+        assert retry_after_seconds({"retry-after": "3"}) == 3
+        assert retry_after_seconds({"retry-after-ms": "250", "retry-after": "3"}) == 0.25
+        assert 8 < retry_after_seconds({"retry-after": formatdate(time.time() + 10, usegmt=True)}) <= 10
+        assert retry_after_seconds({}) is None
+        assert RetryPolicy(base_delay=0.01).delay(1, retry_after=2) >= 2
+
+    def test_concurrency_sets_the_limiter_ceiling(self, fake_server, monkeypatch):
+        """A run's concurrency above the limiter's default ceiling really puts that many calls in flight."""
+        import ai
+        from extract import extract_pages
+        from ratelimit import AdaptiveLimiter
+        monkeypatch.setattr(ai, "limiter", AdaptiveLimiter())
+        fake_server.latency = 2
+        pages = [(f"p{i}.html", f"<html><body><p>Product {i}</p></body></html>") for i in range(80)]
+
+        async def collect():
+            return [r async for r in extract_pages(pages, concurrency=80, fast_path=False)]
+
+        assert len(asyncio.run(collect())) == 80
+        assert ai.limiter.maximum == 80 and fake_server.max_in_flight > 64
+
+    def test_responses_recover_from_429s(self, fake_server, monkeypatch):
+        """Throttled calls are retried until they succeed and the limit backs off."""
+        import ai
+        from ratelimit import AdaptiveLimiter, RetryPolicy
+        monkeypatch.setattr(ai, "limiter", AdaptiveLimiter(initial=16, maximum=16))
+        monkeypatch.setattr(ai, "retry_policy", RetryPolicy(max_attempts=20, base_delay=0.01, max_delay=0.05))
+        fake_server.capacity = 4
+        fake_server.latency = 0.05
+        fake_server.retry_after = 0
+
+        async def go():
+            return await asyncio.gather(*(ai.responses("m", f"page {i}", text_format=Product) for i in range(20)))
+
+        products = asyncio.run(go())
+        assert len(products) == 20
+        assert fake_server.throttled > 0
+        assert ai.limiter.limit < 16
+
+    def test_non_retryable_errors_raise(self, fake_server):
+        """An invalid product is not transient and surfaces on the first attempt."""
+        import ai
+        import pydantic
+        fake_server.responder = lambda body: {"name": "missing everything"}
+        with pytest.raises(pydantic.ValidationError):
+            asyncio.run(ai.responses("m", "page", text_format=Product))
+        assert fake_server.requests == 1
+
+
+class TestUsageAccounting:
+    """Tests for measured token and cost accounting."""
+
+    def test_tracker_prices_and_histograms(self):
+        """Calls are priced per model and a page's calls land in one histogram sample."""
+        from usage import UsageTracker, page_context
+        tracker = UsageTracker({"m": {"input": 1.0, "output": 2.0}})
+        with page_context("a.html"):
+            tracker.record("m", 1_000, 100)
+            tracker.record("m", 500, 50, reasoning_tokens=20)
+        tracker.page_done("a.html")
+        tracker.record("other", 10, 10, page="b.html")
+        tracker.page_done("b.html")
+        report = tracker.to_dict()
+        assert report["models"]["m"] == {"calls": 2, "prompt_tokens": 1_500, "completion_tokens": 150,
+                                         "reasoning_tokens": 20, "cost": pytest.approx(0.0018)}
+        assert report["unpriced_models"] == ["other"]
+        assert report["page_prompt_tokens"]["count"] == 2
+        assert report["page_prompt_tokens"]["buckets"]["250"] == 1
+        assert report["page_prompt_tokens"]["buckets"]["2000"] == 2
+        text = tracker.prometheus()
+        assert 'extract_llm_tokens_total{model="m",kind="prompt"} 1500' in text
+        assert 'extract_page_prompt_tokens_bucket{le="+Inf"} 2' in text
+
+    def test_main_reports_provider_usage(self, fake_server, tmp_path, monkeypatch):
+        """The end-of-run report holds the usage the provider returned, not a length estimate."""
+        import extract
+        from prompts import extract_prompt
+        data = tmp_path / "data"
+        data.mkdir()
+        for i in range(3):
+            (data / f"p{i}.html").write_text(f"<html><body><p>Product {i}</p></body></html>")
+        monkeypatch.chdir(tmp_path)
+        asyncio.run(extract.main(str(data), fast_path=False, prometheus_path="usage.prom"))
+        report = json.loads((tmp_path / "usage.json").read_text())
+        usage = report["models"][extract.MODEL]
+        assert usage["calls"] == 3
+        # the fake reports len(prompt) // 4 prompt tokens
+        assert usage["prompt_tokens"] > 3 * len(extract_prompt) // 4
+        assert usage["cost"] > 0
+        assert report["page_prompt_tokens"]["count"] == 3
+        assert "extract_llm_cost_dollars_total" in (tmp_path / "usage.prom").read_text()
+
+
+class TestCompactPayload:
+    """Tests for the pruned, deduplicated LLM payload."""
+
+    def test_prunes_nodes_keys_and_duplicates(self):
+        from payload import compact_payload
+        jsonld = [{
+            "@context": "https://schema.org", "@type": "ProductGroup", "@id": "#group", "name": "Runner",
+            "description": "A long product description that is repeated by every single variant.",
+            "aggregateRating": {"ratingValue": 4.5}, "url": "https://shop.example/runner",
+            "hasVariant": [
+                {"@type": "Product", "size": "9", "description": "A long product description that is repeated by every single variant.",
+                 "offers": {"@type": "Offer", "price": 90, "availability": "https://schema.org/InStock"}},
+                {"url": "https://shop.example/runner-blue"},
+            ],
+        }, {"@type": "Organization", "name": "Shop"}, {"@type": "WebSite", "name": "Shop"}]
+        meta = {"viewport": "width=device-width", "og:title": "Runner shoe for long distances and trails",
+                "twitter:title": "Runner shoe for long distances and trails", "title": "Runner | Shop"}
+        text = "Menu\nA long product description that is repeated by every single variant.\nFree returns"
+        payload = compact_payload(jsonld, meta, text)
+        structured = json.loads(payload.split("\n")[1])
+        assert len(structured) == 1
+        group = structured[0]
+        assert "@context" not in group and "aggregateRating" not in group and "url" not in group
+        assert "description" not in group["hasVariant"][0]
+        assert group["hasVariant"][0]["offers"] == {"price": 90, "availability": "InStock"}
+        assert group["hasVariant"][1] == {"url": "https://shop.example/runner-blue"}
+        assert json.loads(payload.split("\n")[3]) == {"og:title": "Runner shoe for long distances and trails",
+                                                       "title": "Runner | Shop"}
+        assert payload.endswith("Page Content\nMenu\nFree returns")
+
+    @pytest.mark.parametrize("filename", ["ace.html", "adaysmarch.html", "article.html", "llbean.html", "nike.html"])
+    def test_structured_fields_survive_pruning(self, filename):
+        """The structured mapper reads the same fields from the pruned data as from the full data."""
+        from payload import _strings, compact_payload, prune_jsonld, prune_meta
+        from preprocess import format_payload, scan_html
+        from structured import map_structured
+        with open(f"data/{filename}", "r", encoding="utf-8") as f:
+            jsonld, meta, text = scan_html(BeautifulSoup(f.read(), "html.parser"))
+        pruned = prune_jsonld(jsonld)
+        assert map_structured(pruned, prune_meta(meta, _strings(pruned, set()))) == map_structured(jsonld, meta)
+        assert len(compact_payload(jsonld, meta, text)) < len(format_payload(jsonld, meta, text))
+
+
+class TestBoilerplate:
+    """Tests for per-domain boilerplate learning."""
+
+    @staticmethod
+    def _page(i: int, nav_lines: int = 40) -> str:
+        nav = "".join(f"<li>Department {n}</li>" for n in range(nav_lines))
+        return (f'<html><head><meta property="og:url" content="https://www.shop.example/p/{i}"></head><body>'
+                f'<nav><ul>{nav}</ul></nav><h1>Product number {i}</h1><p>Unique description {i}</p>'
+                f'<footer><p>Accept cookies</p><p>Copyright Shop</p><p>Free returns within 30 days on all orders</p>'
+                f'</footer></body></html>')
+
+    def test_learns_shared_lines_per_domain(self, tmp_path):
+        from boilerplate import BoilerplateModel, learn_from_pages
+        model = learn_from_pages([(f"p{i}", self._page(i)) for i in range(5)])
+        lines = model.lines("shop.example")
+        assert "Accept cookies" in lines and "Department 3" in lines
+        assert not any("Product number" in line for line in lines)
+        # one page of another site is not enough to learn from
+        assert model.lines("other.example") == frozenset()
+
+        model.save(str(tmp_path / "boilerplate.json"))
+        assert BoilerplateModel.load(str(tmp_path / "boilerplate.json")).lines("shop.example") == lines
+
+    def test_stripping_happens_before_truncation(self, tmp_path):
+        """Product text past a huge nav survives the 10,000 character cut once the nav is learned."""
+        from boilerplate import learn_from_pages
+        from preprocess_pool import prepare_page
+        path = str(tmp_path / "boilerplate.json")
+        pages = [self._page(i, nav_lines=2000) for i in range(4)]
+        learn_from_pages(enumerate(pages)).save(path)
+        assert "Unique description 0" not in prepare_page(pages[0]).processed
+        processed = prepare_page(pages[0], boilerplate=path).processed
+        assert "Unique description 0" in processed
+        assert "Department" not in processed and "[truncated]" not in processed
+
+    def test_variant_labels_survive(self):
+        """Sizes, colours and a cart button shared by every product page are product data, not template."""
+        from boilerplate import learn_from_pages
+        pages = []
+        for i in range(5):
+            variants = "".join(f"<li>{label}</li>" for label in ["Size", "S", "M", "L", "XL", "Black", "Navy"])
+            pages.append((f"p{i}", self._page(i).replace(
+                "<p>Unique description", f"<ul>{variants}</ul><button>Add to cart</button><p>$49.00</p>"
+                                         f"<p>Unique notes {i}</p><p>Unique description")))
+        lines = learn_from_pages(pages).lines("shop.example")
+        assert "Department 3" in lines and "Accept cookies" in lines
+        assert not lines & {"Size", "S", "XL", "Navy", "Add to cart", "$49.00"}
+
+    def test_only_runs_of_learned_lines_are_stripped(self):
+        """A learned menu entry repeated inside the product text is kept, the menu block itself goes."""
+        from boilerplate import BoilerplateModel
+        model = BoilerplateModel(min_run_chars=30)
+        model.domains["shop.example"] = frozenset({"Running", "Black", "Trail", "Accept cookies", "Copyright Shop"})
+        text = "Running\nBlack\nTrail\n\nAccept cookies\nCopyright Shop\nRoad shoe\nColour:\nBlack\nFor Running"
+        assert model.strip("shop.example", text) == "Road shoe\nColour:\nBlack\nFor Running"
+
+
+class TestTracing:
+    """Tests for per-stage span tracing."""
+
+    def test_disabled_tracer_records_nothing(self):
+        from tracing import Tracer
+        tracer = Tracer()
+        with tracer.span("read") as span:
+            span.bytes_out = 10
+        tracer.record("llm", 0.5)
+        assert tracer.stages == {}
+
+    def test_main_traces_every_stage(self, fake_server, tmp_path, monkeypatch):
+        """A traced run summarizes each stage and writes a loadable trace file and per-stage profiles."""
+        import extract
+        from tracing import tracer
+        data = tmp_path / "data"
+        data.mkdir()
+        for i in range(4):
+            (data / f"p{i}.html").write_text(f"<html><body><p>Product {i}</p></body></html>")
+        monkeypatch.chdir(tmp_path)
+        try:
+            asyncio.run(extract.main(str(data), trace_file="trace.json", profile_dir="profiles"))
+            summary = tracer.summary()
+        finally:
+            tracer.configure(enabled=False)
+        for stage in ["read", "preprocess", "structured", "queue_wait", "llm", "validate", "finalize", "write",
+                      "compact"]:
+            assert stage in summary
+        assert summary["llm"]["count"] == summary["validate"]["count"] == 4
+        assert summary["llm"]["p50_ms"] <= summary["llm"]["p99_ms"]
+        assert summary["read"]["bytes_out"] > 0
+        events = json.loads((tmp_path / "trace.json").read_text())
+        assert {e["name"] for e in events} == set(summary)
+        assert (tmp_path / "profiles" / "preprocess.prof").exists()
+
+
+class TestBatchMode:
+    """Tests for batch-API extraction against the fake server's batch endpoints."""
+
+    def test_batch_run_maps_results_to_products(self, fake_server, tmp_path, monkeypatch):
+        """Every page goes through one uploaded file per job, results come back post-processed."""
+        import batch
+        data = tmp_path / "data"
+        data.mkdir()
+        for i in range(5):
+            (data / f"p{i}.html").write_text(f"<html><body><p>Product {i}</p></body></html>")
+        monkeypatch.chdir(tmp_path)
+
+        stats = asyncio.run(batch.run(str(data), max_requests=2, fast_path=False, poll_interval=0))
+        assert stats["batched"] == 5 and stats["failed"] == {}
+        assert len(fake_server.batches) == 3
+        state = json.loads((tmp_path / "batch_jobs.json").read_text())
+        assert [job["requests"] for job in state["jobs"]] == [2, 2, 1]
+        products = json.loads((tmp_path / "products.json").read_text())
+        assert len(products) == 5
+        # same clean-up as extract.main
+        assert all(p["image_urls"] == ["https://example.com/image.jpg"] for p in products)
+
+    def test_jobs_are_split_by_size(self, fake_server, tmp_path, monkeypatch):
+        """A job's input file never grows past max_bytes, whatever max_requests allows."""
+        import batch
+        data = tmp_path / "data"
+        data.mkdir()
+        for i in range(5):
+            (data / f"p{i}.html").write_text(f"<html><body><p>Product {i} {'x' * 300}</p></body></html>")
+        monkeypatch.chdir(tmp_path)
+        line = len(json.dumps(batch.request_line("p0.html", "x" * 330))) + 1
+        state = asyncio.run(batch.submit(str(data), fast_path=False, max_bytes=int(line * 2.5)))
+        assert [job["requests"] for job in state["jobs"]] == [2, 2, 1]
+
+    def test_started_jobs_are_saved_when_a_later_one_fails(self, fake_server, tmp_path, monkeypatch):
+        """The state file lists every job that started, even when creating the next one fails."""
+        import batch
+        data = tmp_path / "data"
+        data.mkdir()
+        for i in range(3):
+            (data / f"p{i}.html").write_text(f"<html><body><p>Product {i}</p></body></html>")
+        monkeypatch.chdir(tmp_path)
+        create_batch = fake_server.create_batch
+
+        def fail_second(body):
+            if fake_server.batches:
+                raise RuntimeError("provider down")
+            return create_batch(body)
+
+        monkeypatch.setattr(fake_server, "create_batch", fail_second)
+        with pytest.raises(Exception):
+            asyncio.run(batch.submit(str(data), fast_path=False, max_requests=2))
+        with open("batch_jobs.json") as f:
+            assert [job["id"] for job in json.load(f)["jobs"]] == ["batch-1"]
+
+    def test_bad_results_are_reported(self):
+        """Invalid products and provider errors map to errors, not exceptions."""
+        import batch
+        from fake_openrouter import FakeOpenRouter
+        invalid = FakeOpenRouter().completion({"messages": []})
+        invalid["choices"][0]["message"]["content"] = '{"name": "only a name"}'
+        lines = [
+            {"custom_id": "a.html", "response": {"status_code": 200, "body": invalid}, "error": None},
+            {"custom_id": "b.html", "response": {"status_code": 500, "body": {}}, "error": None},
+            {"custom_id": "c.html", "response": None, "error": {"message": "expired"}},
+        ]
+        for line in lines:
+            name, result = batch.parse_result_line(json.dumps(line))
+            assert name == line["custom_id"]
+            assert isinstance(result, Exception)
+
+
+class TestPacking:
+    """Tests for multi-page packed requests against the fake server."""
+
+    @staticmethod
+    def _pages(n):
+        return [(f"page{i}.html", f"<html><body><p>Product {i}</p></body></html>") for i in range(n)]
+
+    def test_packed_run_needs_fewer_requests(self, fake_server):
+        """Every page still gets its own product, in far fewer calls."""
+        from extract import extract_pages
+
+        stats = {}
+
+        async def both():
+            single = [r async for r in extract_pages(self._pages(10), fast_path=False)]
+            packed = [r async for r in extract_pages(self._pages(10), fast_path=False, pack_tokens=10_000,
+                                                     pack_pages=4, pack_stats=stats)]
+            return single, packed
+
+        single, packed = asyncio.run(both())
+        assert fake_server.requests == 10 + 3
+        assert stats == {"packs": 3, "fallbacks": 0}
+        # products are keyed back to the right page, same as extracting each page alone
+        by_name = lambda results: {r.name: r.product.name for r in results}
+        assert by_name(packed) == by_name(single)
+
+    def test_invalid_items_fall_back_to_single_calls(self, fake_server):
+        """A missing or invalid product in the pack is retried on its own."""
+        import packing
+        from fake_openrouter import default_responder
+
+        def sloppy(body):
+            answer = default_responder(body)
+            if "products" in answer:
+                answer["products"][0]["product"] = {"name": "missing everything"}
+                del answer["products"][1]
+            return answer
+
+        fake_server.responder = sloppy
+        stats = {}
+        results = asyncio.run(packing.extract_packed([(f"p{i}", f"text {i}") for i in range(3)], stats=stats))
+        assert all(not isinstance(r, Exception) for r in results.values()) and len(results) == 3
+        assert stats == {"packs": 1, "fallbacks": 2}
+        assert fake_server.requests == 3
+
+    def test_bad_item_is_repaired_not_redone(self, fake_server):
+        """A packed product with one bad field gets the field repair, not a whole one-page extraction."""
+        import packing
+        from fake_openrouter import default_responder
+
+        def bad_category(body):
+            answer = default_responder(body)
+            if "products" in answer:
+                answer["products"][0]["product"]["cat"] = "Zzzz > Qqqq"
+            return answer
+
+        fake_server.responder = bad_category
+        stats = {}
+        results = asyncio.run(packing.extract_packed([(f"p{i}", f"text {i}") for i in range(3)], stats=stats))
+        assert all(not isinstance(r, Exception) for r in results.values()) and len(results) == 3
+        assert stats == {"packs": 1, "fallbacks": 0}
+        # the pack plus one small repair call
+        assert fake_server.requests == 2
+
+    def test_pack_usage_is_spread_over_its_pages(self, fake_server):
+        """Each packed page is one sample in the per-page histograms, sharing the pack's tokens."""
+        import ai
+        from extract import extract_pages
+
+        async def run():
+            return [r async for r in extract_pages(self._pages(8), fast_path=False, pack_tokens=10_000,
+                                                   pack_pages=4)]
+
+        ai.usage.reset()
+        asyncio.run(run())
+        assert fake_server.requests == 2
+        assert ai.usage.page_prompt_tokens.count == 8
+        assert ai.usage.page_prompt_tokens.sum == pytest.approx(ai.usage.totals().prompt_tokens)
+
+    def test_unreadable_answer_splits_the_pack(self, fake_server):
+        """An answer that isn't JSON (e.g. cut off) halves the pack instead of failing every page."""
+        import packing
+        from fake_openrouter import default_responder
+
+        def truncated(body):
+            answer = default_responder(body)
+            if "products" in answer and len(answer["products"]) > 2:
+                return "cut off"
+            return answer
+
+        fake_server.responder = truncated
+        stats = {}
+        results = asyncio.run(packing.extract_packed([(f"p{i}", f"text {i}") for i in range(4)], stats=stats))
+        assert sorted(results) == ["p0", "p1", "p2", "p3"]
+        assert all(not isinstance(r, Exception) for r in results.values())
+        assert stats["splits"] == 1 and stats["packs"] == 3
+
+
+class TestModelCascade:
+    """Tests for cheap-first extraction with escalation on bad products."""
+
+    def test_checks_and_ordering(self):
+        """Tiers are ordered by price and unknown models are refused."""
+        import cascade
+        from fake_openrouter import DEFAULT_PRODUCT
+        from models import Product
+        product = Product.model_validate(DEFAULT_PRODUCT)
+        assert cascade.check_product(product) == []
+        product.price.price = 0
+        product.image_urls = []
+        assert cascade.check_product(product) == ["price", "images"]
+        assert cascade.cascade_models(["google/gemini-3-flash-preview", "google/gemini-2.0-flash-lite-001"]) == [
+            "google/gemini-2.0-flash-lite-001", "google/gemini-3-flash-preview"]
+        with pytest.raises(ValueError):
+            cascade.cascade_models(["someone/unpriced"])
+
+    def test_only_failing_pages_escalate(self, fake_server):
+        """Pages the cheap model gets wrong go to the next tier, a single bad field is repaired instead."""
+        from cascade import DEFAULT_CASCADE
+        from extract import extract_pages
+        from fake_openrouter import default_responder
+
+        def cheap_is_sloppy(body):
+            product = default_responder(body)
+            # full extractions only (wire keys), repair requests ask for a single field
+            if body["model"] == DEFAULT_CASCADE[0] and "cat" in product:
+                page = body["messages"][1]["content"].split()[-1]
+                if page == "1":
+                    product["p"] = 0
+                if page == "2":
+                    product["cat"] = "Zzzz > Qqqq"
+            return product
+
+        fake_server.responder = cheap_is_sloppy
+        pages = [(f"page{i}.html", f"<html><body><p>Product {i}</p></body></html>") for i in range(5)]
+        stats = {}
+
+        async def collect():
+            return [r async for r in extract_pages(pages, fast_path=False, compact_payload=False,
+                                                   cascade=DEFAULT_CASCADE, cascade_stats=stats)]
+
+        results = asyncio.run(collect())
+        assert all(r.error is None for r in results)
+        assert all(r.product.price.price > 0 for r in results)
+        # the unknown category is repaired in place, the zero price needs the next model
+        assert stats == {DEFAULT_CASCADE[0]: 4, DEFAULT_CASCADE[1]: 1}
+        assert fake_server.requests == 7
+
+    def test_unfixable_page_keeps_last_valid_answer(self, fake_server):
+        """A page without images fails the checks at every tier but is not dropped."""
+        import cascade
+
+        def no_images(body):
+            from fake_openrouter import default_responder
+            product = default_responder(body)
+            product["i"] = []
+            return product
+
+        fake_server.responder = no_images
+        stats = {}
+        product = asyncio.run(cascade.extract_cascade("page text", cascade.DEFAULT_CASCADE, stats=stats))
+        assert product.image_urls == []
+        assert stats == {"unresolved": 1}
+        assert fake_server.requests == len(cascade.DEFAULT_CASCADE)
+
+
+class TestFieldRepair:
+    """Tests for repairing a single invalid field instead of re-extracting the page."""
+
+    PAGE = "Page Content\nHome > Footwear > Trail Shoes\nTrail Runner 2\nPrice: $120.00 USD\n" + "filler text\n" * 500
+
+    def test_snippet_and_broken_fields(self):
+        """Only the lines that mention the field are sent along."""
+        import repair
+        from fake_openrouter import DEFAULT_PRODUCT
+        from models import Product
+        data = json.loads(json.dumps(DEFAULT_PRODUCT))
+        del data["price"]["currency"]
+        data["category"]["name"] = "Zzzz > Qqqq"
+        with pytest.raises(Exception) as error:
+            Product.model_validate(data)
+        assert repair.broken_fields(error.value) == ["price", "category"]
+        assert repair.snippet(self.PAGE, "price") == "Price: $120.00 USD"
+        assert repair.snippet("nothing relevant", "brand") == "nothing relevant"
+
+    def test_bad_category_is_repaired_in_place(self, fake_server):
+        """One small follow-up call fixes the category and every other field is kept."""
+        import repair
+        from fake_openrouter import DEFAULT_PRODUCT
+        bodies = []
+
+        def record(body):
+            from fake_openrouter import default_responder
+            bodies.append(body)
+            return default_responder(body)
+
+        fake_server.responder = record
+        data = json.loads(json.dumps(DEFAULT_PRODUCT))
+        data["category"]["name"] = "Zzzz > Qqqq"
+        product = asyncio.run(repair.validate_or_repair(data, self.PAGE, "fake"))
+        assert fake_server.requests == 1
+        assert product.name == DEFAULT_PRODUCT["name"] and product.price.price == 19.99
+        # the answer had to be one of the nearest taxonomy paths
+        choices = bodies[0]["response_format"]["json_schema"]["schema"]
+        assert product.category.name in json.dumps(choices)
+        assert len(bodies[0]["messages"][1]["content"]) < len(self.PAGE) / 2
+        assert repair.repairs["category"] >= 1
+
+    def test_too_many_broken_fields_are_not_repaired(self, fake_server):
+        """A mostly wrong answer raises so the page is extracted again instead."""
+        import repair
+        from pydantic import ValidationError
+        with pytest.raises(ValidationError):
+            asyncio.run(repair.validate_or_repair({"name": "only a name"}, self.PAGE, "fake"))
+        assert fake_server.requests == 0
+
+
+class TestWireSchema:
+    """Tests for the compact output schema the model answers in."""
+
+    @staticmethod
+    def _variants(product):
+        return sorted((v.model_dump_json() for v in product.variants))
+
+    def test_round_trips_real_products(self):
+        """Every product in products.json survives to_wire -> expand, in far fewer tokens on apparel."""
+        import wire
+        from models import Product
+        with open("products.json", "r", encoding="utf-8") as f:
+            products = [Product.model_validate(p) for p in json.load(f)]
+        for product in products:
+            back = Product.model_validate(wire.expand(wire.to_wire(product)))
+            assert back.model_dump(exclude={"variants"}) == product.model_dump(exclude={"variants"})
+            assert self._variants(back) == self._variants(product)
+        nike = next(p for p in products if "Nike" in p.name)
+        assert wire.output_tokens(wire.to_wire(nike)) < wire.output_tokens(nike.model_dump(mode="json")) / 2
+
+    def test_response_format_is_strict(self):
+        """Built from the pydantic schema: every object closed and every property required, $defs included."""
+        import packing
+        import wire
+        for fmt, name in ((wire.WIRE_FORMAT, "WireProduct"), (packing.RESPONSE_FORMAT, "PackedProducts")):
+            assert fmt["type"] == "json_schema" and fmt["json_schema"]["name"] == name
+            assert fmt["json_schema"]["strict"] is True
+            schema = fmt["json_schema"]["schema"]
+            for obj in [schema, *schema.get("$defs", {}).values()]:
+                assert obj["additionalProperties"] is False
+                assert obj["required"] == list(obj["properties"])
+        assert set(packing.RESPONSE_FORMAT["json_schema"]["schema"]["$defs"]) == {"PackedItem", "WireProduct",
+                                                                                  "WireColor"}
+
+    def test_matrix_expansion(self):
+        """Shared SKUs, missing combinations, sold out cells and sizes without colors."""
+        import wire
+        base = {"n": "Tee", "p": 20, "c": "USD", "cp": 0, "d": "", "f": [], "i": [], "v": "", "cat": "Shoes", "b": "B"}
+        data = wire.expand({**base, "sz": ["S", "M"], "m": [{"n": "Red", "a": "0-", "s": ["R1"], "p": [], "cp": []},
+                                                             {"n": "Blue", "a": "", "s": [], "p": [25], "cp": []}]})
+        assert data["colors"] == ["Red", "Blue"]
+        assert [(v["color"], v["size"], v["sku"], v["aval"]) for v in data["variants"]] == [
+            ("Red", "S", "R1", False), ("Blue", "S", None, True), ("Blue", "M", None, True)]
+        assert data["variants"][1]["price"] == {"price": 25, "currency": "USD", "compare_at_price": None}
+        assert data["price"]["compare_at_price"] is None and data["video_url"] is None
+
+        sizes_only = wire.expand({**base, "sz": ["8", "9"], "m": []})
+        assert [(v["color"], v["size"]) for v in sizes_only["variants"]] == [(None, "8"), (None, "9")]
+        colors_only = wire.expand({**base, "sz": [], "m": [{"n": "Red", "a": "", "s": [], "p": [], "cp": []}]})
+        assert colors_only["colors"] == ["Red"] and colors_only["variants"] == []
+
+    def test_price_per_size(self):
+        """A color priced by size, with a sale on one size, keeps each variant's price through the wire."""
+        import wire
+        from models import Category, Price, Product, Variant
+        variants = [Variant(size="S", color="Red", price=Price(price=20, currency="USD", compare_at_price=30)),
+                    Variant(size="M", color="Red"),
+                    Variant(size="L", color="Red", price=Price(price=24, currency="USD"))]
+        product = Product(name="Tee", price=Price(price=22, currency="USD"), description="", key_features=[],
+                          image_urls=[], category=Category(name="Apparel & Accessories > Clothing"), brand="B",
+                          colors=["Red"], variants=variants)
+        answer = wire.to_wire(product)
+        assert answer["m"][0]["p"] == [20, 0, 24] and answer["m"][0]["cp"] == [30, 0, 0]
+        assert Product.model_validate(wire.expand(answer)).variants == variants
+        # a sale on a size sold at the product price
+        base = {"n": "Tee", "p": 20, "c": "USD", "cp": 0, "d": "", "f": [], "i": [], "v": "", "cat": "Shoes", "b": "B"}
+        data = wire.expand({**base, "sz": ["S", "M"], "m": [{"n": "", "a": "", "s": [], "p": [], "cp": [0, 25]}]})
+        assert [v["price"] for v in data["variants"]] == [
+            None, {"price": 20, "currency": "USD", "compare_at_price": 25}]
+
+
+class TestTransport:
+    """Tests for the per-event-loop client and the configurable transport."""
+
+    def test_client_per_event_loop(self, fake_server):
+        """Each asyncio.run gets its own client, calls within one loop share it."""
+        import ai
+
+        async def clients():
+            return ai._get_client(), ai._get_client()
+
+        first, again = asyncio.run(clients())
+        second, _ = asyncio.run(clients())
+        assert first is again and first is not second
+
+    def test_streamed_structured_output(self, fake_server):
+        """Streaming assembles the same parsed product and still records usage."""
+        import ai
+        from models import Product
+        from transport import TransportConfig
+        ai.usage.reset()
+        ai.configure_transport(TransportConfig(stream=True, max_connections=4))
+        try:
+            product = asyncio.run(ai.responses("fake", "a page", text_format=Product))
+        finally:
+            ai.configure_transport(TransportConfig())
+        assert product.name.startswith("Fake Product")
+        assert ai.usage.totals().calls == 1 and ai.usage.totals().completion_tokens > 0
+
+
+class TestIngest:
+    """Tests for reading pages from folders and crawl archives."""
+
+    def test_tar_archive_streams_html_members(self, tmp_path):
+        """A tar.gz yields its .html members in order and skips everything else."""
+        import io
+        import tarfile
+        from ingest import iter_pages
+        path = tmp_path / "crawl.tar.gz"
+        with tarfile.open(path, "w:gz") as archive:
+            for name, body in [("a/one.html", "<p>one</p>"), ("notes.txt", "skip"), ("b/two.html", "<p>twö</p>")]:
+                data = body.encode()
+                member = tarfile.TarInfo(name)
+                member.size = len(data)
+                archive.addfile(member, io.BytesIO(data))
+        assert list(iter_pages(str(path))) == [("a/one.html", "<p>one</p>"), ("b/two.html", "<p>twö</p>")]
+
+    def test_warc_decodes_responses_and_skips_the_rest(self, tmp_path):
+        """Chunked, gzip encoded responses are decoded; requests, errors and non-HTML are skipped."""
+        import gzip
+        from ingest import iter_pages
+        body = gzip.compress("<html>café</html>".encode("latin-1"))
+        chunked = b"%x\r\n" % len(body) + body + b"\r\n0\r\n\r\n"
+        responses = [
+            ("https://shop.test/ok", b"HTTP/1.1 200 OK\r\nContent-Type: text/html; charset=ISO-8859-1\r\n"
+                                     b"Content-Encoding: gzip\r\nTransfer-Encoding: chunked\r\n\r\n" + chunked),
+            ("https://shop.test/missing", b"HTTP/1.1 404 Not Found\r\nContent-Type: text/html\r\n\r\n<p>gone</p>"),
+            ("https://shop.test/logo.png", b"HTTP/1.1 200 OK\r\nContent-Type: image/png\r\n\r\n\x89PNG"),
+        ]
+        path = tmp_path / "crawl.warc.gz"
+        with open(path, "wb") as out:
+            out.write(gzip.compress(b"WARC/1.0\r\nWARC-Type: request\r\nWARC-Target-URI: https://shop.test/ok\r\n"
+                                    b"Content-Length: 4\r\n\r\nGET \r\n\r\n"))
+            for uri, block in responses:
+                out.write(gzip.compress(f"WARC/1.0\r\nWARC-Type: response\r\nWARC-Target-URI: <{uri}>\r\n"
+                                        f"Content-Length: {len(block)}\r\n\r\n".encode() + block + b"\r\n\r\n"))
+        assert list(iter_pages(str(path))) == [("https://shop.test/ok", "<html>café</html>")]
+
+    def test_corrupt_records_are_skipped(self, tmp_path, caplog):
+        """A record whose body can't be decoded is logged and skipped, the records after it still stream."""
+        from ingest import iter_pages
+        ok = b"HTTP/1.1 200 OK\r\nContent-Type: text/html\r\n\r\n"
+        records = [("https://a.test/1", ok + b"<p>one</p>"),
+                   ("https://a.test/bad-gzip", ok.replace(b"\r\n\r\n", b"\r\nContent-Encoding: gzip\r\n\r\n")
+                    + b"<p>not gzip</p>"),
+                   ("https://a.test/bad-chunk", ok.replace(b"\r\n\r\n", b"\r\nTransfer-Encoding: chunked\r\n\r\n")
+                    + b"zz\r\n<p>x</p>\r\n0\r\n\r\n"),
+                   ("https://a.test/2", ok + b"<p>two</p>")]
+        path = tmp_path / "crawl.warc"
+        with open(path, "wb") as out:
+            for uri, block in records:
+                out.write(f"WARC/1.0\r\nWARC-Type: response\r\nWARC-Target-URI: <{uri}>\r\n"
+                          f"Content-Length: {len(block)}\r\n\r\n".encode() + block + b"\r\n\r\n")
+        with caplog.at_level("WARNING", logger="ingest"):
+            pages = list(iter_pages(str(path)))
+        assert pages == [("https://a.test/1", "<p>one</p>"), ("https://a.test/2", "<p>two</p>")]
+        assert "bad-gzip" in caplog.text and "bad-chunk" in caplog.text
+
+    def test_repeated_uris_get_unique_names(self, tmp_path, fake_server, monkeypatch):
+        """A URI fetched twice gives two pages with distinct, stable names that a run can extract."""
+        import extract
+        from ingest import iter_pages
+        from jobqueue import page_refs
+        (tmp_path / "data").mkdir()
+        path = tmp_path / "data" / "crawl.warc"
+        with open(path, "wb") as out:
+            for uri, text in [("https://a.test/x", "first"), ("https://a.test/x", "second"),
+                              ("https://a.test/x#1", "third"), ("https://a.test/x", "fourth")]:
+                block = f"HTTP/1.1 200 OK\r\nContent-Type: text/html\r\n\r\n<p>{text} fetch</p>".encode()
+                out.write(f"WARC/1.0\r\nWARC-Type: response\r\nWARC-Target-URI: <{uri}>\r\n"
+                          f"Content-Length: {len(block)}\r\n\r\n".encode() + block + b"\r\n\r\n")
+        names = [name for name, _ in iter_pages(str(path))]
+        assert names == ["https://a.test/x", "https://a.test/x#1", "https://a.test/x#1#1", "https://a.test/x#2"]
+        assert [name for name, *_ in page_refs(str(tmp_path / "data"))] == names
+        monkeypatch.chdir(tmp_path)
+        asyncio.run(extract.main(str(tmp_path / "data"), fast_path=False, usage_report=None))
+        assert len(json.loads((tmp_path / "products.json").read_text())) == 4
+
+    def test_memory_mapped_read_matches_text_mode(self, tmp_path):
+        """read_text gives the same string as open(..., encoding="utf-8").read(), CRLF included."""
+        from ingest import read_text
+        path = tmp_path / "page.html"
+        path.write_bytes("<p>naïve</p>\r\n<p>two</p>\r\n".encode())
+        with open(path, "r", encoding="utf-8") as f:
+            assert read_text(str(path)) == f.read()
+        (tmp_path / "empty.html").write_bytes(b"")
+        assert read_text(str(tmp_path / "empty.html")) == ""
+
+
+class TestDedup:
+    """Tests for near-duplicate clustering."""
+
+    @staticmethod
+    def _text(seed, words=300):
+        import random
+        rng = random.Random(seed)
+        return " ".join(rng.choice(["red", "blue", "cotton", "trail", "lamp", "drill", "steel", "soft", "men",
+                                    "women", "size", "fit", "wash", "light", "warm", "pack"]) + str(rng.randint(0, 99))
+                        for _ in range(words))
+
+    def test_text_near_duplicates_cluster(self):
+        """A copy with a few changed words joins the cluster, a different page and a short page don't."""
+        from dedup import DedupIndex
+        page = self._text(1)
+        index = DedupIndex()
+        assert index.add("a", page, [], {}) is None
+        assert index.add("a?utm_source=x", page + " only 3 left viewed 12 times", [], {}) == "a"
+        assert index.add("b", self._text(2), [], {}) is None
+        assert index.add("tiny", "Sold out", [], {}) is None
+        assert (index.pages, index.clusters, index.by_text) == (4, 3, 1)
+
+    def test_product_identifiers_match_within_a_site(self):
+        """Pages naming the same product group match, the same sku on another site doesn't."""
+        from dedup import DedupIndex
+        group = {"@type": "ProductGroup", "productGroupID": "G1", "url": "https://shop.test/g1"}
+        variant = {"@type": "Product", "sku": "G1-RED", "url": "https://shop.test/g1?color=red",
+                   "isVariantOf": {"@type": "ProductGroup", "productGroupID": "G1"}}
+        other_site = {"@type": "Product", "productGroupID": "G1", "url": "https://other.test/g1"}
+        index = DedupIndex()
+        assert index.add("group", self._text(1), [group], {}) is None
+        assert index.add("red", self._text(2), [variant], {}) == "group"
+        assert index.add("other", self._text(3), [other_site], {}) is None
+        assert index.by_identifier == 1
+
+    def test_different_products_on_one_template_stay_apart(self):
+        """Near-identical text doesn't merge pages whose skus differ, ids without a known site don't match."""
+        from dedup import DedupIndex
+        page = self._text(1)
+        drill = {"@type": "Product", "sku": "D-100", "gtin13": "0885911325905", "url": "https://shop.test/d100"}
+        # a copied listing that kept the other product's gtin
+        saw = {"@type": "Product", "sku": "S-200", "gtin13": "0885911325905", "url": "https://shop.test/s200"}
+        index = DedupIndex()
+        assert index.add("drill", page, [drill], {}) is None
+        assert index.add("saw", page + " circular saw", [saw], {}) is None
+        assert index.add("drill?ref=x", page + " viewed 3 times", [drill], {}) == "drill"
+        nowhere = DedupIndex()
+        assert nowhere.add("a", self._text(2), [{"@type": "Product", "sku": "X1"}], {}) is None
+        assert nowhere.add("b", self._text(3), [{"@type": "Product", "sku": "X1"}], {}) is None
+
+    def test_duplicates_are_copied_without_llm_calls(self, fake_server):
+        """Only the representative is extracted, its duplicates get the same product."""
+        from dedup import DedupIndex
+        from extract import extract_pages
+        body = "".join(f"<p>{self._text(i, 40)}</p>" for i in range(8))
+        pages = [("a.html", f"<html><body>{body}</body></html>"),
+                 ("a-copy.html", f"<html><body>{body}<p>viewed 7 times today</p></body></html>"),
+                 ("b.html", f"<html><body><p>{self._text(99)}</p></body></html>")]
+        index = DedupIndex()
+
+        async def collect():
+            return {r.name: r async for r in extract_pages(pages, fast_path=False, dedup=index)}
+
+        results = asyncio.run(collect())
+        assert fake_server.requests == 2
+        assert results["a-copy.html"].source == "duplicate"
+        assert results["a-copy.html"].product == results["a.html"].product
+        assert index.clusters == 2
+
+
+class TestLazyParsing:
+    """Tests for the tree-less lazy preprocessor."""
+
+    def test_matches_scan_html_on_awkward_markup(self):
+        """Entities, unclosed and stray tags, skipped containers and CDATA come out like the soup walk."""
+        from preprocess import scan_html, scan_html_lazy
+        html = """<!DOCTYPE html><html><head><title> Shop &amp; <b>Co</b> </title>
+        <meta property="og:title" content="Trail &quot;Runner&quot;"><meta name="empty" content>
+        <script>var t = '<meta name="fake" content="x">';</script></head>
+        <body><p>Price &pound;20&#33; &nope; &#x2764</p><div>unclosed <span>nested</div> after
+        <template><p>hidden</p></template><ruby>漢<rt>kan</rt></ruby><svg><title>icon</title></svg>
+        line<br>break</br>glued<img src="a.png"></img>tail <![CDATA[raw data]]> <!-- <meta name="c" content="d"> -->
+        <script type="application/ld+json">{"@type": "Product", "name": "Trail Runner"}</script>
+        <script type="application/ld+json">not json</script><p/>end</body></html>"""
+        lazy_jsonld, lazy_meta, lazy_text, complete = scan_html_lazy(html)
+        assert complete
+        assert (lazy_jsonld, lazy_meta, lazy_text) == scan_html(BeautifulSoup(html, "html.parser"))
+
+    def test_stops_reading_text_at_the_budget(self):
+        """A huge page keeps only the text the payload can use, but still finds data after it."""
+        from preprocess import preprocess_html, preprocess_html_lazy, scan_html_lazy
+        rows = "".join(f"<li>Customer review number {i} says it fits well</li>" for i in range(20_000))
+        html = (f"<html><head><title>Big</title></head><body><ul>{rows}</ul>"
+                "<script>document.write('<meta name=\"fake\" content=\"x\">')</script>"
+                '<meta name="late" content="yes">'
+                '<script type="application/ld+json">{"@type": "Product", "name": "Late"}</script></body></html>')
+        jsonld, meta, text, complete = scan_html_lazy(html)
+        assert not complete and 10_000 < len(text) < 11_000
+        assert jsonld == [{"@type": "Product", "name": "Late"}]
+        assert meta == {"late": "yes", "title": "Big"}
+        assert preprocess_html_lazy(html) == preprocess_html(html)
+
+    def test_reads_on_when_dedup_leaves_the_payload_short(self):
+        """Text lines dropped before truncation don't leave the lazy payload short of the full one."""
+        from preprocess_pool import prepare_page
+        description = "A lightweight trail running shoe with a grippy rubber outsole"
+        repeated = f"<p>{description}</p>" * 400
+        html = ('<html><head><script type="application/ld+json">'
+                f'{{"@type": "Product", "name": "Runner", "description": "{description}"}}</script></head>'
+                f"<body>{repeated}<p>Only in the full text</p></body></html>")
+        lazy = prepare_page(html)
+        assert lazy == prepare_page(html, lazy=False)
+        assert "Only in the full text" in lazy.processed
+
+
+class TestRefresh:
+    """Tests for refreshing known pages from their offers."""
+
+    @staticmethod
+    def _page(price="100.00", availability="InStock", text="A light trail running shoe."):
+        offers = f'{{"price": "{price}", "priceCurrency": "USD", "availability": "https://schema.org/{availability}"}}'
+        return ('<html><head><script type="application/ld+json">{"@type": "Product", "name": "Runner", '
+                f'"sku": "R1", "offers": {offers}}}</script></head>'
+                f"<body><p>{text}</p><p>Now ${price}</p><p>{'In stock' if availability == 'InStock' else 'Sold out'}</p>"
+                "</body></html>")
+
+    def test_fingerprint_ignores_offers_only(self):
+        """Price and stock changes keep the fingerprint, a new description doesn't."""
+        from preprocess_pool import prepare_page
+        from refresh import fingerprint
+        base = fingerprint(prepare_page(self._page()))
+        assert fingerprint(prepare_page(self._page(price="80.00", availability="OutOfStock"))) == base
+        assert fingerprint(prepare_page(self._page(text="Now with a recycled upper."))) != base
+
+    def test_apply_offers_updates_price_and_stock(self):
+        """Changed offers land on the stored product, variants it can't match send the page to the LLM."""
+        from refresh import apply_offers
+        product = Product(name="Runner", price=Price(price=100, currency="USD"), description="d", key_features=[],
+                          image_urls=[], category=Category(name="Apparel & Accessories > Shoes"), brand="b",
+                          colors=[], variants=[Variant(sku="R1", size="9"), Variant(sku="R2", size="10")])
+        usd = {"price": 100.0, "currency": "USD", "compare_at_price": None}
+        old = {"price": usd, "variants": {"sku:R1": [True, None], "sku:R2": [True, None]}}
+        new = {"price": {**usd, "price": 80.0}, "variants": {"sku:R1": [True, None], "sku:R2": [False, None]}}
+        updated = apply_offers(product, old, new)
+        assert updated.price.price == 80 and [v.aval for v in updated.variants] == [True, False]
+        assert product.price.price == 100
+        assert apply_offers(product, old, {**new, "variants": {"sku:R3": [True, None]}}) is None
+
+    def test_recrawl_skips_the_llm_for_price_changes(self, fake_server, tmp_path):
+        """A known page with a new price is served from the store, a rewritten one is extracted again."""
+        from extract import extract_pages
+        from refresh import RefreshStore
+        store = RefreshStore(str(tmp_path / "refresh.sqlite"))
+
+        async def crawl(html):
+            return [r async for r in extract_pages([("runner.html", html)], refresh=store)][0]
+
+        first = asyncio.run(crawl(self._page()))
+        assert first.source == "llm" and fake_server.requests == 1
+        repriced = asyncio.run(crawl(self._page(price="80.00")))
+        assert repriced.source == "refresh" and fake_server.requests == 1
+        assert repriced.product.price.price == 80 and repriced.product.name == first.product.name
+        rewritten = asyncio.run(crawl(self._page(price="80.00", text="Now with a recycled upper.")))
+        assert rewritten.source == "llm" and fake_server.requests == 2
+        assert store.outcomes == {"new": 1, "offers": 1, "changed": 1}
+
+class TestJobQueue:
+    """Tests for the SQLite job queue and its workers."""
+
+    @staticmethod
+    def _refs(n):
+        return [(f"page{i}.html", None, f"<html><body><p>Product {i}</p></body></html>") for i in range(n)]
+
+    def test_lease_and_ack(self, tmp_path):
+        """Jobs are leased once, in order, and acked with their result."""
+        from jobqueue import SQLiteJobQueue
+        queue = SQLiteJobQueue(str(tmp_path / "jobs.sqlite"))
+        assert queue.enqueue(self._refs(3)) == 3
+        assert queue.enqueue(self._refs(4)) == 1
+        first = queue.lease("a", 3)
+        assert [job.name for job in first] == ["page0.html", "page1.html", "page2.html"]
+        second = queue.lease("b", 3)
+        assert [job.name for job in second] == ["page3.html"] and second[0].read().startswith("<html>")
+        assert queue.lease("c", 3) == []
+        queue.ack(first[0], '{"name": "p0"}')
+        queue.fail(first[1], "boom")
+        assert queue.counts() == {"queued": 1, "leased": 2, "done": 1, "failed": 0}
+        assert list(queue.results()) == [("page0.html", '{"name": "p0"}')]
+
+    def test_expired_lease_is_retried_then_failed(self, tmp_path):
+        """A job whose worker stopped renewing goes to another worker, until it runs out of attempts."""
+        import time
+        from jobqueue import SQLiteJobQueue
+        queue = SQLiteJobQueue(str(tmp_path / "jobs.sqlite"), lease_seconds=0.05, max_attempts=2)
+        queue.enqueue(self._refs(1))
+        assert queue.lease("a", 1)[0].attempts == 1
+        assert queue.lease("b", 1) == []
+        time.sleep(0.1)
+        retry = queue.lease("b", 1)
+        assert retry[0].attempts == 2
+        time.sleep(0.1)
+        assert queue.lease("c", 1) == []
+        assert queue.counts()["failed"] == 1 and queue.failures() == [("page0.html", "lease expired")]
+
+    def test_fail_after_losing_the_lease(self, tmp_path):
+        """A worker whose lease expired can't requeue the job another worker now holds."""
+        import time
+        from jobqueue import JobQueue, SQLiteJobQueue
+        with pytest.raises(TypeError):
+            JobQueue()
+        queue = SQLiteJobQueue(str(tmp_path / "jobs.sqlite"), lease_seconds=0.05)
+        queue.enqueue(self._refs(1))
+        stale = queue.lease("a", 1)[0]
+        time.sleep(0.1)
+        current = queue.lease("b", 1)[0]
+        queue.fail(stale, "late")
+        assert queue.counts()["leased"] == 1
+        queue.fail(current, "boom")
+        assert queue.counts()["queued"] == 1
+
+    def test_leases_renewed_while_calls_are_slow(self, fake_server, tmp_path, monkeypatch):
+        """Leases outlive lease_seconds while the worker waits on calls, without pulling more pages."""
+        from jobqueue import SQLiteJobQueue, work
+        monkeypatch.chdir(tmp_path)
+        fake_server.latency = 1.0
+        path = str(tmp_path / "jobs.sqlite")
+        queue = SQLiteJobQueue(path, lease_seconds=0.3)
+        queue.enqueue(self._refs(4))
+
+        async def go():
+            worker = asyncio.create_task(work(queue, "w1", concurrency=4, fast_path=False))
+            await asyncio.sleep(0.7)
+            other = SQLiteJobQueue(path, lease_seconds=0.3)
+            stolen = other.lease("w2", 4)
+            other.close()
+            return stolen, await worker
+
+        stolen, acked = asyncio.run(go())
+        assert stolen == [] and acked == 4
+        assert fake_server.requests == 4
+
+    def test_work_drains_the_queue(self, fake_server, tmp_path, monkeypatch):
+        """A worker extracts every queued page and collect writes their products."""
+        from jobqueue import SQLiteJobQueue, collect, work
+        monkeypatch.chdir(tmp_path)
+        queue = SQLiteJobQueue(str(tmp_path / "jobs.sqlite"))
+        queue.enqueue(self._refs(10))
+        assert asyncio.run(work(queue, "w1", concurrency=4)) == 10
+        assert queue.counts() == {"queued": 0, "leased": 0, "done": 10, "failed": 0}
+        assert fake_server.requests == 10
+        assert collect(queue, "products.ndjson") == 10
+        with open("products.json") as f:
+            assert len(json.load(f)) == 10
+
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
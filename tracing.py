@@ -0,0 +1,205 @@
+# Per-stage latency tracing for the extraction pipeline.
+# Each stage (disk read, preprocessing, queue wait, LLM round trip, validation, output) records
+# spans with wall time, CPU time and bytes in/out. The end of a run prints p50/p95/p99 per stage,
+# and optionally writes a Chrome/Perfetto trace file and one cProfile dump per synchronous stage.
+# Disabled (the default) span() hands back a shared no-op object, so the hooks cost next to nothing.
+import cProfile
+import json
+import os
+import random
+import time
+from dataclasses import dataclass, field
+
+# samples kept per stage for percentiles; counts and sums stay exact past this
+MAX_SAMPLES = 100_000
+
+
+@dataclass
+class StageStats:
+    count: int = 0
+    wall: float = 0.0
+    cpu: float = 0.0
+    bytes_in: int = 0
+    bytes_out: int = 0
+    samples: list[float] = field(default_factory=list)
+
+    def add(self, wall: float, cpu: float, bytes_in: int, bytes_out: int, rng: random.Random) -> None:
+        self.count += 1
+        self.wall += wall
+        self.cpu += cpu
+        self.bytes_in += bytes_in
+        self.bytes_out += bytes_out
+        # reservoir sampling keeps memory flat on huge runs
+        if len(self.samples) < MAX_SAMPLES:
+            self.samples.append(wall)
+        else:
+            i = rng.randrange(self.count)
+            if i < MAX_SAMPLES:
+                self.samples[i] = wall
+
+    def percentile(self, q: float) -> float:
+        ordered = sorted(self.samples)
+        if not ordered:
+            return 0.0
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class _NoopSpan:
+    bytes_in = 0
+    bytes_out = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+class Span:
+    __slots__ = ("tracer", "stage", "bytes_in", "bytes_out", "start", "cpu_start", "profiler")
+
+    def __init__(self, tracer: "Tracer", stage: str, bytes_in: int):
+        self.tracer = tracer
+        self.stage = stage
+        self.bytes_in = bytes_in
+        self.bytes_out = 0
+        self.profiler = None
+
+    def __enter__(self):
+        self.profiler = self.tracer._start_profile(self.stage)
+        self.cpu_start = time.thread_time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.start
+        cpu = time.thread_time() - self.cpu_start
+        if self.profiler is not None:
+            self.tracer._stop_profile(self.profiler)
+        self.tracer.record(self.stage, wall, cpu, self.bytes_in, self.bytes_out, self.start)
+        return False
+
+
+class Tracer:
+    """
+    Collects spans per stage. Configure once per run, then use span() for synchronous code and
+    record() for durations measured across awaits (CPU time is not meaningful there, other tasks
+    run on the same thread in between).
+    """
+
+    def __init__(self):
+        self.configure(enabled=False)
+
+    def configure(self, enabled: bool = True, trace_file: str | None = None, profile_dir: str | None = None) -> None:
+        self.enabled = enabled or bool(trace_file) or bool(profile_dir)
+        self.stages: dict[str, StageStats] = {}
+        self.profile_dir = profile_dir
+        self.profiles: dict[str, cProfile.Profile] = {}
+        self._profiling = False
+        self._rng = random.Random(0)
+        self._origin = time.perf_counter()
+        self._trace = None
+        if trace_file:
+            self._trace = open(trace_file, "w")
+            self._trace.write("[\n")
+            self._first_event = True
+
+    def span(self, stage: str, bytes_in: int = 0):
+        if not self.enabled:
+            return _NOOP
+        return Span(self, stage, bytes_in)
+
+    def record(self, stage: str, wall: float, cpu: float = 0.0, bytes_in: int = 0, bytes_out: int = 0,
+               start: float | None = None) -> None:
+        if not self.enabled:
+            return
+        self.stages.setdefault(stage, StageStats()).add(wall, cpu, bytes_in, bytes_out, self._rng)
+        if self._trace is not None:
+            start = time.perf_counter() - wall if start is None else start
+            event = {"name": stage, "ph": "X", "pid": os.getpid(), "tid": 0,
+                     "ts": round((start - self._origin) * 1e6), "dur": round(wall * 1e6),
+                     "args": {"cpu_ms": round(cpu * 1000, 3), "bytes_in": bytes_in, "bytes_out": bytes_out}}
+            self._trace.write(("" if self._first_event else ",\n") + json.dumps(event))
+            self._first_event = False
+
+    def _start_profile(self, stage: str) -> cProfile.Profile | None:
+        # only one profiler can be active at a time, a nested span just isn't profiled
+        if self.profile_dir is None or self._profiling:
+            return None
+        profiler = self.profiles.setdefault(stage, cProfile.Profile())
+        profiler.enable()
+        self._profiling = True
+        return profiler
+
+    def _stop_profile(self, profiler: cProfile.Profile) -> None:
+        profiler.disable()
+        self._profiling = False
+
+    def summary(self) -> dict[str, dict]:
+        return {stage: {
+            "count": stats.count,
+            "wall_s": stats.wall,
+            "cpu_s": stats.cpu,
+            "p50_ms": stats.percentile(0.50) * 1000,
+            "p95_ms": stats.percentile(0.95) * 1000,
+            "p99_ms": stats.percentile(0.99) * 1000,
+            "bytes_in": stats.bytes_in,
+            "bytes_out": stats.bytes_out,
+        } for stage, stats in self.stages.items()}
+
+    def print_summary(self) -> None:
+        if not self.stages:
+            return
+        print(f"{'Stage':<14} {'Count':>7} {'Wall s':>8} {'CPU s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+              f"{'MB in':>8} {'MB out':>8}")
+        for stage, row in self.summary().items():
+            print(f"{stage:<14} {row['count']:>7,} {row['wall_s']:>8.2f} {row['cpu_s']:>8.2f} {row['p50_ms']:>9.2f} "
+                  f"{row['p95_ms']:>9.2f} {row['p99_ms']:>9.2f} {row['bytes_in'] / 1e6:>8.2f} "
+                  f"{row['bytes_out'] / 1e6:>8.2f}")
+
+    def close(self) -> None:
+        """Finish the trace file and write the per-stage profiles (stage.prof, readable with pstats)."""
+        if self._trace is not None:
+            self._trace.write("\n]\n")
+            self._trace.close()
+            self._trace = None
+        if self.profile_dir:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            for stage, profiler in self.profiles.items():
+                profiler.dump_stats(os.path.join(self.profile_dir, f"{stage}.prof"))
+
+
+# the process-wide tracer the pipeline reports to, off until a run configures it
+tracer = Tracer()
+
+
+#overhead check: what a span costs per page when tracing is off and on
+if __name__ == "__main__":
+    import argparse
+    import timeit
+
+    parser = argparse.ArgumentParser(description="Measure per-span overhead of the tracer")
+    parser.add_argument("--spans", type=int, default=200_000)
+    args = parser.parse_args()
+
+    def traced():
+        with tracer.span("stage", 100) as span:
+            span.bytes_out = 10
+
+    def untraced():
+        pass
+
+    bare = min(timeit.repeat(untraced, number=args.spans, repeat=5))
+    tracer.configure(enabled=False)
+    off = min(timeit.repeat(traced, number=args.spans, repeat=5))
+    tracer.configure(enabled=True)
+    on = min(timeit.repeat(traced, number=args.spans, repeat=5))
+    print(f"{args.spans:,} spans")
+    print(f"{'disabled':<10} {(off - bare) / args.spans * 1e9:>8.0f} ns/span")
+    print(f"{'enabled':<10} {(on - bare) / args.spans * 1e9:>8.0f} ns/span")
@@ -0,0 +1,141 @@
+# HTTP transport for the OpenRouter client.
+# Connection pool size, keep-alive, HTTP/2 and timeouts in one place, and a client per event loop:
+# an httpx client holds connections bound to the loop that opened them, so a process that runs
+# several asyncio.run() calls (tests, benches, batch submit then collect) or forks worker
+# processes must not share one. Streaming makes the read timeout apply between chunks instead of
+# to the whole answer, so a long generation doesn't need a huge timeout to survive.
+import asyncio
+import os
+import weakref
+from dataclasses import dataclass
+
+import openai
+
+try:  # openai >= 3 runs on httpx2, older releases on httpx; Limits/Timeout are the same
+    import httpx2 as httpx
+except ImportError:
+    import httpx
+
+
+@dataclass(frozen=True)
+class TransportConfig:
+    """
+    max_connections: open connections per client, in flight requests beyond it wait up to pool_timeout
+    max_keepalive: idle connections kept for reuse, bursts don't pay a new TCP/TLS handshake each
+    keepalive_expiry: seconds an idle connection is kept
+    http2: multiplex requests over few connections (needs the h2 package)
+    connect_timeout / read_timeout / write_timeout / pool_timeout: seconds, read_timeout is per chunk
+    stream: stream completions and assemble them client side
+    """
+    max_connections: int = 256
+    max_keepalive: int = 256
+    keepalive_expiry: float = 60.0
+    http2: bool = False
+    connect_timeout: float = 5.0
+    read_timeout: float = 120.0
+    write_timeout: float = 30.0
+    pool_timeout: float = 30.0
+    stream: bool = False
+
+    def http_client(self) -> httpx.AsyncClient:
+        # the SDK's client class keeps its own defaults (redirects etc.) for everything not set here
+        return openai.DefaultAsyncHttpxClient(
+            limits=httpx.Limits(max_connections=self.max_connections,
+                                max_keepalive_connections=self.max_keepalive,
+                                keepalive_expiry=self.keepalive_expiry),
+            timeout=httpx.Timeout(connect=self.connect_timeout, read=self.read_timeout,
+                                  write=self.write_timeout, pool=self.pool_timeout),
+            http2=self.http2,
+        )
+
+
+class ClientPool:
+    """One client per (process, event loop), built by `factory` on first use in that loop."""
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.clear()
+
+    def clear(self) -> None:
+        self._pid = os.getpid()
+        # entries go away with their loop
+        self._clients: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+    def get(self):
+        if os.getpid() != self._pid:
+            # a forked child must not reuse the parent's sockets
+            self.clear()
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = self._clients[loop] = self.factory()
+        return client
+
+    async def close(self) -> None:
+        """Close the current loop's client, call before the loop ends to release its connections."""
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.close()
+
+
+#bench: requests/sec through ai.responses at 1, 32 and 256 in-flight calls against the fake server
+if __name__ == "__main__":
+    import argparse
+    import socket
+    import subprocess
+    import sys
+    import time
+
+    import ai
+
+    parser = argparse.ArgumentParser(description="Client throughput at several in-flight levels")
+    parser.add_argument("--latency", type=float, default=0.05, help="fake server seconds per request")
+    parser.add_argument("--seconds", type=float, default=3.0, help="rough duration of each run")
+    parser.add_argument("--levels", default="1,32,256")
+    args = parser.parse_args()
+
+    # the fake server runs in its own process so it doesn't share the client's GIL
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    server = subprocess.Popen([sys.executable, "fake_openrouter.py", "--port", str(port), "--latency", str(args.latency)],
+                              stdout=subprocess.DEVNULL)
+    os.environ["open_router_key"] = "fake"
+    os.environ["open_router_base_url"] = f"http://127.0.0.1:{port}/api/v1"
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            break
+        except OSError:
+            time.sleep(0.1)
+    configs = {
+        "sdk default": None,
+        "no keep-alive": TransportConfig(max_keepalive=0),
+        "tuned": TransportConfig(),
+        "tuned, streaming": TransportConfig(stream=True),
+    }
+
+    async def run(config: TransportConfig | None, in_flight: int) -> tuple[float, int]:
+        # the path real calls take: per-loop client, adaptive limiter and retries
+        ai.configure_transport(config)
+        ai.configure_concurrency(in_flight)
+        # enough requests that each level runs about args.seconds at the ideal rate
+        total = max(in_flight, int(args.seconds * in_flight / args.latency))
+        start = time.perf_counter()
+        results = await asyncio.gather(*(ai.responses("fake", "bench") for _ in range(total)), return_exceptions=True)
+        elapsed = time.perf_counter() - start
+        await ai.clients.close()
+        return total / elapsed, sum(isinstance(r, Exception) for r in results)
+
+    levels = [int(level) for level in args.levels.split(",")]
+    print(f"fake server latency {args.latency * 1000:.0f}ms, ideal rate = in-flight / latency")
+    print(f"{'client':<18}" + "".join(f" {f'{level} in flight':>16}" for level in levels))
+    try:
+        for label, config in configs.items():
+            cells = []
+            for level in levels:
+                rate, failed = asyncio.run(run(config, level))
+                cells.append(f"{rate:>9.0f} req/s" + (f" ({failed} failed)" if failed else ""))
+            print(f"{label:<18}" + "".join(f" {cell:>16}" for cell in cells))
+    finally:
+        server.terminate()
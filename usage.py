@@ -0,0 +1,203 @@
+# Measured token usage and cost for a run.
+# ai.responses reports the provider's usage numbers for every call here. Totals are kept per model
+# and per page, and folded into token histograms once a page is finished, so memory does not grow
+# with the number of pages. The report goes out as JSON and as a Prometheus textfile.
+import json
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass
+
+# page the current task is working on, so calls made deep inside ai.responses get attributed to it;
+# {page: weight} for a request that carries several pages (packing.py)
+current_page: ContextVar[str | dict[str, float] | None] = ContextVar("current_page", default=None)
+
+# upper bounds of the per-page token histogram buckets, +Inf is implied
+TOKEN_BUCKETS = (250, 500, 1_000, 2_000, 4_000, 8_000, 16_000, 32_000, 64_000)
+
+
+@contextmanager
+def page_context(name: str | dict[str, float]):
+    """Attribute the calls made inside to a page, or spread them over {page: weight} pages."""
+    token = current_page.set(name)
+    try:
+        yield
+    finally:
+        current_page.reset(token)
+
+
+@dataclass
+class ModelUsage:
+    calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    # part of completion_tokens, kept separately to see what thinking costs
+    reasoning_tokens: int = 0
+    cost: float = 0.0
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus layout."""
+
+    def __init__(self, buckets=TOKEN_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> list[tuple[str, int]]:
+        total = 0
+        rows = []
+        for bound, count in zip([*map(str, self.buckets), "+Inf"], self.counts):
+            total += count
+            rows.append((bound, total))
+        return rows
+
+    def to_dict(self) -> dict:
+        return {"buckets": dict(self.cumulative()), "sum": self.sum, "count": self.count}
+
+
+class UsageTracker:
+    """
+    Accumulates real prompt/completion/reasoning tokens and dollars from every LLM call.
+
+    prices: {model: {"input": $/1M, "output": $/1M}}, unknown models cost 0 and are listed
+    under unpriced_models so a missing price doesn't silently read as free.
+    """
+
+    def __init__(self, prices: dict[str, dict[str, float]]):
+        self.prices = prices
+        self.reset()
+
+    def reset(self) -> None:
+        self.models: dict[str, ModelUsage] = {}
+        self.unpriced_models: set[str] = set()
+        self._open_pages: dict[str, list[int]] = {}
+        self.page_prompt_tokens = Histogram()
+        self.page_completion_tokens = Histogram()
+
+    def price(self, model: str, prompt_tokens: int, completion_tokens: int) -> float:
+        prices = self.prices.get(model)
+        if prices is None:
+            self.unpriced_models.add(model)
+            return 0.0
+        return (prompt_tokens * prices["input"] + completion_tokens * prices["output"]) / 1_000_000
+
+    def record(self, model: str, prompt_tokens: int, completion_tokens: int, reasoning_tokens: int = 0,
+               page: str | None = None) -> float:
+        """Add one call's usage, returning its cost. page defaults to the current page_context."""
+        cost = self.price(model, prompt_tokens, completion_tokens)
+        usage = self.models.setdefault(model, ModelUsage())
+        usage.calls += 1
+        usage.prompt_tokens += prompt_tokens
+        usage.completion_tokens += completion_tokens
+        usage.reasoning_tokens += reasoning_tokens
+        usage.cost += cost
+        page = page or current_page.get()
+        if page is None:
+            # a call outside any page is its own sample
+            self.page_prompt_tokens.observe(prompt_tokens)
+            self.page_completion_tokens.observe(completion_tokens)
+            return cost
+        # a packed call is split over its pages by weight
+        weights = page if isinstance(page, dict) else {page: 1}
+        total = sum(weights.values()) or 1
+        for name, weight in weights.items():
+            totals = self._open_pages.setdefault(name, [0, 0])
+            totals[0] += prompt_tokens * weight / total
+            totals[1] += completion_tokens * weight / total
+        return cost
+
+    def page_done(self, page: str) -> None:
+        """Fold a finished page's totals into the histograms (pages that never called the LLM are skipped)."""
+        totals = self._open_pages.pop(page, None)
+        if totals is not None:
+            self.page_prompt_tokens.observe(totals[0])
+            self.page_completion_tokens.observe(totals[1])
+
+    def totals(self) -> ModelUsage:
+        total = ModelUsage()
+        for usage in self.models.values():
+            total.calls += usage.calls
+            total.prompt_tokens += usage.prompt_tokens
+            total.completion_tokens += usage.completion_tokens
+            total.reasoning_tokens += usage.reasoning_tokens
+            total.cost += usage.cost
+        return total
+
+    def to_dict(self) -> dict:
+        return {
+            "models": {model: asdict(usage) for model, usage in sorted(self.models.items())},
+            "total": asdict(self.totals()),
+            "unpriced_models": sorted(self.unpriced_models),
+            "page_prompt_tokens": self.page_prompt_tokens.to_dict(),
+            "page_completion_tokens": self.page_completion_tokens.to_dict(),
+        }
+
+    def prometheus(self) -> str:
+        lines = [
+            "# HELP extract_llm_calls_total LLM calls that returned usage.",
+            "# TYPE extract_llm_calls_total counter",
+        ]
+        for model, usage in sorted(self.models.items()):
+            lines.append(f'extract_llm_calls_total{{model="{model}"}} {usage.calls}')
+        lines += [
+            "# HELP extract_llm_tokens_total Tokens reported by the provider.",
+            "# TYPE extract_llm_tokens_total counter",
+        ]
+        for model, usage in sorted(self.models.items()):
+            for kind in ("prompt", "completion", "reasoning"):
+                lines.append(f'extract_llm_tokens_total{{model="{model}",kind="{kind}"}} '
+                             f'{getattr(usage, kind + "_tokens")}')
+        lines += [
+            "# HELP extract_llm_cost_dollars_total Cost priced from MODEL_PRICES.",
+            "# TYPE extract_llm_cost_dollars_total counter",
+        ]
+        for model, usage in sorted(self.models.items()):
+            lines.append(f'extract_llm_cost_dollars_total{{model="{model}"}} {usage.cost:.8f}')
+        for name, histogram in (("extract_page_prompt_tokens", self.page_prompt_tokens),
+                                ("extract_page_completion_tokens", self.page_completion_tokens)):
+            lines += [f"# HELP {name} Tokens per page across all its LLM calls.", f"# TYPE {name} histogram"]
+            for bound, count in histogram.cumulative():
+                lines.append(f'{name}_bucket{{le="{bound}"}} {count}')
+            lines += [f"{name}_sum {histogram.sum}", f"{name}_count {histogram.count}"]
+        return "\n".join(lines) + "\n"
+
+    def write_json(self, path: str) -> None:
+        _write_atomic(path, json.dumps(self.to_dict(), indent=2))
+
+    def write_prometheus(self, path: str) -> None:
+        _write_atomic(path, self.prometheus())
+
+    def print_report(self) -> None:
+        print(f"{'Model':<36} {'Calls':>7} {'Prompt':>12} {'Completion':>12} {'Reasoning':>10} {'Cost':>10}")
+        for model, usage in sorted(self.models.items()):
+            print(f"{model:<36} {usage.calls:>7,} {usage.prompt_tokens:>12,} {usage.completion_tokens:>12,} "
+                  f"{usage.reasoning_tokens:>10,} ${usage.cost:>9.4f}")
+        total = self.totals()
+        print(f"{'TOTAL':<36} {total.calls:>7,} {total.prompt_tokens:>12,} {total.completion_tokens:>12,} "
+              f"{total.reasoning_tokens:>10,} ${total.cost:>9.4f}")
+        pages = self.page_prompt_tokens.count
+        if pages:
+            print(f"Per page: {self.page_prompt_tokens.sum / pages:,.0f} prompt + "
+                  f"{self.page_completion_tokens.sum / pages:,.0f} completion tokens on average over {pages} pages")
+        if self.unpriced_models:
+            print(f"No price in MODEL_PRICES for: {', '.join(sorted(self.unpriced_models))} (counted as $0)")
+
+
+def _write_atomic(path: str, text: str) -> None:
+    # the Prometheus textfile collector must never see a half written file
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        f.write(text)
+    os.replace(tmp, path)
@@ -0,0 +1,188 @@
+# Compact wire schema for LLM output.
+# Output tokens cost 4x input on the default model and generation time grows with them. Product
+# makes the model write one full object per size x color with the color name and nulls repeated
+# every time. The wire format the model answers in instead uses short keys, empty values instead
+# of nulls, and a colors x sizes matrix: one row per color with a character per size for
+# availability and the SKUs. expand() turns it back into Product-shaped data locally.
+#
+# Structured outputs in strict mode make every key required, so nulls can't just be left out;
+# "" / 0 / [] stand in for "not on the page" and cost a token or two instead of four.
+import json
+
+from pydantic import BaseModel
+
+from models import Product
+
+# availability marks in a matrix row, one per size
+IN_STOCK, SOLD_OUT, NOT_SOLD = "1", "0", "-"
+
+
+class WireColor(BaseModel):
+    # color name, "" when the page has sizes but no colors
+    n: str
+    # one IN_STOCK/SOLD_OUT/NOT_SOLD mark per size, "" when every size is in stock
+    a: str
+    # SKU per size, a single SKU shared by the whole color, or []
+    s: list[str]
+    # price per size, a single price shared by the whole color, or [] when it's the product price;
+    # 0 for a size at the product price
+    p: list[float]
+    # compare_at_price in the same layout as p, [] when the color isn't on sale
+    cp: list[float]
+
+
+class WireProduct(BaseModel):
+    n: str
+    p: float
+    c: str
+    cp: float
+    d: str
+    f: list[str]
+    i: list[str]
+    v: str
+    cat: str
+    b: str
+    sz: list[str]
+    m: list[WireColor]
+
+
+def _strict(schema):
+    # strict mode wants every object closed and every property listed as required
+    if isinstance(schema, dict):
+        if "properties" in schema:
+            schema["additionalProperties"] = False
+            schema["required"] = list(schema["properties"])
+        for value in schema.values():
+            _strict(value)
+    elif isinstance(schema, list):
+        for value in schema:
+            _strict(value)
+    return schema
+
+
+def response_format(model: type[BaseModel]) -> dict:
+    """A strict json_schema response_format built from the model's own JSON schema."""
+    return {"type": "json_schema",
+            "json_schema": {"schema": _strict(model.model_json_schema()), "name": model.__name__, "strict": True}}
+
+
+WIRE_FORMAT = response_format(WireProduct)
+
+
+def _cell(values: list, j: int):
+    # a single value covers the whole row
+    if len(values) == 1:
+        return values[0]
+    return values[j] if j < len(values) else None
+
+
+def expand(wire: dict) -> dict:
+    """Product-shaped data from a wire answer, left unvalidated so Product (and repair.py) can check it."""
+    currency = wire.get("c") or None
+    sizes = [size or None for size in wire.get("sz") or []]
+    rows = wire.get("m") or ([{}] if sizes else [])
+    colors, variants = [], []
+    for row in rows:
+        color = row.get("n") or None
+        if color and color not in colors:
+            colors.append(color)
+        marks, skus = row.get("a") or "", row.get("s") or []
+        prices, compare = row.get("p") or [], row.get("cp") or []
+        # a color without sizes is only a variant when the page says something about it
+        cells = sizes or ([None] if skus or any(prices) or any(compare) or SOLD_OUT in marks else [])
+        for j, size in enumerate(cells):
+            mark = marks[j] if j < len(marks) else IN_STOCK
+            if mark == NOT_SOLD:
+                continue
+            compare_at = _cell(compare, j) or None
+            # a size on sale at the product price still needs a price to carry its compare_at_price
+            price = _cell(prices, j) or (wire.get("p") if compare_at else None)
+            variants.append({
+                "size": size,
+                "sku": _cell(skus, j) or None,
+                "color": color,
+                "price": {"price": price, "currency": currency, "compare_at_price": compare_at} if price else None,
+                "aval": mark != SOLD_OUT,
+            })
+    return {
+        "name": wire.get("n"),
+        "price": {"price": wire.get("p"), "currency": currency, "compare_at_price": wire.get("cp") or None},
+        "description": wire.get("d"),
+        "key_features": wire.get("f") or [],
+        "image_urls": wire.get("i") or [],
+        "video_url": wire.get("v") or None,
+        "category": {"name": wire.get("cat")},
+        "brand": wire.get("b"),
+        "colors": colors,
+        "variants": variants,
+    }
+
+
+def _squeeze(values: list, row: list) -> list:
+    # [] when nothing is set, one value when every sold size shares it, else one per size
+    sold = {value for value, variant in zip(values, row) if variant is not None}
+    if not any(values):
+        return []
+    if len(sold) == 1:
+        return [sold.pop()]
+    return values
+
+
+def to_wire(product: Product) -> dict:
+    """The wire answer for a product, used by the size report and the fake model server."""
+    colors = list(dict.fromkeys([*product.colors, *(v.color for v in product.variants if v.color)]))
+    if any(v.color is None for v in product.variants) or not colors and product.variants:
+        colors.append(None)
+    sizes = list(dict.fromkeys(v.size for v in product.variants if v.size is not None))
+    if any(v.size is None for v in product.variants) and sizes:
+        sizes.append(None)
+    cells = {(v.color, v.size): v for v in product.variants}
+    rows = []
+    for color in colors:
+        row = [cells.get((color, size)) for size in sizes or [None]]
+        marks = "".join(NOT_SOLD if v is None else IN_STOCK if v.aval else SOLD_OUT for v in row)
+        skus = [v.sku or "" if v else "" for v in row]
+        prices = [v.price.price if v and v.price else 0 for v in row]
+        compare = [v.price.compare_at_price or 0 if v and v.price else 0 for v in row]
+        rows.append({
+            "n": color or "",
+            "a": "" if set(marks) <= {IN_STOCK} else marks,
+            "s": _squeeze(skus, row),
+            "p": _squeeze(prices, row),
+            "cp": _squeeze(compare, row),
+        })
+    return {
+        "n": product.name, "p": product.price.price, "c": product.price.currency,
+        "cp": product.price.compare_at_price or 0, "d": product.description, "f": product.key_features,
+        "i": product.image_urls, "v": product.video_url or "", "cat": product.category.name, "b": product.brand,
+        "sz": [size or "" for size in sizes], "m": rows,
+    }
+
+
+def output_tokens(value) -> int:
+    # same 1 token ≈ 4 characters estimate as extraction.estimate_tokens, on compact JSON like the model writes
+    return len(json.dumps(value, separators=(",", ":"), ensure_ascii=False)) // 4
+
+
+#report: output tokens of Product vs the wire format for the products in products.json
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Output tokens of the Product schema vs the wire schema")
+    parser.add_argument("--products", default="products.json")
+    parser.add_argument("--ms-per-token", type=float, default=5, help="generation speed for the latency column")
+    args = parser.parse_args()
+
+    with open(args.products, "r", encoding="utf-8") as f:
+        products = [Product.model_validate(p) for p in json.load(f)]
+    print(f"{'Product':<40} {'Variants':>9} {'Product':>9} {'Wire':>7} {'Saved':>7} {'Gen. ms saved':>14}")
+    before = after = 0
+    for product in products:
+        full = output_tokens(product.model_dump(mode="json"))
+        wire = output_tokens(to_wire(product))
+        before += full
+        after += wire
+        print(f"{product.name[:40]:<40} {len(product.variants):>9} {full:>8}t {wire:>6}t {1 - wire / full:>7.0%} "
+              f"{(full - wire) * args.ms_per_token:>14,.0f}")
+    print(f"{'TOTAL':<40} {'':>9} {before:>8}t {after:>6}t {1 - after / before:>7.0%} "
+          f"{(before - after) * args.ms_per_token:>14,.0f}")